@@ -45,4 +45,844 @@ DELIMITER ;
 select * from movement;
 select * from health_record;
 select * from interaction;
-select * from species;
\ No newline at end of file
+select * from species;
+
+-- Per-species activity rollup read by the dashboards instead of joining
+-- species with movement, health_record and interaction on every render.
+CREATE TABLE species_activity_summary (
+    species_id INT PRIMARY KEY,
+    movement_count INT NOT NULL DEFAULT 0,
+    last_movement_at TIMESTAMP NULL,
+    health_record_count INT NOT NULL DEFAULT 0,
+    last_health_date DATE NULL,
+    latest_health_status VARCHAR(50),
+    latest_disease VARCHAR(255),
+    interaction_count INT NOT NULL DEFAULT 0,
+    last_interaction_date DATE NULL,
+    latest_incident_type VARCHAR(100),
+    FOREIGN KEY (species_id) REFERENCES species(species_id) ON DELETE CASCADE
+);
+
+-- Lets the triggers below find a species' latest fix without reading all of its fixes
+ALTER TABLE movement ADD INDEX idx_movement_species_timestamp (species_id, timestamp);
+
+DELIMITER $$
+
+-- Recomputes one species' rollup row with indexed lookups on species_id,
+-- e.g. to repair it after writes made with the triggers disabled.
+CREATE PROCEDURE refresh_species_activity(IN sid INT)
+BEGIN
+    REPLACE INTO species_activity_summary
+    SELECT
+        sid,
+        (SELECT COUNT(*) FROM movement WHERE species_id = sid),
+        (SELECT MAX(timestamp) FROM movement WHERE species_id = sid),
+        (SELECT COUNT(*) FROM health_record WHERE species_id = sid),
+        (SELECT MAX(date_recorded) FROM health_record WHERE species_id = sid),
+        (SELECT health_status FROM health_record WHERE species_id = sid
+            ORDER BY date_recorded DESC, health_record_id DESC LIMIT 1),
+        (SELECT disease FROM health_record WHERE species_id = sid
+            ORDER BY date_recorded DESC, health_record_id DESC LIMIT 1),
+        (SELECT COUNT(*) FROM interaction WHERE species_id = sid),
+        (SELECT MAX(date_recorded) FROM interaction WHERE species_id = sid),
+        (SELECT incident_type FROM interaction WHERE species_id = sid
+            ORDER BY date_recorded DESC, interaction_id DESC LIMIT 1);
+END $$
+
+-- Rebuilds the whole rollup. Each child table is aggregated on its own,
+-- so there is no movement x health x interaction fan-out.
+CREATE PROCEDURE refresh_species_activity_summary()
+BEGIN
+    DELETE FROM species_activity_summary;
+    INSERT INTO species_activity_summary
+    SELECT
+        sp.species_id,
+        COALESCE(m.movement_count, 0),
+        m.last_movement_at,
+        COALESCE(h.health_record_count, 0),
+        h.last_health_date,
+        h.health_status,
+        h.disease,
+        COALESCE(i.interaction_count, 0),
+        i.last_interaction_date,
+        i.incident_type
+    FROM species sp
+    LEFT JOIN (
+        SELECT species_id, COUNT(*) AS movement_count, MAX(timestamp) AS last_movement_at
+        FROM movement GROUP BY species_id
+    ) m ON m.species_id = sp.species_id
+    LEFT JOIN (
+        SELECT species_id, health_record_count, date_recorded AS last_health_date, health_status, disease
+        FROM (
+            SELECT species_id, date_recorded, health_status, disease,
+                   COUNT(*) OVER (PARTITION BY species_id) AS health_record_count,
+                   ROW_NUMBER() OVER (PARTITION BY species_id ORDER BY date_recorded DESC, health_record_id DESC) AS rn
+            FROM health_record
+        ) ranked WHERE rn = 1
+    ) h ON h.species_id = sp.species_id
+    LEFT JOIN (
+        SELECT species_id, interaction_count, date_recorded AS last_interaction_date, incident_type
+        FROM (
+            SELECT species_id, date_recorded, incident_type,
+                   COUNT(*) OVER (PARTITION BY species_id) AS interaction_count,
+                   ROW_NUMBER() OVER (PARTITION BY species_id ORDER BY date_recorded DESC, interaction_id DESC) AS rn
+            FROM interaction
+        ) ranked WHERE rn = 1
+    ) i ON i.species_id = sp.species_id;
+END $$
+
+-- Every write updates the rollup in place. Counts move by one; the "latest"
+-- columns are recomputed only when the row removed or changed was the latest
+-- one, so editing or deleting older rows never aggregates a species' history.
+CREATE PROCEDURE summary_add_movement(IN sid INT, IN ts TIMESTAMP)
+BEGIN
+    INSERT INTO species_activity_summary (species_id, movement_count, last_movement_at)
+    VALUES (sid, 1, ts)
+    ON DUPLICATE KEY UPDATE
+        movement_count = movement_count + 1,
+        last_movement_at = CASE WHEN last_movement_at IS NULL OR ts > last_movement_at
+                                THEN ts ELSE last_movement_at END;
+END $$
+
+CREATE PROCEDURE summary_remove_movement(IN sid INT, IN ts TIMESTAMP)
+BEGIN
+    UPDATE species_activity_summary SET movement_count = movement_count - 1 WHERE species_id = sid;
+    IF ts >= (SELECT last_movement_at FROM species_activity_summary WHERE species_id = sid) THEN
+        UPDATE species_activity_summary
+        SET last_movement_at = (SELECT MAX(timestamp) FROM movement WHERE species_id = sid)
+        WHERE species_id = sid;
+    END IF;
+END $$
+
+CREATE PROCEDURE summary_add_health_record(IN sid INT, IN d DATE, IN status VARCHAR(50), IN dis VARCHAR(255))
+BEGIN
+    INSERT INTO species_activity_summary
+        (species_id, health_record_count, last_health_date, latest_health_status, latest_disease)
+    VALUES (sid, 1, d, status, dis)
+    ON DUPLICATE KEY UPDATE
+        health_record_count = health_record_count + 1,
+        latest_health_status = IF(last_health_date IS NULL OR d >= last_health_date, status, latest_health_status),
+        latest_disease = IF(last_health_date IS NULL OR d >= last_health_date, dis, latest_disease),
+        last_health_date = IF(last_health_date IS NULL OR d >= last_health_date, d, last_health_date);
+END $$
+
+CREATE PROCEDURE summary_remove_health_record(IN sid INT, IN d DATE)
+BEGIN
+    UPDATE species_activity_summary SET health_record_count = health_record_count - 1 WHERE species_id = sid;
+    IF d >= (SELECT last_health_date FROM species_activity_summary WHERE species_id = sid) THEN
+        UPDATE species_activity_summary sa
+        LEFT JOIN (
+            SELECT species_id, date_recorded, health_status, disease FROM health_record
+            WHERE species_id = sid ORDER BY date_recorded DESC, health_record_id DESC LIMIT 1
+        ) latest ON latest.species_id = sa.species_id
+        SET sa.last_health_date = latest.date_recorded,
+            sa.latest_health_status = latest.health_status,
+            sa.latest_disease = latest.disease
+        WHERE sa.species_id = sid;
+    END IF;
+END $$
+
+CREATE PROCEDURE summary_add_interaction(IN sid INT, IN d DATE, IN incident VARCHAR(100))
+BEGIN
+    INSERT INTO species_activity_summary
+        (species_id, interaction_count, last_interaction_date, latest_incident_type)
+    VALUES (sid, 1, d, incident)
+    ON DUPLICATE KEY UPDATE
+        interaction_count = interaction_count + 1,
+        latest_incident_type = IF(last_interaction_date IS NULL OR d >= last_interaction_date,
+                                  incident, latest_incident_type),
+        last_interaction_date = IF(last_interaction_date IS NULL OR d >= last_interaction_date,
+                                   d, last_interaction_date);
+END $$
+
+CREATE PROCEDURE summary_remove_interaction(IN sid INT, IN d DATE)
+BEGIN
+    UPDATE species_activity_summary SET interaction_count = interaction_count - 1 WHERE species_id = sid;
+    IF d >= (SELECT last_interaction_date FROM species_activity_summary WHERE species_id = sid) THEN
+        UPDATE species_activity_summary sa
+        LEFT JOIN (
+            SELECT species_id, date_recorded, incident_type FROM interaction
+            WHERE species_id = sid ORDER BY date_recorded DESC, interaction_id DESC LIMIT 1
+        ) latest ON latest.species_id = sa.species_id
+        SET sa.last_interaction_date = latest.date_recorded,
+            sa.latest_incident_type = latest.incident_type
+        WHERE sa.species_id = sid;
+    END IF;
+END $$
+
+-- Inserts are the hot path (collar fixes).
+CREATE TRIGGER after_movement_insert
+AFTER INSERT ON movement
+FOR EACH ROW
+BEGIN
+    IF NEW.species_id IS NOT NULL THEN
+        CALL summary_add_movement(NEW.species_id, NEW.timestamp);
+    END IF;
+END$$
+
+-- An update is a remove of the old row and an add of the new one, skipped
+-- when none of the columns the rollup reads changed.
+CREATE TRIGGER after_movement_update
+AFTER UPDATE ON movement
+FOR EACH ROW
+BEGIN
+    IF NOT (NEW.species_id <=> OLD.species_id AND NEW.timestamp <=> OLD.timestamp) THEN
+        IF OLD.species_id IS NOT NULL THEN
+            CALL summary_remove_movement(OLD.species_id, OLD.timestamp);
+        END IF;
+        IF NEW.species_id IS NOT NULL THEN
+            CALL summary_add_movement(NEW.species_id, NEW.timestamp);
+        END IF;
+    END IF;
+END$$
+
+CREATE TRIGGER after_movement_delete
+AFTER DELETE ON movement
+FOR EACH ROW
+BEGIN
+    IF OLD.species_id IS NOT NULL THEN
+        CALL summary_remove_movement(OLD.species_id, OLD.timestamp);
+    END IF;
+END$$
+
+CREATE TRIGGER after_health_record_insert
+AFTER INSERT ON health_record
+FOR EACH ROW
+BEGIN
+    IF NEW.species_id IS NOT NULL THEN
+        CALL summary_add_health_record(NEW.species_id, NEW.date_recorded, NEW.health_status, NEW.disease);
+    END IF;
+END$$
+
+CREATE TRIGGER after_health_record_update
+AFTER UPDATE ON health_record
+FOR EACH ROW
+BEGIN
+    IF NOT (NEW.species_id <=> OLD.species_id AND NEW.date_recorded <=> OLD.date_recorded
+            AND NEW.health_status <=> OLD.health_status AND NEW.disease <=> OLD.disease) THEN
+        IF OLD.species_id IS NOT NULL THEN
+            CALL summary_remove_health_record(OLD.species_id, OLD.date_recorded);
+        END IF;
+        IF NEW.species_id IS NOT NULL THEN
+            CALL summary_add_health_record(NEW.species_id, NEW.date_recorded, NEW.health_status, NEW.disease);
+        END IF;
+    END IF;
+END$$
+
+CREATE TRIGGER after_health_record_delete
+AFTER DELETE ON health_record
+FOR EACH ROW
+BEGIN
+    IF OLD.species_id IS NOT NULL THEN
+        CALL summary_remove_health_record(OLD.species_id, OLD.date_recorded);
+    END IF;
+END$$
+
+CREATE TRIGGER after_interaction_insert
+AFTER INSERT ON interaction
+FOR EACH ROW
+BEGIN
+    IF NEW.species_id IS NOT NULL THEN
+        CALL summary_add_interaction(NEW.species_id, NEW.date_recorded, NEW.incident_type);
+    END IF;
+END$$
+
+CREATE TRIGGER after_interaction_update
+AFTER UPDATE ON interaction
+FOR EACH ROW
+BEGIN
+    IF NOT (NEW.species_id <=> OLD.species_id AND NEW.date_recorded <=> OLD.date_recorded
+            AND NEW.incident_type <=> OLD.incident_type) THEN
+        IF OLD.species_id IS NOT NULL THEN
+            CALL summary_remove_interaction(OLD.species_id, OLD.date_recorded);
+        END IF;
+        IF NEW.species_id IS NOT NULL THEN
+            CALL summary_add_interaction(NEW.species_id, NEW.date_recorded, NEW.incident_type);
+        END IF;
+    END IF;
+END$$
+
+CREATE TRIGGER after_interaction_delete
+AFTER DELETE ON interaction
+FOR EACH ROW
+BEGIN
+    IF OLD.species_id IS NOT NULL THEN
+        CALL summary_remove_interaction(OLD.species_id, OLD.date_recorded);
+    END IF;
+END$$
+
+DELIMITER ;
+
+CALL refresh_species_activity_summary();
+
+-- Spatial index over movement fixes. POINT(x, y) is (longitude, latitude) in
+-- SRID 0; distances are computed with ST_Distance_Sphere. Fixes without
+-- coordinates map to POINT(0 0) and are filtered out by the queries in spatial.py.
+ALTER TABLE movement
+ADD COLUMN position POINT GENERATED ALWAYS AS (POINT(COALESCE(longitude, 0), COALESCE(latitude, 0))) STORED SRID 0 NOT NULL,
+ADD SPATIAL INDEX idx_movement_position (position);
+
+-- Daily per-species track rollup backing the coarse (day/week) resolutions in tracks.py.
+-- Sums are kept instead of averages so inserts can update a bucket in place.
+CREATE TABLE movement_track_daily (
+    species_id INT NOT NULL,
+    day DATE NOT NULL,
+    fix_count INT NOT NULL DEFAULT 0,
+    latitude_sum DOUBLE NOT NULL DEFAULT 0,
+    longitude_sum DOUBLE NOT NULL DEFAULT 0,
+    first_fix_at TIMESTAMP NULL,
+    last_fix_at TIMESTAMP NULL,
+    PRIMARY KEY (species_id, day),
+    FOREIGN KEY (species_id) REFERENCES species(species_id) ON DELETE CASCADE
+);
+
+DELIMITER $$
+
+CREATE PROCEDURE refresh_movement_track_day(IN sid INT, IN d DATE)
+BEGIN
+    DELETE FROM movement_track_daily WHERE species_id = sid AND day = d;
+    INSERT INTO movement_track_daily
+    SELECT species_id, DATE(timestamp), COUNT(*), SUM(latitude), SUM(longitude), MIN(timestamp), MAX(timestamp)
+    FROM movement
+    WHERE species_id = sid AND timestamp >= d AND timestamp < d + INTERVAL 1 DAY
+      AND latitude IS NOT NULL AND longitude IS NOT NULL
+    GROUP BY species_id, DATE(timestamp);
+END $$
+
+CREATE PROCEDURE refresh_movement_track_daily()
+BEGIN
+    DELETE FROM movement_track_daily;
+    INSERT INTO movement_track_daily
+    SELECT species_id, DATE(timestamp), COUNT(*), SUM(latitude), SUM(longitude), MIN(timestamp), MAX(timestamp)
+    FROM movement
+    WHERE species_id IS NOT NULL AND timestamp IS NOT NULL
+      AND latitude IS NOT NULL AND longitude IS NOT NULL
+    GROUP BY species_id, DATE(timestamp);
+END $$
+
+CREATE TRIGGER after_movement_insert_track
+AFTER INSERT ON movement
+FOR EACH ROW FOLLOWS after_movement_insert
+BEGIN
+    IF NEW.species_id IS NOT NULL AND NEW.timestamp IS NOT NULL
+       AND NEW.latitude IS NOT NULL AND NEW.longitude IS NOT NULL THEN
+        INSERT INTO movement_track_daily
+            (species_id, day, fix_count, latitude_sum, longitude_sum, first_fix_at, last_fix_at)
+        VALUES (NEW.species_id, DATE(NEW.timestamp), 1, NEW.latitude, NEW.longitude, NEW.timestamp, NEW.timestamp)
+        ON DUPLICATE KEY UPDATE
+            fix_count = fix_count + 1,
+            latitude_sum = latitude_sum + NEW.latitude,
+            longitude_sum = longitude_sum + NEW.longitude,
+            first_fix_at = LEAST(first_fix_at, NEW.timestamp),
+            last_fix_at = GREATEST(last_fix_at, NEW.timestamp);
+    END IF;
+END$$
+
+CREATE TRIGGER after_movement_update_track
+AFTER UPDATE ON movement
+FOR EACH ROW FOLLOWS after_movement_update
+BEGIN
+    IF OLD.species_id IS NOT NULL AND OLD.timestamp IS NOT NULL THEN
+        CALL refresh_movement_track_day(OLD.species_id, DATE(OLD.timestamp));
+    END IF;
+    IF NEW.species_id IS NOT NULL AND NEW.timestamp IS NOT NULL
+       AND NOT (NEW.species_id <=> OLD.species_id AND DATE(NEW.timestamp) <=> DATE(OLD.timestamp)) THEN
+        CALL refresh_movement_track_day(NEW.species_id, DATE(NEW.timestamp));
+    END IF;
+END$$
+
+CREATE TRIGGER after_movement_delete_track
+AFTER DELETE ON movement
+FOR EACH ROW FOLLOWS after_movement_delete
+BEGIN
+    IF OLD.species_id IS NOT NULL AND OLD.timestamp IS NOT NULL THEN
+        CALL refresh_movement_track_day(OLD.species_id, DATE(OLD.timestamp));
+    END IF;
+END$$
+
+DELIMITER ;
+
+CALL refresh_movement_track_daily();
+
+-- Exact row counts kept up to date by triggers, so counting a table never
+-- scans it. TRUNCATE does not fire triggers; run refresh_table_row_counts() after one.
+-- A table's count is the sum of its slot rows. Tables written on every ingest
+-- (movement, and audit_log through the change feed triggers) spread their
+-- counter over 16 slots picked by connection, so concurrent writers do not
+-- queue on one row lock; the others only use slot 0.
+CREATE TABLE table_row_counts (
+    table_name VARCHAR(64) NOT NULL,
+    slot TINYINT UNSIGNED NOT NULL DEFAULT 0,
+    row_count BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (table_name, slot)
+);
+
+DELIMITER $$
+
+CREATE PROCEDURE refresh_table_row_counts()
+BEGIN
+    DELETE FROM table_row_counts;
+    INSERT INTO table_row_counts (table_name, row_count)
+    SELECT 'habitat', COUNT(*) FROM habitat
+    UNION ALL
+    SELECT 'species', COUNT(*) FROM species
+    UNION ALL
+    SELECT 'movement', COUNT(*) FROM movement
+    UNION ALL
+    SELECT 'health_record', COUNT(*) FROM health_record
+    UNION ALL
+    SELECT 'interaction', COUNT(*) FROM interaction
+    UNION ALL
+    SELECT 'users', COUNT(*) FROM users
+    UNION ALL
+    SELECT 'report', COUNT(*) FROM report
+    UNION ALL
+    SELECT 'made_on', COUNT(*) FROM made_on
+    UNION ALL
+    SELECT 'resides_in', COUNT(*) FROM resides_in
+    UNION ALL
+    SELECT 'audit_log', COUNT(*) FROM audit_log;
+END $$
+
+CREATE TRIGGER after_habitat_insert_count
+AFTER INSERT ON habitat
+FOR EACH ROW
+BEGIN
+    UPDATE table_row_counts SET row_count = row_count + 1 WHERE table_name = 'habitat';
+END$$
+
+CREATE TRIGGER after_habitat_delete_count
+AFTER DELETE ON habitat
+FOR EACH ROW
+BEGIN
+    UPDATE table_row_counts SET row_count = row_count - 1 WHERE table_name = 'habitat';
+END$$
+
+CREATE TRIGGER after_species_insert_count
+AFTER INSERT ON species
+FOR EACH ROW
+BEGIN
+    UPDATE table_row_counts SET row_count = row_count + 1 WHERE table_name = 'species';
+END$$
+
+CREATE TRIGGER after_species_delete_count
+AFTER DELETE ON species
+FOR EACH ROW
+BEGIN
+    UPDATE table_row_counts SET row_count = row_count - 1 WHERE table_name = 'species';
+END$$
+
+CREATE TRIGGER after_movement_insert_count
+AFTER INSERT ON movement
+FOR EACH ROW
+BEGIN
+    INSERT INTO table_row_counts (table_name, slot, row_count) VALUES ('movement', CONNECTION_ID() % 16, 1)
+    ON DUPLICATE KEY UPDATE row_count = row_count + 1;
+END$$
+
+CREATE TRIGGER after_movement_delete_count
+AFTER DELETE ON movement
+FOR EACH ROW
+BEGIN
+    INSERT INTO table_row_counts (table_name, slot, row_count) VALUES ('movement', CONNECTION_ID() % 16, -1)
+    ON DUPLICATE KEY UPDATE row_count = row_count - 1;
+END$$
+
+CREATE TRIGGER after_health_record_insert_count
+AFTER INSERT ON health_record
+FOR EACH ROW
+BEGIN
+    UPDATE table_row_counts SET row_count = row_count + 1 WHERE table_name = 'health_record';
+END$$
+
+CREATE TRIGGER after_health_record_delete_count
+AFTER DELETE ON health_record
+FOR EACH ROW
+BEGIN
+    UPDATE table_row_counts SET row_count = row_count - 1 WHERE table_name = 'health_record';
+END$$
+
+CREATE TRIGGER after_interaction_insert_count
+AFTER INSERT ON interaction
+FOR EACH ROW
+BEGIN
+    UPDATE table_row_counts SET row_count = row_count + 1 WHERE table_name = 'interaction';
+END$$
+
+CREATE TRIGGER after_interaction_delete_count
+AFTER DELETE ON interaction
+FOR EACH ROW
+BEGIN
+    UPDATE table_row_counts SET row_count = row_count - 1 WHERE table_name = 'interaction';
+END$$
+
+CREATE TRIGGER after_users_insert_count
+AFTER INSERT ON users
+FOR EACH ROW
+BEGIN
+    UPDATE table_row_counts SET row_count = row_count + 1 WHERE table_name = 'users';
+END$$
+
+CREATE TRIGGER after_users_delete_count
+AFTER DELETE ON users
+FOR EACH ROW
+BEGIN
+    UPDATE table_row_counts SET row_count = row_count - 1 WHERE table_name = 'users';
+END$$
+
+CREATE TRIGGER after_report_insert_count
+AFTER INSERT ON report
+FOR EACH ROW
+BEGIN
+    UPDATE table_row_counts SET row_count = row_count + 1 WHERE table_name = 'report';
+END$$
+
+CREATE TRIGGER after_report_delete_count
+AFTER DELETE ON report
+FOR EACH ROW
+BEGIN
+    UPDATE table_row_counts SET row_count = row_count - 1 WHERE table_name = 'report';
+END$$
+
+CREATE TRIGGER after_made_on_insert_count
+AFTER INSERT ON made_on
+FOR EACH ROW
+BEGIN
+    UPDATE table_row_counts SET row_count = row_count + 1 WHERE table_name = 'made_on';
+END$$
+
+CREATE TRIGGER after_made_on_delete_count
+AFTER DELETE ON made_on
+FOR EACH ROW
+BEGIN
+    UPDATE table_row_counts SET row_count = row_count - 1 WHERE table_name = 'made_on';
+END$$
+
+CREATE TRIGGER after_resides_in_insert_count
+AFTER INSERT ON resides_in
+FOR EACH ROW
+BEGIN
+    UPDATE table_row_counts SET row_count = row_count + 1 WHERE table_name = 'resides_in';
+END$$
+
+CREATE TRIGGER after_resides_in_delete_count
+AFTER DELETE ON resides_in
+FOR EACH ROW
+BEGIN
+    UPDATE table_row_counts SET row_count = row_count - 1 WHERE table_name = 'resides_in';
+END$$
+
+CREATE TRIGGER after_audit_log_insert_count
+AFTER INSERT ON audit_log
+FOR EACH ROW
+BEGIN
+    INSERT INTO table_row_counts (table_name, slot, row_count) VALUES ('audit_log', CONNECTION_ID() % 16, 1)
+    ON DUPLICATE KEY UPDATE row_count = row_count + 1;
+END$$
+
+CREATE TRIGGER after_audit_log_delete_count
+AFTER DELETE ON audit_log
+FOR EACH ROW
+BEGIN
+    INSERT INTO table_row_counts (table_name, slot, row_count) VALUES ('audit_log', CONNECTION_ID() % 16, -1)
+    ON DUPLICATE KEY UPDATE row_count = row_count - 1;
+END$$
+
+DELIMITER ;
+
+CALL refresh_table_row_counts();
+
+
+-- Change feed: every insert, update and delete on the tables the dashboards
+-- show writes one compact row (table, operation, key) to audit_log, so
+-- readers can fetch only what changed since the last audit_log.id they saw.
+-- Species inserts are already logged by after_species_insert above. The link
+-- tables made_on and resides_in have composite keys and are not in the feed.
+-- Each reader's watermark is kept in change_feed_consumers so consumed
+-- entries can be compacted away (see changefeed.py).
+CREATE TABLE change_feed_consumers (
+    consumer VARCHAR(64) PRIMARY KEY,
+    watermark BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+);
+
+DELIMITER $$
+
+CREATE TRIGGER after_habitat_insert_audit
+AFTER INSERT ON habitat
+FOR EACH ROW
+BEGIN
+    INSERT INTO audit_log (table_name, operation, record_id) VALUES ('habitat', 'INSERT', NEW.habitat_id);
+END$$
+
+CREATE TRIGGER after_habitat_update_audit
+AFTER UPDATE ON habitat
+FOR EACH ROW
+BEGIN
+    IF NEW.habitat_id <> OLD.habitat_id THEN
+        INSERT INTO audit_log (table_name, operation, record_id) VALUES ('habitat', 'DELETE', OLD.habitat_id);
+    END IF;
+    INSERT INTO audit_log (table_name, operation, record_id) VALUES ('habitat', 'UPDATE', NEW.habitat_id);
+END$$
+
+CREATE TRIGGER after_habitat_delete_audit
+AFTER DELETE ON habitat
+FOR EACH ROW
+BEGIN
+    INSERT INTO audit_log (table_name, operation, record_id) VALUES ('habitat', 'DELETE', OLD.habitat_id);
+END$$
+
+CREATE TRIGGER after_species_update_audit
+AFTER UPDATE ON species
+FOR EACH ROW
+BEGIN
+    IF NEW.species_id <> OLD.species_id THEN
+        INSERT INTO audit_log (table_name, operation, record_id) VALUES ('species', 'DELETE', OLD.species_id);
+    END IF;
+    INSERT INTO audit_log (table_name, operation, record_id) VALUES ('species', 'UPDATE', NEW.species_id);
+END$$
+
+CREATE TRIGGER after_species_delete_audit
+AFTER DELETE ON species
+FOR EACH ROW
+BEGIN
+    INSERT INTO audit_log (table_name, operation, record_id) VALUES ('species', 'DELETE', OLD.species_id);
+END$$
+
+CREATE TRIGGER after_movement_insert_audit
+AFTER INSERT ON movement
+FOR EACH ROW
+BEGIN
+    INSERT INTO audit_log (table_name, operation, record_id) VALUES ('movement', 'INSERT', NEW.movement_id);
+END$$
+
+CREATE TRIGGER after_movement_update_audit
+AFTER UPDATE ON movement
+FOR EACH ROW
+BEGIN
+    IF NEW.movement_id <> OLD.movement_id THEN
+        INSERT INTO audit_log (table_name, operation, record_id) VALUES ('movement', 'DELETE', OLD.movement_id);
+    END IF;
+    INSERT INTO audit_log (table_name, operation, record_id) VALUES ('movement', 'UPDATE', NEW.movement_id);
+END$$
+
+CREATE TRIGGER after_movement_delete_audit
+AFTER DELETE ON movement
+FOR EACH ROW
+BEGIN
+    INSERT INTO audit_log (table_name, operation, record_id) VALUES ('movement', 'DELETE', OLD.movement_id);
+END$$
+
+CREATE TRIGGER after_health_record_insert_audit
+AFTER INSERT ON health_record
+FOR EACH ROW
+BEGIN
+    INSERT INTO audit_log (table_name, operation, record_id) VALUES ('health_record', 'INSERT', NEW.health_record_id);
+END$$
+
+CREATE TRIGGER after_health_record_update_audit
+AFTER UPDATE ON health_record
+FOR EACH ROW
+BEGIN
+    IF NEW.health_record_id <> OLD.health_record_id THEN
+        INSERT INTO audit_log (table_name, operation, record_id) VALUES ('health_record', 'DELETE', OLD.health_record_id);
+    END IF;
+    INSERT INTO audit_log (table_name, operation, record_id) VALUES ('health_record', 'UPDATE', NEW.health_record_id);
+END$$
+
+CREATE TRIGGER after_health_record_delete_audit
+AFTER DELETE ON health_record
+FOR EACH ROW
+BEGIN
+    INSERT INTO audit_log (table_name, operation, record_id) VALUES ('health_record', 'DELETE', OLD.health_record_id);
+END$$
+
+CREATE TRIGGER after_interaction_insert_audit
+AFTER INSERT ON interaction
+FOR EACH ROW
+BEGIN
+    INSERT INTO audit_log (table_name, operation, record_id) VALUES ('interaction', 'INSERT', NEW.interaction_id);
+END$$
+
+CREATE TRIGGER after_interaction_update_audit
+AFTER UPDATE ON interaction
+FOR EACH ROW
+BEGIN
+    IF NEW.interaction_id <> OLD.interaction_id THEN
+        INSERT INTO audit_log (table_name, operation, record_id) VALUES ('interaction', 'DELETE', OLD.interaction_id);
+    END IF;
+    INSERT INTO audit_log (table_name, operation, record_id) VALUES ('interaction', 'UPDATE', NEW.interaction_id);
+END$$
+
+CREATE TRIGGER after_interaction_delete_audit
+AFTER DELETE ON interaction
+FOR EACH ROW
+BEGIN
+    INSERT INTO audit_log (table_name, operation, record_id) VALUES ('interaction', 'DELETE', OLD.interaction_id);
+END$$
+
+CREATE TRIGGER after_report_insert_audit
+AFTER INSERT ON report
+FOR EACH ROW
+BEGIN
+    INSERT INTO audit_log (table_name, operation, record_id) VALUES ('report', 'INSERT', NEW.report_id);
+END$$
+
+CREATE TRIGGER after_report_update_audit
+AFTER UPDATE ON report
+FOR EACH ROW
+BEGIN
+    IF NEW.report_id <> OLD.report_id THEN
+        INSERT INTO audit_log (table_name, operation, record_id) VALUES ('report', 'DELETE', OLD.report_id);
+    END IF;
+    INSERT INTO audit_log (table_name, operation, record_id) VALUES ('report', 'UPDATE', NEW.report_id);
+END$$
+
+CREATE TRIGGER after_report_delete_audit
+AFTER DELETE ON report
+FOR EACH ROW
+BEGIN
+    INSERT INTO audit_log (table_name, operation, record_id) VALUES ('report', 'DELETE', OLD.report_id);
+END$$
+
+CREATE TRIGGER after_users_insert_audit
+AFTER INSERT ON users
+FOR EACH ROW
+BEGIN
+    INSERT INTO audit_log (table_name, operation, record_id) VALUES ('users', 'INSERT', NEW.user_id);
+END$$
+
+CREATE TRIGGER after_users_update_audit
+AFTER UPDATE ON users
+FOR EACH ROW
+BEGIN
+    IF NEW.user_id <> OLD.user_id THEN
+        INSERT INTO audit_log (table_name, operation, record_id) VALUES ('users', 'DELETE', OLD.user_id);
+    END IF;
+    INSERT INTO audit_log (table_name, operation, record_id) VALUES ('users', 'UPDATE', NEW.user_id);
+END$$
+
+CREATE TRIGGER after_users_delete_audit
+AFTER DELETE ON users
+FOR EACH ROW
+BEGIN
+    INSERT INTO audit_log (table_name, operation, record_id) VALUES ('users', 'DELETE', OLD.user_id);
+END$$
+
+DELIMITER ;
+
+-- Monthly range partitions for the append-only movement and audit_log tables
+-- (the partitions themselves are created and archived by partitions.py).
+-- MySQL partitioned tables cannot hold spatial columns or foreign keys, and
+-- the partitioning column must be part of the primary key, so:
+--   * movement.position and its SPATIAL index move to movement_position,
+--     kept in step by triggers;
+--   * movement loses its foreign key to species, which the triggers below
+--     enforce instead (and ingest.py checks before loading);
+--   * both primary keys gain the time column, which becomes NOT NULL.
+CREATE TABLE movement_position (
+    movement_id INT PRIMARY KEY,
+    timestamp TIMESTAMP NOT NULL,
+    position POINT SRID 0 NOT NULL,
+    SPATIAL INDEX idx_movement_position (position),
+    KEY idx_movement_position_time (timestamp)
+);
+
+INSERT INTO movement_position (movement_id, timestamp, position)
+SELECT movement_id, COALESCE(timestamp, FROM_UNIXTIME(1)), position FROM movement;
+
+ALTER TABLE movement
+DROP INDEX idx_movement_position,
+DROP COLUMN position,
+DROP FOREIGN KEY movement_ibfk_1;
+
+-- Fixes without a time get a placeholder; partitions.py keeps them in one p_before partition
+UPDATE movement SET timestamp = FROM_UNIXTIME(1) WHERE timestamp IS NULL;
+
+ALTER TABLE movement
+MODIFY timestamp TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+DROP PRIMARY KEY,
+ADD PRIMARY KEY (movement_id, timestamp);
+
+UPDATE audit_log SET changed_at = FROM_UNIXTIME(1) WHERE changed_at IS NULL;
+
+ALTER TABLE audit_log
+MODIFY changed_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+DROP PRIMARY KEY,
+ADD PRIMARY KEY (id, changed_at);
+
+DELIMITER $$
+
+CREATE TRIGGER before_movement_insert_species
+BEFORE INSERT ON movement
+FOR EACH ROW
+BEGIN
+    IF NEW.species_id IS NOT NULL AND NOT EXISTS (SELECT 1 FROM species WHERE species_id = NEW.species_id) THEN
+        SIGNAL SQLSTATE '23000' SET MESSAGE_TEXT = 'movement.species_id does not match any species';
+    END IF;
+END$$
+
+CREATE TRIGGER before_movement_update_species
+BEFORE UPDATE ON movement
+FOR EACH ROW
+BEGIN
+    IF NEW.species_id IS NOT NULL AND NOT (NEW.species_id <=> OLD.species_id)
+       AND NOT EXISTS (SELECT 1 FROM species WHERE species_id = NEW.species_id) THEN
+        SIGNAL SQLSTATE '23000' SET MESSAGE_TEXT = 'movement.species_id does not match any species';
+    END IF;
+END$$
+
+CREATE TRIGGER before_species_delete_movement
+BEFORE DELETE ON species
+FOR EACH ROW
+BEGIN
+    IF EXISTS (SELECT 1 FROM movement WHERE species_id = OLD.species_id) THEN
+        SIGNAL SQLSTATE '23000' SET MESSAGE_TEXT = 'Cannot delete a species that still has movement rows';
+    END IF;
+END$$
+
+CREATE TRIGGER before_species_update_movement
+BEFORE UPDATE ON species
+FOR EACH ROW
+BEGIN
+    IF NEW.species_id <> OLD.species_id AND EXISTS (SELECT 1 FROM movement WHERE species_id = OLD.species_id) THEN
+        SIGNAL SQLSTATE '23000' SET MESSAGE_TEXT = 'Cannot renumber a species that still has movement rows';
+    END IF;
+END$$
+
+CREATE TRIGGER after_movement_insert_position
+AFTER INSERT ON movement
+FOR EACH ROW
+BEGIN
+    INSERT INTO movement_position (movement_id, timestamp, position)
+    VALUES (NEW.movement_id, NEW.timestamp, POINT(COALESCE(NEW.longitude, 0), COALESCE(NEW.latitude, 0)));
+END$$
+
+CREATE TRIGGER after_movement_update_position
+AFTER UPDATE ON movement
+FOR EACH ROW
+BEGIN
+    DELETE FROM movement_position WHERE movement_id = OLD.movement_id;
+    INSERT INTO movement_position (movement_id, timestamp, position)
+    VALUES (NEW.movement_id, NEW.timestamp, POINT(COALESCE(NEW.longitude, 0), COALESCE(NEW.latitude, 0)));
+END$$
+
+CREATE TRIGGER after_movement_delete_position
+AFTER DELETE ON movement
+FOR EACH ROW
+BEGIN
+    DELETE FROM movement_position WHERE movement_id = OLD.movement_id;
+END$$
+
+DELIMITER ;
+
+-- Full-text search (see search.py). Each index covers exactly the columns
+-- one MATCH() in search.py names. Set innodb_ft_min_token_size = 3 (the
+-- default) so short words such as "net" are indexed.
+ALTER TABLE interaction ADD FULLTEXT INDEX ft_interaction (incident_type, mitigation_efforts, location);
+ALTER TABLE habitat ADD FULLTEXT INDEX ft_habitat (name, location, environmental_attributes);
+ALTER TABLE species ADD FULLTEXT INDEX ft_species (common_name, scientific_name);
+
+-- Logins look users up by email (see auth.py). Existing plaintext passwords
+-- are replaced by salted hashes the next time each user logs in.
+ALTER TABLE users ADD UNIQUE INDEX idx_users_email (email);
@@ -0,0 +1,396 @@
+"""
+Home-range and habitat-usage analytics over movement fixes.
+
+For every species: minimum convex polygon (MCP) and kernel density (KDE)
+home-range areas, distance travelled per day and time spent in each of its
+habitats. Fixes for all species are read in one pass and processed with
+vectorized NumPy/pandas operations; only the hull and the KDE smoothing run
+per species, on small arrays.
+
+Results are kept per species in this process. The movement_track_daily
+rollup gives each species' fix count and latest fix cheaply, so a refresh
+only re-reads and recomputes the species whose fixes changed since the
+last run.
+"""
+import math
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+from scipy.ndimage import gaussian_filter
+from scipy.spatial import ConvexHull, QhullError
+
+from cache import cached_read_sql
+from partitions import read_range
+from spatial import EARTH_RADIUS_M
+
+# Share of fixes enclosed by the MCP and KDE home ranges
+HOME_RANGE_LEVEL = float(os.environ.get("WMCS_HOME_RANGE_LEVEL", 0.95))
+# Cells per side of each species' KDE grid
+KDE_GRID_SIZE = 64
+# Time after a fix that counts towards dwell time, at most; longer gaps are collar outages
+MAX_DWELL_GAP = pd.Timedelta(hours=6)
+
+HOME_RANGE_COLUMNS = ["species_id", "fix_count", "first_fix_at", "last_fix_at", "centroid_latitude",
+                      "centroid_longitude", "mcp_area_km2", "kde_area_km2", "mean_daily_distance_km"]
+DAILY_DISTANCE_COLUMNS = ["species_id", "day", "fix_count", "distance_km"]
+DWELL_COLUMNS = ["species_id", "habitat_id", "habitat_name", "fix_count", "dwell_hours", "dwell_share"]
+
+# Species-habitat pairs: resides_in plus each species' home habitat (species.habitat_id)
+RESIDENCES_QUERY = """
+    SELECT species_id, habitat_id FROM resides_in
+    UNION
+    SELECT species_id, habitat_id FROM species WHERE habitat_id IS NOT NULL
+"""
+
+_results = {}
+_results_lock = threading.Lock()
+
+
+def pairwise_haversine(lat1, lon1, lat2, lon2):
+    """Great-circle distance in metres between matching elements of coordinate arrays."""
+    lat1, lon1, lat2, lon2 = (np.radians(a) for a in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(a))
+
+
+def species_signatures():
+    """
+    Returns each species' fix count and latest fix time from the movement_track_daily rollup.
+
+    A species whose signature differs from the one its results were computed
+    from has new (or late, or archived-and-restored) fixes.
+    """
+    query = """
+        SELECT species_id, SUM(fix_count) AS fix_count, MIN(first_fix_at) AS first_fix_at,
+               MAX(last_fix_at) AS last_fix_at
+        FROM movement_track_daily
+        GROUP BY species_id
+    """
+    signatures = cached_read_sql(query, tables=["movement_track_daily"])
+    return {int(row.species_id): (int(row.fix_count), pd.Timestamp(row.first_fix_at), pd.Timestamp(row.last_fix_at))
+            for row in signatures.itertuples(index=False)}
+
+
+def habitat_positions():
+    """
+    Places each habitat on the map with a circular extent.
+
+    habitat only stores a place name and an area, so, like interaction
+    hotspots, a habitat's centre is the mean of its resident species' fixes
+    (from the daily rollup) and its extent a circle of area `area_size` km².
+
+    Returns:
+        DataFrame: habitat_id, name, latitude, longitude and radius_m.
+    """
+    query = f"""
+        SELECT r.habitat_id, h.name, h.area_size,
+               SUM(d.latitude_sum) / SUM(d.fix_count) AS latitude,
+               SUM(d.longitude_sum) / SUM(d.fix_count) AS longitude
+        FROM ({RESIDENCES_QUERY}) r
+        JOIN habitat h ON h.habitat_id = r.habitat_id
+        JOIN movement_track_daily d ON d.species_id = r.species_id
+        GROUP BY r.habitat_id, h.name, h.area_size
+    """
+    habitats = cached_read_sql(query, tables=["resides_in", "species", "habitat", "movement_track_daily"])
+    area_m2 = pd.to_numeric(habitats["area_size"]).astype(np.float64).fillna(0) * 1e6
+    return pd.DataFrame({
+        "habitat_id": habitats["habitat_id"].astype("Int32"),
+        "name": habitats["name"],
+        "latitude": pd.to_numeric(habitats["latitude"]).astype(np.float64),
+        "longitude": pd.to_numeric(habitats["longitude"]).astype(np.float64),
+        "radius_m": np.sqrt(area_m2 / math.pi),
+    })
+
+
+def residences():
+    """Returns every (species_id, habitat_id) pair; see RESIDENCES_QUERY."""
+    return cached_read_sql(RESIDENCES_QUERY, tables=["resides_in", "species"])
+
+
+def _project(fixes):
+    """Adds x/y metres on a local equirectangular projection centred on each species' centroid."""
+    groups = fixes.groupby("species_id", sort=False)
+    lat0 = groups["latitude"].transform("mean").to_numpy()
+    lon0 = groups["longitude"].transform("mean").to_numpy()
+    lats = fixes["latitude"].to_numpy()
+    lons = fixes["longitude"].to_numpy()
+    x = EARTH_RADIUS_M * np.radians(lons - lon0) * np.cos(np.radians(lat0))
+    y = EARTH_RADIUS_M * np.radians(lats - lat0)
+    return fixes.assign(x=x, y=y)
+
+
+def _hull_area(points):
+    if len(points) < 3:
+        return 0.0
+    try:
+        # For 2-D input qhull reports the enclosed area as the "volume"
+        return float(ConvexHull(points).volume)
+    except QhullError:
+        return 0.0
+
+
+def mcp_areas(fixes, level=HOME_RANGE_LEVEL):
+    """
+    Minimum convex polygon home-range area per species.
+
+    The `1 - level` share of fixes farthest from the species' centroid is left
+    out before taking the hull, the usual guard against excursions.
+
+    Args:
+        fixes (DataFrame): Projected fixes (species_id, x, y), see _project.
+        level (float): Share of fixes to enclose.
+
+    Returns:
+        Series: Area in km² indexed by species_id.
+    """
+    distance = np.hypot(fixes["x"].to_numpy(), fixes["y"].to_numpy())
+    rank = pd.Series(distance, index=fixes.index).groupby(fixes["species_id"]).rank(method="first", pct=True)
+    core = fixes[rank.to_numpy() <= level]
+    areas = {species_id: _hull_area(group[["x", "y"]].to_numpy())
+             for species_id, group in core.groupby("species_id", sort=True)}
+    return pd.Series(areas, dtype=np.float64).rename_axis("species_id") / 1e6
+
+
+def kde_areas(fixes, level=HOME_RANGE_LEVEL, grid_size=KDE_GRID_SIZE):
+    """
+    Kernel density home-range area per species.
+
+    Each species gets a grid_size x grid_size grid over its fixes padded by
+    three bandwidths. The fixes of every species are binned into one stacked
+    histogram with a single bincount, then each species' grid is smoothed with
+    a Gaussian of its reference bandwidth. The home range is the smallest set
+    of cells holding `level` of the density.
+
+    Args:
+        fixes (DataFrame): Projected fixes (species_id, x, y), see _project.
+        level (float): Share of the density the home range holds.
+        grid_size (int): Cells per grid side.
+
+    Returns:
+        Series: Area in km² indexed by species_id.
+    """
+    groups = fixes.groupby("species_id", sort=True)
+    stats = groups.agg(n=("x", "size"), sx=("x", "std"), sy=("y", "std"),
+                       min_x=("x", "min"), max_x=("x", "max"), min_y=("y", "min"), max_y=("y", "max"))
+    stats = stats[stats["n"] >= 3]
+    if stats.empty:
+        return pd.Series(dtype=np.float64).rename_axis("species_id")
+
+    # Reference bandwidth for a bivariate normal kernel
+    spread = np.sqrt((stats["sx"].fillna(0) ** 2 + stats["sy"].fillna(0) ** 2) / 2)
+    bandwidth = np.maximum(spread * stats["n"] ** (-1 / 6), 1.0)
+    origin_x = stats["min_x"] - 3 * bandwidth
+    origin_y = stats["min_y"] - 3 * bandwidth
+    cell_x = (stats["max_x"] + 3 * bandwidth - origin_x) / grid_size
+    cell_y = (stats["max_y"] + 3 * bandwidth - origin_y) / grid_size
+
+    fixes = fixes[fixes["species_id"].isin(stats.index)]
+    slot = pd.Series(np.arange(len(stats)), index=stats.index)
+    species = fixes["species_id"].to_numpy()
+    row = slot.reindex(species).to_numpy()
+    gx = np.clip(((fixes["x"].to_numpy() - origin_x.reindex(species).to_numpy())
+                  / cell_x.reindex(species).to_numpy()).astype(np.int64), 0, grid_size - 1)
+    gy = np.clip(((fixes["y"].to_numpy() - origin_y.reindex(species).to_numpy())
+                  / cell_y.reindex(species).to_numpy()).astype(np.int64), 0, grid_size - 1)
+    histograms = np.bincount((row * grid_size + gx) * grid_size + gy,
+                             minlength=len(stats) * grid_size * grid_size)
+    histograms = histograms.reshape(len(stats), grid_size, grid_size).astype(np.float64)
+
+    areas = np.empty(len(stats))
+    for i, (h, cx, cy) in enumerate(zip(bandwidth.to_numpy(), cell_x.to_numpy(), cell_y.to_numpy())):
+        density = gaussian_filter(histograms[i], sigma=(h / cx, h / cy), mode="constant", truncate=3.0)
+        ordered = np.sort(density.ravel())[::-1]
+        cumulative = np.cumsum(ordered)
+        cells = int(np.searchsorted(cumulative, level * cumulative[-1])) + 1
+        areas[i] = cells * cx * cy
+    return pd.Series(areas / 1e6, index=stats.index)
+
+
+def daily_distances(fixes):
+    """
+    Distance travelled per species and day.
+
+    Each leg between consecutive fixes of a species counts towards the day of
+    the fix it ends at.
+
+    Args:
+        fixes (DataFrame): species_id, timestamp, latitude and longitude, sorted by species and time.
+
+    Returns:
+        DataFrame: DAILY_DISTANCE_COLUMNS.
+    """
+    species = fixes["species_id"].to_numpy()
+    lats = fixes["latitude"].to_numpy()
+    lons = fixes["longitude"].to_numpy()
+    legs = np.zeros(len(fixes))
+    if len(fixes) > 1:
+        same = species[1:] == species[:-1]
+        legs[1:] = np.where(same, pairwise_haversine(lats[:-1], lons[:-1], lats[1:], lons[1:]), 0.0)
+    daily = (fixes.assign(day=fixes["timestamp"].dt.floor("D"), distance_km=legs / 1000)
+             .groupby(["species_id", "day"], sort=True)
+             .agg(fix_count=("distance_km", "size"), distance_km=("distance_km", "sum"))
+             .reset_index())
+    return daily[DAILY_DISTANCE_COLUMNS]
+
+
+def habitat_dwell(fixes, habitats, resides):
+    """
+    Time each species spent in each of its habitats.
+
+    Every fix is matched to the nearest of its species' habitats whose
+    circle contains it (see habitat_positions) and credited with the time
+    until the species' next fix, capped at MAX_DWELL_GAP. Fixes outside every
+    habitat are reported with a missing habitat_id.
+
+    Args:
+        fixes (DataFrame): species_id, timestamp, latitude and longitude, sorted by species and time.
+        habitats (DataFrame): As returned by habitat_positions.
+        resides (DataFrame): species_id, habitat_id pairs.
+
+    Returns:
+        DataFrame: DWELL_COLUMNS.
+    """
+    if fixes.empty:
+        return pd.DataFrame(columns=DWELL_COLUMNS)
+    species = fixes["species_id"].to_numpy()
+    times = fixes["timestamp"].to_numpy()
+    gaps = np.zeros(len(fixes), dtype="timedelta64[ns]")
+    if len(fixes) > 1:
+        same = species[1:] == species[:-1]
+        gaps[:-1] = np.where(same, times[1:] - times[:-1], np.timedelta64(0, "ns"))
+    gaps = np.minimum(gaps, MAX_DWELL_GAP.to_timedelta64())
+
+    # One row per (fix, candidate habitat), then keep the closest habitat containing the fix
+    located = fixes[["species_id", "latitude", "longitude"]].assign(fix=np.arange(len(fixes)))
+    candidates = located.merge(resides.astype({"species_id": "Int32", "habitat_id": "Int32"}), on="species_id")
+    candidates = candidates.merge(habitats, on="habitat_id", suffixes=("", "_habitat"))
+    distance = pairwise_haversine(candidates["latitude"].to_numpy(), candidates["longitude"].to_numpy(),
+                                  candidates["latitude_habitat"].to_numpy(), candidates["longitude_habitat"].to_numpy())
+    candidates = candidates.assign(distance=distance)[distance <= candidates["radius_m"].to_numpy()]
+    nearest = candidates.sort_values("distance").drop_duplicates("fix").set_index("fix")
+
+    habitat_id = nearest["habitat_id"].reindex(np.arange(len(fixes)))
+    dwell = (pd.DataFrame({"species_id": fixes["species_id"].to_numpy(), "habitat_id": habitat_id.to_numpy(),
+                           "dwell_hours": gaps / np.timedelta64(1, "h")})
+             .astype({"habitat_id": "Int32"})
+             .groupby(["species_id", "habitat_id"], dropna=False, sort=True)
+             .agg(fix_count=("dwell_hours", "size"), dwell_hours=("dwell_hours", "sum"))
+             .reset_index())
+    totals = dwell.groupby("species_id")["dwell_hours"].transform("sum")
+    dwell["dwell_share"] = (dwell["dwell_hours"] / totals.replace(0, np.nan)).fillna(0)
+    names = habitats.set_index("habitat_id")["name"]
+    dwell["habitat_name"] = dwell["habitat_id"].map(names)
+    return dwell[DWELL_COLUMNS]
+
+
+def compute_analytics(fixes, habitats, resides, level=HOME_RANGE_LEVEL):
+    """
+    Computes every analytic for a batch of species from their fixes.
+
+    Args:
+        fixes (DataFrame): species_id, timestamp, latitude and longitude.
+        habitats (DataFrame): As returned by habitat_positions.
+        resides (DataFrame): species_id, habitat_id pairs.
+        level (float): Share of fixes the home ranges enclose.
+
+    Returns:
+        dict: "home_ranges", "daily_distances" and "habitat_dwell" DataFrames.
+    """
+    fixes = fixes.dropna(subset=["species_id", "timestamp", "latitude", "longitude"])
+    fixes = pd.DataFrame({
+        "species_id": fixes["species_id"].astype("Int32"),
+        "timestamp": pd.to_datetime(fixes["timestamp"]),
+        "latitude": fixes["latitude"].astype(np.float64),
+        "longitude": fixes["longitude"].astype(np.float64),
+    }).sort_values(["species_id", "timestamp"], kind="stable").reset_index(drop=True)
+
+    projected = _project(fixes)
+    daily = daily_distances(fixes)
+    summary = fixes.groupby("species_id", sort=True).agg(
+        fix_count=("timestamp", "size"), first_fix_at=("timestamp", "min"), last_fix_at=("timestamp", "max"),
+        centroid_latitude=("latitude", "mean"), centroid_longitude=("longitude", "mean"))
+    summary["mcp_area_km2"] = mcp_areas(projected, level)
+    summary["kde_area_km2"] = kde_areas(projected, level)
+    summary["mean_daily_distance_km"] = daily.groupby("species_id")["distance_km"].mean()
+    home_ranges = summary.fillna({"mcp_area_km2": 0.0, "kde_area_km2": 0.0}).reset_index()
+    return {
+        "home_ranges": home_ranges[HOME_RANGE_COLUMNS],
+        "daily_distances": daily,
+        "habitat_dwell": habitat_dwell(fixes, habitats, resides),
+    }
+
+
+def refresh_analytics(species_ids=None):
+    """
+    Recomputes the analytics of species whose fixes changed since they were last computed.
+
+    Fixes come from partitions.read_range, so archived months count too.
+
+    Args:
+        species_ids (list): Only consider these species; all species with fixes by default.
+
+    Returns:
+        list: The species that were recomputed.
+    """
+    signatures = species_signatures()
+    wanted = signatures.keys() if species_ids is None else [int(s) for s in species_ids if int(s) in signatures]
+    with _results_lock:
+        stale = sorted(s for s in wanted if s not in _results or _results[s]["signature"] != signatures[s])
+    if not stale:
+        return []
+
+    start = min(signatures[s][1] for s in stale)
+    end = max(signatures[s][2] for s in stale) + pd.Timedelta(seconds=1)
+    filters = None if len(stale) == len(signatures) else {"species_id": stale}
+    fixes = read_range("movement", start, end, columns=["species_id", "timestamp", "latitude", "longitude"],
+                       filters=filters)
+    results = compute_analytics(fixes, habitat_positions(), residences())
+
+    by_species = {name: dict(tuple(frame.groupby("species_id", sort=False))) for name, frame in results.items()}
+    with _results_lock:
+        for species_id in stale:
+            _results[species_id] = {"signature": signatures[species_id]}
+            for name, frames in by_species.items():
+                _results[species_id][name] = frames.get(species_id)
+    return stale
+
+
+def _collect(name, columns, species_ids):
+    refresh_analytics(species_ids)
+    with _results_lock:
+        keys = sorted(_results) if species_ids is None else [int(s) for s in species_ids]
+        frames = [_results[s][name] for s in keys if s in _results and _results[s][name] is not None]
+    if not frames:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(frames, ignore_index=True)
+
+
+def home_ranges(species_ids=None):
+    """
+    Returns home-range areas and movement summaries per species, refreshing stale species first.
+
+    Args:
+        species_ids (list): Species to report; all species with fixes by default.
+
+    Returns:
+        DataFrame: HOME_RANGE_COLUMNS, one row per species.
+    """
+    return _collect("home_ranges", HOME_RANGE_COLUMNS, species_ids)
+
+
+def distance_per_day(species_ids=None):
+    """Returns the distance each species travelled per day; see daily_distances."""
+    return _collect("daily_distances", DAILY_DISTANCE_COLUMNS, species_ids)
+
+
+def dwell_times(species_ids=None):
+    """Returns the time each species spent in each of its habitats; see habitat_dwell."""
+    return _collect("habitat_dwell", DWELL_COLUMNS, species_ids)
+
+
+def clear_analytics():
+    """Drops every stored result, forcing a full recompute on the next call."""
+    with _results_lock:
+        _results.clear()
@@ -1,7 +1,31 @@
+import tempfile
+import time
+import uuid
+
 import streamlit as st
 import pandas as pd
-from auth import check_user
-from db import create_connection
+from analytics import distance_per_day, dwell_times, home_ranges
+from auth import check_user, issue_token, protect_password, user_cache_stats, verify_token
+from batch import apply_batch, diff_frames, read_patch
+from cache import bump_table_version, cache_stats
+from changefeed import (acknowledge, apply_changes, changes_since, compact_change_log, current_watermark,
+                        merge_changes, safe_watermark, sync_cache)
+from compact import table_memory_report
+from counts import count_table, count_tables
+from db import get_connection, pool_stats, replica_stats, set_session
+from export import CANNED_QUERIES, EXPORT_FORMATS, export
+from instrumentation import (QUERY_LOG_PATH, configure_slow_queries, export_query_log, frequent_queries,
+                             latency_histogram, query_totals, reset_query_stats, slow_queries, slow_query_settings,
+                             slowest_queries)
+from panels import load_panels
+from partitions import maintain, status as partition_status
+from pagination import DEFAULT_PAGE_SIZE, FILTER_OPERATORS, fetch_page
+from queries import (delete_row, endangered_species_info, fetch_record, insert_row, species_from_large_habitats,
+                     species_summary, update_row)
+from schema import column_info, column_names, primary_key, refresh_catalog
+from search import SEARCH_FIELDS, search
+from spatial import incursions_near_hotspots
+from tracks import get_track
 
 st.title("Wildlife Conservation Management System")
 
@@ -11,6 +35,22 @@ if "logged_in" not in st.session_state:
     st.session_state["user_role"] = None
     st.session_state["user_name"] = None
 
+# Tag this session's queries so its reads can see its own writes (see db.set_session)
+set_session(st.session_state.setdefault("db_session", uuid.uuid4().hex))
+
+# Role and name come from the signed session token, so reruns need no database lookup
+if st.session_state["logged_in"]:
+    claims = verify_token(st.session_state.get("session_token"))
+    if claims:
+        st.session_state["user_role"] = claims["role"]
+        st.session_state["user_name"] = claims["name"]
+    else:
+        st.session_state["logged_in"] = False
+        st.session_state["user_role"] = None
+        st.session_state["user_name"] = None
+        st.session_state["session_token"] = None
+        st.warning("Your session has expired, please log in again.")
+
 # Login function
 def login():
     st.subheader("Login")
@@ -23,28 +63,203 @@ def login():
             st.session_state["logged_in"] = True
             st.session_state["user_role"] = user["role"]
             st.session_state["user_name"] = user["name"]
+            st.session_state["session_token"] = issue_token(user)
             st.success(f"Welcome, {user['name']}!")
         else:
             st.error("Invalid email or password")
 
-# Function to display a table's contents
+def parse_key(value):
+    """Converts a typed-in key to an int when possible so it compares numerically."""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return value
+
+def page_controls(state_key, has_prev, has_next):
+    """
+    Renders Previous/Next buttons and a jump-to-key box, and updates the stored cursor.
+    
+    Args:
+        state_key (str): Session state key holding the cursor for this view.
+        has_prev (bool): Whether a previous page exists.
+        has_next (bool): Whether a next page exists.
+    """
+    state = st.session_state[state_key]
+    prev_col, next_col, jump_col = st.columns(3)
+    if prev_col.button("Previous", key=f"{state_key}_prev", disabled=not has_prev):
+        state["cursor"] = {"before": state["first_key"]}
+    if next_col.button("Next", key=f"{state_key}_next", disabled=not has_next):
+        state["cursor"] = {"after": state["last_key"]}
+    jump_to = jump_col.text_input("Jump to key", key=f"{state_key}_jump")
+    if jump_col.button("Go", key=f"{state_key}_go") and jump_to:
+        state["cursor"] = {"start_at": parse_key(jump_to)}
+
+def load_page(state_key, table_name, key_column, columns, **options):
+    """
+    Fetches the page the stored cursor points at and remembers its boundaries.
+    
+    The cursor is reset to the first page whenever the browsing options change.
+    When neither the cursor nor the options changed since the last rerun, the
+    page kept in session state is reused and patched with the rows the change
+    feed reports as written, instead of being read again. Patches never widen
+    the window past its last key or `page_size` rows; the page is read again
+    when they would.
+    
+    Args:
+        state_key (str): Session state key holding the cursor for this view.
+        table_name (str): Name of the table to browse.
+        key_column (str): Column to paginate on.
+        columns (list): All column names of the table.
+        **options: Extra arguments for pagination.fetch_page (page size, projection, filter).
+    
+    Returns:
+        dict: The page returned by fetch_page.
+    """
+    state = st.session_state.setdefault(state_key, {"cursor": {}, "options": None, "first_key": None,
+                                                    "last_key": None, "has_prev": False, "has_next": False,
+                                                    "page": None, "page_cursor": None, "table_name": table_name,
+                                                    "pending": {}})
+    # Each view keeps its own copy of the changes, so the first one drawn does not consume another's
+    st.session_state.setdefault("page_views", set()).add(state_key)
+    if state["options"] != options:
+        state["options"] = options
+        state["cursor"] = {}
+        state["page"] = None
+    
+    page_controls(state_key, state["has_prev"], state["has_next"])
+    changes = state["pending"].pop(table_name, None)
+    page = state.get("page")
+    if page is not None and state["page_cursor"] == state["cursor"] and not options.get("filter_value"):
+        if changes and key_column == primary_key(table_name)[0]:
+            low = state["first_key"] if state["has_prev"] else None
+            high = state["last_key"]
+            if high is None or (not state["has_next"] and any(key > high for key in changes["upserted"])):
+                # Rows added after the last page would grow it; read the window again instead
+                page = None
+            else:
+                data = apply_changes(page["data"], table_name, changes, key_range=(low, high))
+                if data.empty or len(data) > options.get("page_size", DEFAULT_PAGE_SIZE):
+                    page = None
+                else:
+                    page = dict(page, data=data, first_key=data[key_column].iloc[0],
+                                last_key=data[key_column].iloc[-1])
+        elif changes:
+            page = None
+    else:
+        page = None
+    
+    if page is None:
+        page = fetch_page(table_name, key_column, columns, **state["cursor"], **options)
+        if page["data"].empty and "before" in state["cursor"]:
+            # Walked off the start of the table, show the first page instead
+            state["cursor"] = {}
+            page = fetch_page(table_name, key_column, columns, **options)
+    
+    state["page"] = page
+    state["page_cursor"] = dict(state["cursor"])
+    state["first_key"] = page["first_key"]
+    state["last_key"] = page["last_key"]
+    state["has_prev"] = page["has_prev"]
+    state["has_next"] = page["has_next"]
+    return page
+
+# Changed keys a view may keep before it just reads its page again; past this, patching costs more than a re-read
+MAX_PENDING_KEYS = 1000
+
+def sync_changes():
+    """
+    Reads the change feed once per rerun, until it has caught up.
+    
+    Writes made by other processes invalidate the shared query cache, and the
+    changed keys are kept with every view showing those tables until each one
+    patches itself. A view with more than MAX_PENDING_KEYS waiting drops them
+    along with its page, which is read again when it is next shown. The
+    session's watermark is reported back at most once a minute so consumed
+    entries can be compacted.
+    """
+    state = st.session_state
+    try:
+        sync_cache()
+        if "change_watermark" not in state:
+            state["change_watermark"] = current_watermark()
+            state["change_gaps"] = {}
+            state["feed_consumer"] = f"session-{uuid.uuid4().hex[:12]}"
+            return
+        while True:
+            delta = changes_since(state["change_watermark"], gaps=state["change_gaps"])
+            for view_key in state.get("page_views", ()):
+                view = state.get(view_key)
+                if view is None:
+                    continue
+                table_name = view["table_name"]
+                if table_name in delta["tables"]:
+                    merge_changes(view["pending"], {"tables": {table_name: delta["tables"][table_name]}})
+                pending = view["pending"].get(table_name)
+                too_many = pending is not None and len(pending["upserted"]) + len(pending["deleted"]) > MAX_PENDING_KEYS
+                if delta["reset"] or too_many:
+                    # Entries we had not read were compacted away, or there is more to patch than to read
+                    view["page"] = None
+                    view["pending"] = {}
+            state["change_watermark"] = delta["watermark"]
+            state["change_gaps"] = delta["gaps"]
+            if not delta["truncated"]:
+                break
+        if time.time() - state.get("feed_acknowledged_at", 0) > 60:
+            acknowledge(state["feed_consumer"], safe_watermark(delta))
+            state["feed_acknowledged_at"] = time.time()
+    except Exception as e:
+        st.sidebar.warning(f"Change feed unavailable: {e}")
+
+# Function to display a table's contents one page at a time
 def display_table(table_name):
     try:
-        conn = create_connection()
-        query = f"SELECT * FROM {table_name}"
-        data = pd.read_sql(query, conn)
+        columns = get_table_columns(table_name)
+        if not columns:
+            return
+        key_column = (primary_key(table_name) or columns)[0]
+        
+        with st.expander("Browse options"):
+            page_size = st.number_input("Rows per page", min_value=10, max_value=1000, value=DEFAULT_PAGE_SIZE,
+                                        step=10, key=f"{table_name}_page_size")
+            selected_columns = st.multiselect("Columns", columns, key=f"{table_name}_columns")
+            filter_column = st.selectbox("Filter column", [""] + columns, key=f"{table_name}_filter_column")
+            filter_op = st.selectbox("Operator", list(FILTER_OPERATORS), key=f"{table_name}_filter_op")
+            filter_value = st.text_input("Filter value", key=f"{table_name}_filter_value")
+        
+        page = load_page(f"browse_{table_name}", table_name, key_column, columns, page_size=page_size,
+                         columns=selected_columns or columns, filter_column=filter_column, filter_op=filter_op,
+                         filter_value=filter_value)
+        data = page["data"]
         
         if data.empty:
             st.warning(f"No data found in {table_name}.")
         else:
             st.write(data)
-        
-        conn.close()
+            st.caption(f"Showing {key_column} {page['first_key']} to {page['last_key']}")
     except Exception as e:
         st.error(f"Error fetching data from {table_name}: {e}")
+
+def select_record_id(table_name, primary_key_column, columns, label):
+    """
+    Renders a paginated record picker so only one window of keys is ever loaded.
+    
+    Args:
+        table_name (str): Name of the table.
+        primary_key_column (str): The primary key column for the table.
+        columns (list): All column names of the table.
+        label (str): Label for the selectbox.
+    
+    Returns:
+        The selected key, or None if the window is empty.
+    """
+    page = load_page(f"ids_{table_name}", table_name, primary_key_column, columns,
+                     page_size=100, columns=[primary_key_column])
+    record_ids = page["data"][primary_key_column].tolist()
+    return st.selectbox(label, record_ids)
 def get_table_columns(table_name):
     """
-    Fetches the column names of a table from the database.
+    Looks up the column names of a table in the cached schema catalog.
+    Generated columns such as movement.position are left out.
     
     Args:
         table_name (str): Name of the table.
@@ -53,14 +268,50 @@ def get_table_columns(table_name):
         list: List of column names.
     """
     try:
-        with create_connection() as conn:
-            query = f"SHOW COLUMNS FROM {table_name}"
-            columns_df = pd.read_sql(query, conn)
-            return columns_df['Field'].tolist()
+        return column_names(table_name, include_generated=False)
     except Exception as e:
         st.error(f"Error fetching columns for table {table_name}: {e}")
         return []
 
+INTEGER_TYPES = ("tinyint", "smallint", "mediumint", "int", "bigint")
+DECIMAL_TYPES = ("decimal", "float", "double")
+TEXT_TYPES = ("text", "mediumtext", "longtext")
+
+def column_input(table_name, column_name, label, value=None):
+    """
+    Renders an input widget that matches the column's SQL type.
+    
+    Args:
+        table_name (str): Name of the table.
+        column_name (str): Name of the column.
+        label (str): Label shown next to the widget.
+        value: Current value of the column, if any.
+    
+    Returns:
+        The value entered by the user, converted to a matching Python type.
+    """
+    info = column_info(table_name, column_name)
+    data_type = info["data_type"]
+    if value is not None and pd.isna(value):
+        value = None
+    
+    if data_type in INTEGER_TYPES:
+        return st.number_input(label, value=None if value is None else int(value), step=1)
+    if data_type in DECIMAL_TYPES:
+        scale = info["numeric_scale"] or 2
+        return st.number_input(label, value=None if value is None else float(value),
+                               step=10 ** -scale, format=f"%.{scale}f")
+    if data_type == "date":
+        if isinstance(value, pd.Timestamp):
+            value = value.date()
+        return st.date_input(label, value=value)
+    if data_type in TEXT_TYPES:
+        return st.text_area(label, value="" if value is None else str(value))
+    return st.text_input(label, value="" if value is None else str(value), max_chars=info["char_length"])
+
+def is_filled(value):
+    return value is not None and value != ""
+
 def write_record(table_name, columns, values):
     """
     Inserts a new record into the specified table.
@@ -70,16 +321,12 @@ def write_record(table_name, columns, values):
         columns (list): List of column names in the table.
         values (list): List of values to insert into the columns.
     """
-    placeholders = ', '.join(['%s'] * len(values))  # For parameterized query
-    columns_str = ', '.join(columns)
-    query = f"INSERT INTO {table_name} ({columns_str}) VALUES ({placeholders})"
-    
+    if table_name == "users" and "password" in columns:
+        values = list(values)
+        values[columns.index("password")] = protect_password(values[columns.index("password")])
     try:
-        with create_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute(query, values)
-            conn.commit()
-            st.success(f"Record successfully added to {table_name}")
+        insert_row(table_name, columns, values)
+        st.success(f"Record successfully added to {table_name}")
     except Exception as e:
         st.error(f"Error inserting record into {table_name}: {e}")
 
@@ -98,14 +345,16 @@ def add_record_form(table_name):
     # Dictionary to hold user inputs
     values = {}
     
-    # Generate input fields based on columns
+    # Generate typed input fields based on columns, leaving auto-increment keys to the database
     for column in columns:
-        values[column] = st.text_input(column.replace('_', ' ').title())
+        if column_info(table_name, column)["auto_increment"]:
+            continue
+        values[column] = column_input(table_name, column, column.replace('_', ' ').title())
     
     # Button to submit record
     if st.button("Add Record"):
         # Ensure all fields are filled out before submitting
-        if all(values.values()):
+        if all(is_filled(value) for value in values.values()):
             write_record(table_name, list(values.keys()), list(values.values()))
         else:
             st.warning("Please fill out all fields before submitting.")
@@ -117,40 +366,45 @@ def display_record_count(table_name):
     else:
         st.warning("Could not fetch record count.")           
         
-def count_records(table_name):
+def display_all_record_counts(tables, approximate=False):
+    """
+    Shows the record count of every table in one table, fetched in a single round trip.
+    
+    Args:
+        tables (list): Tables to count.
+        approximate (bool): Use the fast statistics estimate instead of the maintained counters.
+    """
     try:
-        # Create connection to the database
-        conn = create_connection()
-        
-        # Prepare the query to call the stored procedure
-        query = f"CALL count_records('{table_name}')"
-        
-        # Fetch the result
-        count = pd.read_sql(query, conn).iloc[0, 0]
-        
-        conn.close()
-        
-        return count
+        counts = count_tables(tables, approximate=approximate)
+        st.write("Record counts:" if not approximate else "Approximate record counts:")
+        st.write(counts)
+    except Exception as e:
+        st.error(f"Error counting records: {e}")
+
+def count_records(table_name, approximate=False):
+    try:
+        # Read the trigger-maintained counter instead of scanning the table
+        return count_table(table_name, approximate=approximate)
     except Exception as e:
         st.error(f"Error counting records from {table_name}: {e}")
         return None
     
-def get_primary_key_column(columns):
+def get_primary_key_column(table_name):
     """
-    Identifies the likely primary key column based on naming conventions.
-    Assumes the primary key column will be named *'_id' (e.g., species_id, habitat_id).
+    Looks up the table's primary key column in the schema catalog.
+    Tables with a composite primary key (e.g., resides_in) have no single key column.
     
     Args:
-        columns (list): List of column names in the table.
+        table_name (str): Name of the table.
     
     Returns:
-        str: The name of the primary key column.
+        str: The name of the primary key column, or None.
     """
-    # Check for column names ending with '_id' which likely indicate primary key columns
-    for column in columns:
-        if column.endswith('_id'):
-            return column
-    return None
+    try:
+        key_columns = primary_key(table_name)
+    except KeyError:
+        return None
+    return key_columns[0] if len(key_columns) == 1 else None
 def update_record(table_name, primary_key_column, record_id, new_values):
     """
     Updates a record in the specified table based on the primary key column and record ID.
@@ -161,18 +415,11 @@ def update_record(table_name, primary_key_column, record_id, new_values):
         record_id (int): The ID of the record to update.
         new_values (dict): A dictionary containing column names as keys and the new values as values.
     """
+    if table_name == "users" and "password" in new_values:
+        new_values = dict(new_values, password=protect_password(new_values["password"]))
     try:
-        # Build the UPDATE query dynamically based on new values
-        set_clause = ", ".join([f"{col} = %s" for col in new_values.keys()])
-        values = list(new_values.values()) + [record_id]
-        
-        # Execute the UPDATE query
-        with create_connection() as conn:
-            cursor = conn.cursor()
-            query = f"UPDATE {table_name} SET {set_clause} WHERE {primary_key_column} = %s"
-            cursor.execute(query, values)
-            conn.commit()
-            st.success(f"Record with {primary_key_column} {record_id} updated in {table_name}.")
+        update_row(table_name, primary_key_column, record_id, new_values)
+        st.success(f"Record with {primary_key_column} {record_id} updated in {table_name}.")
     except Exception as e:
         st.error(f"Error updating record in {table_name}: {e}")
 
@@ -189,41 +436,97 @@ def update_record_form(table_name):
     columns = get_table_columns(table_name)
     
     # Get the primary key column for the table
-    primary_key_column = get_primary_key_column(columns)
+    primary_key_column = get_primary_key_column(table_name)
     
     if primary_key_column:
-        # Get list of record IDs (primary key values) for the selected table
         try:
-            with create_connection() as conn:
-                query = f"SELECT {primary_key_column} FROM {table_name}"
-                ids_df = pd.read_sql(query, conn)
-                record_ids = ids_df[primary_key_column].tolist()
-                
-                # Allow user to select a record to update
-                record_id = st.selectbox(f"Select a record to update based on {primary_key_column}", record_ids)
+            # Allow user to select a record to update from the current window of keys
+            record_id = select_record_id(table_name, primary_key_column, columns,
+                                         f"Select a record to update based on {primary_key_column}")
+            
+            # Fetch current values of the selected record
+            record_df = fetch_record(table_name, primary_key_column, record_id, columns)
+            
+            if not record_df.empty:
+                current_values = record_df.iloc[0].to_dict()
                 
-                # Fetch current values of the selected record
-                query = f"SELECT * FROM {table_name} WHERE {primary_key_column} = %s"
-                record_df = pd.read_sql(query, create_connection(), params=(record_id,))
+                # Display fields for updating
+                new_values = {}
+                for column, current_value in current_values.items():
+                    if column != primary_key_column:  # Don't allow updating the primary key column
+                        new_value = column_input(table_name, column, f"Update {column.replace('_', ' ').title()}", current_value)
+                        new_values[column] = new_value
                 
-                if not record_df.empty:
-                    current_values = record_df.iloc[0].to_dict()
-                    
-                    # Display fields for updating
-                    new_values = {}
-                    for column, current_value in current_values.items():
-                        if column != primary_key_column:  # Don't allow updating the primary key column
-                            new_value = st.text_input(f"Update {column.replace('_', ' ').title()}", value=str(current_value))
-                            new_values[column] = new_value
-                    
-                    # Button to update the record
-                    if st.button(f"Update Record with {primary_key_column} {record_id}"):
-                        update_record(table_name, primary_key_column, record_id, new_values)
+                # Button to update the record
+                if st.button(f"Update Record with {primary_key_column} {record_id}"):
+                    update_record(table_name, primary_key_column, record_id, new_values)
         except Exception as e:
             st.error(f"Error fetching records for updating: {e}")
     else:
         st.warning(f"No primary key column found for table {table_name}. Cannot update records without a primary key.")
         
+def show_batch_result(result, dry_run):
+    """Reports the outcome of a batch edit: conflicts, the preview and the row counts."""
+    if not result["conflicts"].empty:
+        st.error(f"{len(result['conflicts'])} rows were changed or deleted by someone else since you loaded them. "
+                 "Nothing was written; reload and try again.")
+        st.write(result["conflicts"])
+        return
+    if dry_run:
+        st.info(f"Dry run: {result['updated']} rows would be updated and {result['deleted']} deleted.")
+    elif result["applied"]:
+        st.success(f"Updated {result['updated']} and deleted {result['deleted']} rows in one transaction.")
+    else:
+        st.warning("No changes to apply.")
+    if not result["preview"].empty:
+        st.write(result["preview"])
+
+def batch_edit_form(table_name):
+    """
+    Edits or deletes many rows of a table at once, from an editable grid or an uploaded CSV patch.
+
+    Every change is applied in a single transaction by batch.apply_batch, after
+    checking that no row changed since it was loaded.
+
+    Args:
+        table_name (str): Name of the table to edit.
+    """
+    st.subheader(f"Batch Edit {table_name.title()}")
+    columns = get_table_columns(table_name)
+    primary_key_column = get_primary_key_column(table_name)
+    if not primary_key_column:
+        st.warning(f"No primary key column found for table {table_name}. Cannot batch edit without a primary key.")
+        return
+    try:
+        mode = st.radio("Changes from", ["Grid", "Patch file"], horizontal=True, key=f"batch_mode_{table_name}")
+        if mode == "Grid":
+            filter_column = st.selectbox("Filter column", [""] + columns, key=f"batch_filter_column_{table_name}")
+            filter_op = st.selectbox("Operator", list(FILTER_OPERATORS), key=f"batch_filter_op_{table_name}")
+            filter_value = st.text_input("Filter value", key=f"batch_filter_value_{table_name}")
+            page = load_page(f"batch_{table_name}", table_name, primary_key_column, columns, page_size=2000,
+                             filter_column=filter_column, filter_op=filter_op, filter_value=filter_value)
+            original = page["data"]
+            st.caption("Edit cells, or select rows and delete them. Nothing is written until you apply.")
+            edited = st.data_editor(original, num_rows="dynamic", disabled=[primary_key_column],
+                                    key=f"batch_editor_{table_name}_{page['first_key']}")
+            changes = diff_frames(original, edited, primary_key_column)
+        else:
+            st.caption(f"CSV with a {primary_key_column} column, an optional action column (update/delete), the "
+                       "columns to set (empty = unchanged, NULL = NULL) and optional expected_<column> checks.")
+            uploaded = st.file_uploader("Patch file", type=["csv"], key=f"batch_patch_{table_name}")
+            if uploaded is None:
+                return
+            changes = read_patch(uploaded, table_name)
+        st.write(f"{len(changes['updates'])} rows to update, {len(changes['deletes'])} to delete.")
+
+        preview_col, apply_col = st.columns(2)
+        if preview_col.button("Preview changes", key=f"batch_preview_{table_name}"):
+            show_batch_result(apply_batch(table_name, **changes, dry_run=True), dry_run=True)
+        if apply_col.button("Apply changes", key=f"batch_apply_{table_name}"):
+            show_batch_result(apply_batch(table_name, **changes), dry_run=False)
+    except Exception as e:
+        st.error(f"Error applying batch to {table_name}; nothing was written: {e}")
+
 def delete_record(table_name, primary_key_column, record_id):
     """
     Deletes a record from the specified table based on the primary key column and record ID.
@@ -234,12 +537,8 @@ def delete_record(table_name, primary_key_column, record_id):
         record_id (int): The ID of the record to delete.
     """
     try:
-        with create_connection() as conn:
-            cursor = conn.cursor()
-            query = f"DELETE FROM {table_name} WHERE {primary_key_column} = %s"
-            cursor.execute(query, (record_id,))
-            conn.commit()
-            st.success(f"Record with {primary_key_column} {record_id} deleted from {table_name}.")
+        delete_row(table_name, primary_key_column, record_id)
+        st.success(f"Record with {primary_key_column} {record_id} deleted from {table_name}.")
     except Exception as e:
         st.error(f"Error deleting record from {table_name}: {e}")
 
@@ -256,48 +555,24 @@ def delete_record_form(table_name):
     columns = get_table_columns(table_name)
     
     # Get the primary key column for the table
-    primary_key_column = get_primary_key_column(columns)
+    primary_key_column = get_primary_key_column(table_name)
     
     if primary_key_column:
-        # Get list of record IDs (primary key values) for the selected table
         try:
-            with create_connection() as conn:
-                query = f"SELECT {primary_key_column} FROM {table_name}"
-                ids_df = pd.read_sql(query, conn)
-                record_ids = ids_df[primary_key_column].tolist()
-                
-                # Allow user to select a record to delete
-                record_id = st.selectbox(f"Select a record to delete based on {primary_key_column}", record_ids)
-                
-                # Button to delete the record
-                if st.button(f"Delete Record with {primary_key_column} {record_id}"):
-                    delete_record(table_name, primary_key_column, record_id)
+            # Allow user to select a record to delete from the current window of keys
+            record_id = select_record_id(table_name, primary_key_column, columns,
+                                         f"Select a record to delete based on {primary_key_column}")
+            
+            # Button to delete the record
+            if st.button(f"Delete Record with {primary_key_column} {record_id}"):
+                delete_record(table_name, primary_key_column, record_id)
         except Exception as e:
             st.error(f"Error fetching records for deletion: {e}")
     else:
         st.warning(f"No primary key column found for table {table_name}. Cannot delete records without a primary key.")           
 def get_species_from_large_habitats(threshold):
     try:
-        # Create connection to the database
-        conn = create_connection()
-        
-        # Define the nested query
-        query = f"""
-        SELECT common_name
-        FROM species
-        WHERE habitat_id IN (
-            SELECT habitat_id
-            FROM habitat
-            WHERE area_size > {threshold}
-        );
-        """
-        
-        # Execute the query and fetch the results
-        data = pd.read_sql(query, conn)
-        
-        conn.close()
-        
-        return data
+        return species_from_large_habitats(threshold)
     except Exception as e:
         st.error(f"Error fetching species: {e}")
         return None
@@ -315,11 +590,13 @@ def add_column_to_table(table_name, column_name, column_type):
     try:
         query = f"ALTER TABLE {table_name} ADD COLUMN {column_name} {column_type}"
         
-        with create_connection() as conn:
+        with get_connection() as conn:
             cursor = conn.cursor()
             cursor.execute(query)
             conn.commit()
-            st.success(f"Column '{column_name}' added successfully to the {table_name} table.")
+        refresh_catalog()
+        bump_table_version(table_name)
+        st.success(f"Column '{column_name}' added successfully to the {table_name} table.")
     except Exception as e:
         st.error(f"Error adding column to {table_name}: {e}")
         
@@ -355,11 +632,16 @@ def drop_table(table_name):
     try:
         query = f"DROP TABLE {table_name} "
         
-        with create_connection() as conn:
+        with get_connection() as conn:
             cursor = conn.cursor()
             cursor.execute(query)
             conn.commit()
-            st.success(f"  successfully dropped {table_name} table.")
+            # The dropped table no longer needs a row counter
+            cursor.execute("DELETE FROM table_row_counts WHERE table_name = %s", (table_name,))
+            conn.commit()
+        refresh_catalog()
+        bump_table_version(table_name)
+        st.success(f"  successfully dropped {table_name} table.")
     except Exception as e:
         st.error(f"Error dropping  {table_name}: {e}")
         
@@ -375,7 +657,7 @@ def drop_table_form():
         
         if st.button("Drop table"):
             if table_name:
-                drop_table(table_name, column_name, column_type)
+                drop_table(table_name)
             else:
                 st.warning("Please fill out all fields before submitting.")
     else:
@@ -384,29 +666,7 @@ def drop_table_form():
 
 def display_species_info():
     try:
-        conn = create_connection()
-        query = """
-            SELECT 
-                sp.common_name,
-                sp.population_status,
-                m.timestamp AS movement_time,
-                hr.health_status,
-                hr.disease,
-                i.incident_type
-            FROM 
-                species sp
-            JOIN 
-                movement m ON sp.species_id = m.species_id
-            JOIN 
-                health_record hr ON sp.species_id = hr.species_id
-            JOIN 
-                interaction i ON sp.species_id = i.species_id
-            WHERE 
-                sp.population_status = 'Endangered';
-        """
-        
-        data = pd.read_sql(query, conn)
-        conn.close()
+        data = endangered_species_info()
         
         if not data.empty:
             st.write("Endangered Species Information with Movement, Health, and Interaction Details:")
@@ -418,28 +678,7 @@ def display_species_info():
 
 def display_species_summary():
     try:
-        conn = create_connection()
-        query = """
-            SELECT 
-                sp.population_status, 
-                sp.common_name, 
-                COUNT(DISTINCT m.movement_id) AS movement_count,
-                COUNT(DISTINCT i.interaction_id) AS interaction_count
-            FROM 
-                species sp
-            LEFT JOIN 
-                movement m ON sp.species_id = m.species_id
-            LEFT JOIN 
-                health_record hr ON sp.species_id = hr.species_id
-            LEFT JOIN 
-                interaction i ON sp.species_id = i.species_id
-            GROUP BY 
-                population_status, sp.common_name
-            ORDER BY 
-                sp.population_status, movement_count DESC;
-        """
-        data = pd.read_sql(query, conn)
-        conn.close()
+        data = species_summary()
         
         if not data.empty:
             st.write("Species Summary with Movement, Health, and Interaction Counts:")
@@ -449,6 +688,190 @@ def display_species_summary():
     except Exception as e:
         st.error(f"Error fetching species summary: {e}")
 
+def display_hotspot_incursions(radius_km, days):
+    """
+    Shows collar fixes from the last `days` days that came within `radius_km` of a
+    location where human-wildlife interactions were reported.
+    """
+    try:
+        since = (pd.Timestamp.today().normalize() - pd.Timedelta(days=days)).to_pydatetime()
+        data = incursions_near_hotspots(radius_km * 1000, since)
+        
+        if not data.empty:
+            st.write(f"Fixes within {radius_km} km of interaction hotspots in the last {days} days:")
+            st.write(data)
+        else:
+            st.warning("No incursions found near interaction hotspots.")
+    except Exception as e:
+        st.error(f"Error fetching hotspot incursions: {e}")
+
+def display_movement_track(species_id, resolution, start, end, target_points):
+    """
+    Plots a downsampled movement track for one species.
+    
+    Args:
+        species_id (int): Species to plot.
+        resolution (str): "hour", "day", "week" or "raw".
+        start (date): First day of the window.
+        end (date): Last day of the window (inclusive).
+        target_points (int): Maximum number of points sent to the browser.
+    """
+    try:
+        track = get_track(species_id, resolution, start=start, end=pd.Timestamp(end) + pd.Timedelta(days=1),
+                          target_points=target_points)
+        
+        if not track.empty:
+            st.write(f"Track for species {species_id}: {len(track)} points at {resolution} resolution")
+            st.map(track, latitude="latitude", longitude="longitude")
+            st.write(track)
+        else:
+            st.warning(f"No movement data for species {species_id} in that period.")
+    except Exception as e:
+        st.error(f"Error fetching movement track: {e}")
+
+def display_query_performance():
+    """
+    Administrator page listing the slowest and most frequent statements recorded
+    since startup, with a latency histogram and captured EXPLAIN plans.
+    """
+    st.subheader("Query Performance")
+    settings = slow_query_settings()
+    top_n = st.number_input("Statements to show", min_value=1, max_value=100, value=10)
+    slow_ms = st.number_input("Slow query threshold (ms)", min_value=0.0, value=float(settings["slow_ms"]))
+    explain = st.checkbox("Capture EXPLAIN for slow SELECTs", value=settings["explain"])
+    configure_slow_queries(slow_ms=slow_ms, explain=explain)
+
+    st.write(query_totals())
+    st.write("Slowest statements (by p95):")
+    st.dataframe(slowest_queries(top_n))
+    st.write("Most frequent statements:")
+    st.dataframe(frequent_queries(top_n))
+    st.write("Latency histogram:")
+    st.bar_chart(latency_histogram(), x="bucket", y="count")
+
+    slow = slow_queries()
+    if slow:
+        st.write(f"Recent statements over {slow_ms:g} ms:")
+        for record in reversed(slow[-top_n:]):
+            with st.expander(f"{record['wall_ms']:.1f} ms in {record['caller']}"):
+                st.code(record["sql"], language="sql")
+                if record["plan"]:
+                    st.write(pd.DataFrame(record["plan"]))
+
+    log_path = st.text_input("Export to", value=QUERY_LOG_PATH)
+    if st.button("Export query log"):
+        try:
+            written = export_query_log(log_path)
+            st.success(f"Appended {written} statements to {log_path}")
+        except Exception as e:
+            st.error(f"Error exporting query log: {e}")
+    if st.button("Reset query stats"):
+        reset_query_stats()
+        st.success("Query stats cleared.")
+
+def export_form(sources):
+    """
+    Lets the user download a whole table or canned query.
+
+    The export is streamed in chunks to a temporary file on the server, so
+    building it takes constant memory; Streamlit then serves that file.
+    """
+    with st.expander("Export data"):
+        source = st.selectbox("Table or query", sources + list(CANNED_QUERIES), key="export_source")
+        fmt = st.selectbox("Format", EXPORT_FORMATS, key="export_format")
+        if st.button("Prepare export"):
+            try:
+                output = tempfile.TemporaryFile()
+                rows = export(source, output, fmt=fmt)
+                output.seek(0)
+                st.success(f"Exported {rows} rows from {source}.")
+                st.download_button("Download", output, file_name=f"{source}.{fmt}",
+                                   mime="application/octet-stream")
+            except Exception as e:
+                st.error(f"Error exporting {source}: {e}")
+
+def display_search():
+    """
+    Searches interactions, habitats and species for free text and shows ranked hits a page at a time.
+    """
+    query = st.text_input("Search interactions, habitats and species",
+                          placeholder="e.g. net entanglements near the buffer zone")
+    sources = st.multiselect("Search in", list(SEARCH_FIELDS), default=list(SEARCH_FIELDS))
+    if st.session_state.get("search_key") != (query, tuple(sources)):
+        st.session_state["search_key"] = (query, tuple(sources))
+        st.session_state["search_page"] = 0
+    if not query:
+        return
+    try:
+        page = st.session_state["search_page"]
+        start = time.perf_counter()
+        result = search(query, tables=sources, page=page)
+        elapsed = (time.perf_counter() - start) * 1000
+        if result["data"].empty:
+            st.warning("No matches found.")
+        else:
+            st.write(f"Page {page + 1} ({elapsed:.0f} ms):")
+            st.write(result["data"])
+        prev_col, next_col = st.columns(2)
+        if prev_col.button("Previous", key="search_prev", disabled=not result["has_prev"]):
+            st.session_state["search_page"] = page - 1
+            st.rerun()
+        if next_col.button("Next", key="search_next", disabled=not result["has_next"]):
+            st.session_state["search_page"] = page + 1
+            st.rerun()
+    except Exception as e:
+        st.error(f"Error searching: {e}")
+
+def display_movement_analytics(species_ids):
+    """
+    Shows home ranges, daily distances and habitat dwell times.
+
+    Args:
+        species_ids (list): Species to report; all species when empty.
+    """
+    try:
+        species_ids = species_ids or None
+        ranges = home_ranges(species_ids)
+        if ranges.empty:
+            st.warning("No movement data available for analytics.")
+            return
+        st.write("Home ranges (MCP and KDE areas in km², mean daily distance in km):")
+        st.write(ranges)
+        st.write("Time spent per habitat:")
+        st.write(dwell_times(species_ids))
+        if species_ids and len(species_ids) == 1:
+            daily = distance_per_day(species_ids)
+            st.line_chart(daily, x="day", y="distance_km")
+    except Exception as e:
+        st.error(f"Error computing movement analytics: {e}")
+
+def render_panels(panels):
+    """
+    Loads several independent panels concurrently and shows each one as soon as its data arrives.
+
+    Every panel gets its own slot, in the given order, so the layout does not
+    depend on which query finishes first. A failed or timed-out panel shows an
+    error in its own slot only.
+
+    Args:
+        panels (list): (title, loader) pairs. Each loader takes no arguments and returns a DataFrame.
+    """
+    slots = {}
+    for title, _ in panels:
+        slots[title] = st.empty()
+        slots[title].info(f"Loading {title.lower()}...")
+
+    for result in load_panels({title: loader for title, loader in panels}):
+        slot = slots[result["name"]].container()
+        if result["error"] is not None:
+            slot.error(f"Error loading {result['name'].lower()}: {result['error']}")
+            continue
+        slot.write(f"{result['name']} ({result['elapsed'] * 1000:.0f} ms):")
+        if result["data"] is None or result["data"].empty:
+            slot.warning("No data available.")
+        else:
+            slot.write(result["data"])
+
 # Add a button in Streamlit to display this summary
 
 def dashboard(role):
@@ -463,9 +886,13 @@ def dashboard(role):
     table_name = st.selectbox("Choose a table to view", role_tables.get(role, []))
     if table_name:
         display_table(table_name)
+        export_form(role_tables.get(role, []))
         if role == "Researcher":
             if st.button(f"Show record count for {table_name}"):
                 display_record_count(table_name)
+            approximate = st.checkbox("Fast approximate counts")
+            if st.button("Show record counts for all tables"):
+                display_all_record_counts(role_tables.get(role, []), approximate=approximate)
             threshold = st.number_input("Enter minimum area of habitat", min_value=1, value=100000)
             if st.button(f"Show species from habitats with more than {threshold} area "):
                 species_data = get_species_from_large_habitats(threshold)
@@ -475,11 +902,45 @@ def dashboard(role):
                 else:
                     st.warning(f"No species found in habitats with more than {threshold} area.")    
             if st.button("Show Species Summary"):
-                display_species_summary()       
+                display_species_summary()
+            if st.button("Load research overview"):
+                render_panels([
+                    ("Record counts", lambda: count_tables(role_tables[role], approximate=approximate)),
+                    (f"Species from habitats larger than {threshold}", lambda: species_from_large_habitats(threshold)),
+                    ("Species summary", species_summary),
+                ])
+            
+            st.subheader("Movement Track")
+            track_species = st.number_input("Species ID", min_value=1, value=1, step=1)
+            resolution = st.selectbox("Resolution", ["day", "week", "hour", "raw"])
+            today = pd.Timestamp.today().date()
+            track_start = st.date_input("From", value=today - pd.Timedelta(days=365 if resolution in ("day", "week") else 7))
+            track_end = st.date_input("To", value=today)
+            target_points = st.number_input("Maximum points", min_value=10, max_value=20000, value=2000, step=100)
+            if st.button("Plot Movement Track"):
+                display_movement_track(track_species, resolution, track_start, track_end, target_points)
+
+            st.subheader("Movement Analytics")
+            analytics_species = st.text_input("Species IDs (comma-separated, empty for all)")
+            if st.button("Show Home Ranges and Habitat Use"):
+                display_movement_analytics([int(s) for s in analytics_species.split(",") if s.strip().isdigit()])       
         elif role == "Conservationist":
             
+            st.subheader("Search")
+            display_search()
             if st.button("Show Endangered Species Information"):
-                display_species_info()          
+                display_species_info()
+            radius_km = st.number_input("Incursion radius (km)", min_value=0.1, value=2.0)
+            days = st.number_input("Look back (days)", min_value=1, value=7)
+            if st.button("Show Incursions Near Interaction Hotspots"):
+                display_hotspot_incursions(radius_km, days)
+            if st.button("Load conservation overview"):
+                since = (pd.Timestamp.today().normalize() - pd.Timedelta(days=days)).to_pydatetime()
+                render_panels([
+                    ("Endangered species", endangered_species_info),
+                    (f"Incursions within {radius_km} km of hotspots", lambda: incursions_near_hotspots(radius_km * 1000, since)),
+                    ("Record counts", lambda: count_tables(role_tables[role])),
+                ])          
 
 # Main app logic
 if st.session_state["logged_in"]:
@@ -490,6 +951,8 @@ if st.session_state["logged_in"]:
         "Administrator": ["users","interaction","movement", "health_record", "species", "habitat","audit_log"]
     }
 
+    sync_changes()
+
     # Sidebar navigation
     st.sidebar.title("Navigation")
     st.sidebar.write(f"Logged in as: {st.session_state['user_name']} ({role})")
@@ -510,9 +973,51 @@ if st.session_state["logged_in"]:
         if st.sidebar.button("Delete records"):
             selected_table = st.selectbox("Choose a table to delete a record", role_tables.get(role, []))
             delete_record_form(selected_table)   
+
+        if st.sidebar.checkbox("Batch edit"):
+            selected_table = st.selectbox("Choose a table to batch edit", role_tables.get(role, []))
+            batch_edit_form(selected_table)
     # Display form for adding records
     
     if role in ["Administrator"]:
+        if st.sidebar.button("Connection Pool Stats"):
+            st.subheader("Connection Pool Stats")
+            st.write(pool_stats())
+            replicas = replica_stats()
+            if replicas:
+                st.subheader("Read Replicas")
+                st.write(pd.DataFrame(replicas))
+        if st.sidebar.button("Query Cache Stats"):
+            st.subheader("Query Cache Stats")
+            st.write(cache_stats())
+            st.subheader("User Cache Stats")
+            st.write(user_cache_stats())
+        if st.sidebar.button("DataFrame Memory Report"):
+            st.subheader("DataFrame Memory Report")
+            for table in role_tables[role]:
+                try:
+                    st.write(f"{table} (first 10,000 rows, raw vs compact dtypes):")
+                    st.dataframe(table_memory_report(table))
+                except Exception as e:
+                    st.error(f"Error building memory report for {table}: {e}")
+        # A checkbox rather than a button so the page's own widgets survive reruns
+        if st.sidebar.checkbox("Query Performance"):
+            display_query_performance()
+        if st.sidebar.button("Compact Change Log"):
+            try:
+                deleted = compact_change_log()
+                st.success(f"Removed {deleted} consumed change log entries.")
+            except Exception as e:
+                st.error(f"Error compacting change log: {e}")
+        if st.sidebar.button("Archive Old Partitions"):
+            try:
+                for table_name, result in maintain().items():
+                    archived = sum(result["archived"].values())
+                    st.success(f"{table_name}: archived {archived} rows from {len(result['archived'])} months, "
+                               f"created {len(result['created'])} partitions.")
+                st.dataframe(partition_status())
+            except Exception as e:
+                st.error(f"Error maintaining partitions: {e}")
         if st.sidebar.button("Add Columns"):
             add_column_form()
         if st.sidebar.button("Drop Table"):
@@ -522,5 +1027,6 @@ if st.session_state["logged_in"]:
         st.session_state["logged_in"] = False
         st.session_state["user_role"] = None
         st.session_state["user_name"] = None
+        st.session_state["session_token"] = None
 else:
     login()
@@ -1,17 +1,274 @@
-from db import create_connection
+"""
+Password checks and signed session tokens.
 
-def check_user(email, password):
-    """Verify if a user exists and the password matches."""
-    conn = create_connection()
-    cursor = conn.cursor(dictionary=True)
-    
-    # Check if user exists
-    cursor.execute("SELECT * FROM users WHERE email = %s", (email,))
-    user = cursor.fetchone()
-    cursor.close()
-    conn.close()
-    
-    # Compare the plain text password (for simplicity)
-    if user and user["password"] == password:
+Passwords are stored as salted PBKDF2-SHA256 hashes in the form
+"pbkdf2_sha256$<iterations>$<salt>$<hash>". Rows still holding a plaintext
+password (or a hash with fewer iterations than PASSWORD_ITERATIONS) are
+rehashed the next time their owner logs in.
+
+User records are looked up by email through a small in-process cache that
+is invalidated whenever the users table is written (see cache.py). After a
+login the session keeps a signed token with the user's name and role, so
+reruns can trust the role without asking the database again.
+"""
+import base64
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+import db
+from cache import bump_table_version, table_versions
+from db import get_connection
+
+PASSWORD_ALGORITHM = "pbkdf2_sha256"
+# PBKDF2 rounds for new hashes; raise it as hardware gets faster, existing hashes are upgraded on login
+PASSWORD_ITERATIONS = int(os.environ.get("WMCS_PASSWORD_ITERATIONS", 600000))
+SALT_BYTES = 16
+
+# Most user records kept in memory
+USER_CACHE_SIZE = int(os.environ.get("WMCS_USER_CACHE_SIZE", 1024))
+
+# Secret for signing session tokens. Without one, a random secret is used and tokens end with the process.
+SESSION_SECRET = os.environ.get("WMCS_SESSION_SECRET") or secrets.token_hex(32)
+SESSION_TTL = int(os.environ.get("WMCS_SESSION_TTL", 8 * 3600))
+
+USER_COLUMNS = ["user_id", "name", "email", "role", "password"]
+
+
+def hash_password(password, iterations=None, salt=None):
+    """
+    Hashes a password with a random salt.
+
+    Args:
+        password (str): The plaintext password.
+        iterations (int): PBKDF2 rounds; PASSWORD_ITERATIONS by default.
+        salt (bytes): Salt to use; random by default.
+
+    Returns:
+        str: "pbkdf2_sha256$<iterations>$<salt>$<hash>", salt and hash base64-encoded.
+    """
+    iterations = iterations or PASSWORD_ITERATIONS
+    salt = salt or secrets.token_bytes(SALT_BYTES)
+    digest = hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), salt, iterations)
+    return "$".join([PASSWORD_ALGORITHM, str(iterations), base64.b64encode(salt).decode("ascii"),
+                     base64.b64encode(digest).decode("ascii")])
+
+
+def _parse_hash(stored):
+    parts = stored.split("$") if isinstance(stored, str) else []
+    if len(parts) != 4 or parts[0] != PASSWORD_ALGORITHM or not parts[1].isdigit():
+        return None
+    try:
+        return int(parts[1]), base64.b64decode(parts[2]), base64.b64decode(parts[3])
+    except ValueError:
+        return None
+
+
+def is_password_hash(value):
+    """Returns whether a stored value is a password hash rather than a legacy plaintext password."""
+    return _parse_hash(value) is not None
+
+
+def verify_password(password, stored):
+    """
+    Checks a password against a stored hash, or a legacy plaintext value.
+
+    Returns:
+        tuple: (matches, needs_rehash). needs_rehash is True when the password matched
+        a plaintext value or a hash weaker than PASSWORD_ITERATIONS.
+    """
+    if stored is None or password is None:
+        return False, False
+    parsed = _parse_hash(stored)
+    if parsed is None:
+        return hmac.compare_digest(str(stored).encode("utf-8"), password.encode("utf-8")), True
+    iterations, salt, expected = parsed
+    digest = hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), salt, iterations)
+    return hmac.compare_digest(digest, expected), iterations < PASSWORD_ITERATIONS
+
+
+def protect_password(value):
+    """Hashes a password about to be written to users, leaving existing hashes and empty values alone."""
+    if value in (None, "") or is_password_hash(value):
+        return value
+    return hash_password(str(value))
+
+
+class UserCache:
+    """
+    A bounded LRU of user records by email, including misses.
+
+    Each entry remembers the users table version it was read at and is
+    ignored once the table has been written since (see cache.bump_table_version).
+
+    Args:
+        max_entries (int): Most emails kept.
+    """
+
+    def __init__(self, max_entries=USER_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0}
+
+    def get(self, email):
+        version = table_versions(["users"])
+        with self._lock:
+            entry = self._entries.get(email)
+            if entry is not None and entry[0] == version:
+                self._entries.move_to_end(email)
+                self._stats["hits"] += 1
+                return True, entry[1]
+            self._stats["misses"] += 1
+        return False, None
+
+    def put(self, email, version, user):
+        with self._lock:
+            self._entries[email] = (version, user)
+            self._entries.move_to_end(email)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, entries=len(self._entries), max_entries=self.max_entries)
+
+
+_users = UserCache()
+_dummy = {}
+
+
+def _dummy_hash():
+    # Built on first use, and again whenever PASSWORD_ITERATIONS changes
+    if _dummy.get("iterations") != PASSWORD_ITERATIONS:
+        _dummy.update(iterations=PASSWORD_ITERATIONS, hash=hash_password(secrets.token_hex(8)))
+    return _dummy["hash"]
+
+
+def find_user(email):
+    """
+    Returns the user record for an email, or None.
+
+    Only the columns needed to log in are read, by the unique email index,
+    with a prepared statement on MySQL.
+
+    Returns:
+        dict: user_id, name, email, role and the stored password hash.
+    """
+    found, user = _users.get(email)
+    if found:
         return user
-    return None
+    version = table_versions(["users"])
+    with get_connection() as conn:
+        # The SQLite stand-in has no server-side prepared statements
+        cursor = conn.cursor() if db.DB_BACKEND == "sqlite" else conn.cursor(prepared=True)
+        cursor.execute(f"SELECT {', '.join(USER_COLUMNS)} FROM users WHERE email = %s LIMIT 1", (email,))
+        row = cursor.fetchone()
+        cursor.close()
+    user = dict(zip(USER_COLUMNS, row)) if row else None
+    _users.put(email, version, user)
+    return user
+
+
+def _rehash(user, password):
+    stored = hash_password(password)
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        # Only replace the value we verified against, in case the password was changed meanwhile
+        cursor.execute("UPDATE users SET password = %s WHERE user_id = %s AND password = %s",
+                       (stored, user["user_id"], user["password"]))
+        conn.commit()
+        cursor.close()
+    bump_table_version("users")
+
+
+def check_user(email, password):
+    """
+    Verify if a user exists and the password matches.
+
+    Plaintext and outdated hashes are upgraded to PASSWORD_ITERATIONS on a
+    successful login.
+
+    Returns:
+        dict: user_id, name, email and role, or None when the email or password is wrong.
+    """
+    user = find_user(email)
+    if user is None:
+        # Spend the same time as a real check so response times do not reveal which emails exist
+        verify_password(password or "", _dummy_hash())
+        return None
+    matches, needs_rehash = verify_password(password, user["password"])
+    if not matches:
+        return None
+    if needs_rehash:
+        _rehash(user, password)
+    return {key: user[key] for key in USER_COLUMNS if key != "password"}
+
+
+def user_cache_stats():
+    """Returns the user cache's hit and miss counters."""
+    return _users.stats()
+
+
+def clear_user_cache():
+    """Drops every cached user record."""
+    _users.clear()
+
+
+def _b64(data):
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def _unb64(text):
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def _sign(payload):
+    return _b64(hmac.new(SESSION_SECRET.encode("utf-8"), payload.encode("ascii"), hashlib.sha256).digest())
+
+
+def issue_token(user, ttl=SESSION_TTL):
+    """
+    Creates a signed session token for a logged-in user.
+
+    Args:
+        user (dict): As returned by check_user.
+        ttl (int): Seconds until the token expires.
+
+    Returns:
+        str: "<payload>.<signature>", both base64url-encoded.
+    """
+    claims = {"uid": user["user_id"], "name": user["name"], "role": user["role"], "exp": int(time.time()) + ttl}
+    payload = _b64(json.dumps(claims, separators=(",", ":")).encode("utf-8"))
+    return f"{payload}.{_sign(payload)}"
+
+
+def verify_token(token):
+    """
+    Checks a session token's signature and expiry without touching the database.
+
+    Returns:
+        dict: The claims (uid, name, role, exp), or None for a missing, forged or expired token.
+    """
+    if not isinstance(token, str) or token.count(".") != 1:
+        return None
+    payload, signature = token.split(".")
+    if not hmac.compare_digest(signature, _sign(payload)):
+        return None
+    try:
+        claims = json.loads(_unb64(payload))
+    except ValueError:
+        return None
+    if claims.get("exp", 0) < time.time():
+        return None
+    return claims
+
@@ -0,0 +1,282 @@
+"""
+Transactional batch edits and deletes.
+
+A batch is a list of updates and deletes for one table, built from an edited
+grid (diff_frames) or an uploaded patch file (read_patch). apply_batch locks
+the affected rows, checks that they still hold the values the editor started
+from, then runs every statement with executemany in a single transaction.
+Either the whole batch is committed or none of it is.
+
+Patch file format (CSV), one row per change:
+    <primary key>,action,<column>,...,expected_<column>,...
+    17,update,Recovered,,Sick
+    18,delete,,,
+
+`action` is "update" (the default) or "delete". An empty cell leaves the
+column unchanged and NULL sets it to NULL. `expected_<column>` cells are the
+values the row must still have for the change to apply.
+"""
+import datetime
+import decimal
+import math
+
+import numpy as np
+import pandas as pd
+
+import db
+from auth import protect_password
+from cache import bump_table_version
+from db import get_connection
+from pagination import quote_identifier, to_python
+from schema import column_names, primary_key
+
+ACTIONS = ("update", "delete")
+EXPECTED_PREFIX = "expected_"
+NULL_MARKER = "NULL"
+# Keys per SELECT when locking and checking the affected rows
+LOCK_CHUNK_SIZE = 1000
+
+PREVIEW_COLUMNS = ["record_id", "action", "column", "current_value", "new_value"]
+CONFLICT_COLUMNS = ["record_id", "column", "expected_value", "current_value"]
+
+
+def _is_null(value):
+    return value is None or value is pd.NA or value is pd.NaT or (isinstance(value, float) and math.isnan(value))
+
+
+def _to_db(value):
+    """Converts a pandas/NumPy cell into a value the driver accepts."""
+    if _is_null(value):
+        return None
+    if isinstance(value, pd.Timestamp):
+        return value.to_pydatetime()
+    return to_python(value)
+
+
+def same_value(a, b):
+    """
+    Compares a value read from the database with one from a grid or patch file.
+
+    Numbers compare numerically (Decimal 1.50 equals "1.5"), dates and times as
+    timestamps, everything else as text.
+    """
+    if _is_null(a) or _is_null(b):
+        return _is_null(a) and _is_null(b)
+    if isinstance(a, (datetime.date, datetime.datetime, pd.Timestamp, np.datetime64)) or \
+            isinstance(b, (datetime.date, datetime.datetime, pd.Timestamp, np.datetime64)):
+        try:
+            return pd.Timestamp(a) == pd.Timestamp(b)
+        except (TypeError, ValueError):
+            return str(a) == str(b)
+    if isinstance(a, (int, float, decimal.Decimal, np.number)) or isinstance(b, (int, float, decimal.Decimal, np.number)):
+        try:
+            return math.isclose(float(a), float(b), rel_tol=1e-9, abs_tol=1e-12)
+        except (TypeError, ValueError):
+            return str(a) == str(b)
+    return str(a) == str(b)
+
+
+def diff_frames(original, edited, key_column):
+    """
+    Turns an edited copy of a DataFrame into a batch.
+
+    Rows missing from `edited` are deletes; rows whose cells changed are
+    updates of just those cells. Rows added in the editor are ignored (use
+    Add records for new rows).
+
+    Args:
+        original (DataFrame): Rows as they were read, including `key_column`.
+        edited (DataFrame): The same rows after editing.
+        key_column (str): Primary key column.
+
+    Returns:
+        dict: "updates" ({key: {column: new value}}), "deletes" (list of keys) and
+        "expected" ({key: {column: original value}}) for apply_batch.
+    """
+    before = original.set_index(key_column)
+    after = edited.dropna(subset=[key_column]).set_index(key_column)
+    updates, expected = {}, {}
+    for key in before.index.intersection(after.index):
+        changed = {column: after.at[key, column] for column in before.columns
+                   if column in after.columns and not same_value(before.at[key, column], after.at[key, column])}
+        if changed:
+            key = to_python(key)
+            updates[key] = changed
+            expected[key] = {column: before.at[key, column] for column in changed}
+    deletes = [to_python(key) for key in before.index.difference(after.index)]
+    for key in deletes:
+        expected[key] = before.loc[key].to_dict()
+    return {"updates": updates, "deletes": deletes, "expected": expected}
+
+
+def read_patch(source, table_name):
+    """
+    Parses a CSV patch file into a batch (see the module docstring for the format).
+
+    Args:
+        source: Path or file object.
+        table_name (str): Table the patch applies to.
+
+    Returns:
+        dict: "updates", "deletes" and "expected", as for apply_batch.
+
+    Raises:
+        ValueError: If the file has no primary key column, unknown columns or actions.
+    """
+    key_column = primary_key(table_name)[0]
+    columns = column_names(table_name, include_generated=False)
+    patch = pd.read_csv(source, dtype=str, keep_default_na=False, na_values=[""])
+    if key_column not in patch.columns:
+        raise ValueError(f"Patch has no {key_column} column")
+    value_columns = [c for c in patch.columns if c not in (key_column, "action") and not c.startswith(EXPECTED_PREFIX)]
+    expected_columns = [c for c in patch.columns if c.startswith(EXPECTED_PREFIX)]
+    unknown = (set(value_columns) | {c[len(EXPECTED_PREFIX):] for c in expected_columns}) - set(columns)
+    if unknown:
+        raise ValueError(f"Columns not in {table_name}: {', '.join(sorted(unknown))}")
+
+    def cell(value):
+        return None if value == NULL_MARKER else value
+
+    updates, deletes, expected = {}, [], {}
+    for row in patch.to_dict("records"):
+        key = row[key_column]
+        action = (row.get("action") or "update").strip().lower() if not _is_null(row.get("action")) else "update"
+        if action not in ACTIONS:
+            raise ValueError(f"Unknown action for {key_column} {key}: {action}")
+        checks = {c[len(EXPECTED_PREFIX):]: cell(row[c]) for c in expected_columns if not _is_null(row[c])}
+        if checks:
+            expected[key] = checks
+        if action == "delete":
+            deletes.append(key)
+        else:
+            changed = {c: cell(row[c]) for c in value_columns if not _is_null(row[c])}
+            if changed:
+                updates[key] = changed
+    return {"updates": updates, "deletes": deletes, "expected": expected}
+
+
+def _lock_rows(cursor, table_name, key_column, keys, columns):
+    """Reads the current values of `keys`, locking the rows until the transaction ends."""
+    select_list = ", ".join(quote_identifier(c) for c in [key_column] + columns)
+    # SQLite has no row locks; BEGIN IMMEDIATE (see apply_batch) already holds the write lock
+    lock = "" if db.DB_BACKEND == "sqlite" else " FOR UPDATE"
+    current = {}
+    for start in range(0, len(keys), LOCK_CHUNK_SIZE):
+        chunk = keys[start:start + LOCK_CHUNK_SIZE]
+        cursor.execute(f"SELECT {select_list} FROM {quote_identifier(table_name)} "
+                       f"WHERE {quote_identifier(key_column)} IN ({', '.join(['%s'] * len(chunk))}){lock}", chunk)
+        for row in cursor.fetchall():
+            current[str(row[0])] = dict(zip(columns, row[1:]))
+    return current
+
+
+def apply_batch(table_name, updates=None, deletes=None, expected=None, dry_run=False):
+    """
+    Applies many updates and deletes to one table in a single transaction.
+
+    The affected rows are locked and compared with `expected` first; if any
+    row was deleted or changed by someone else since the batch was prepared,
+    nothing is written and the conflicts are returned. Otherwise updates that
+    set the same columns share one executemany, as do all deletes.
+
+    Args:
+        table_name (str): Table to change.
+        updates (dict): Primary key -> {column: new value}.
+        deletes (list): Primary keys of the rows to delete.
+        expected (dict): Primary key -> {column: value the row must still have}.
+        dry_run (bool): Run every statement, then roll back. Constraint errors and
+            conflicts surface exactly as they would for real.
+
+    Returns:
+        dict: "applied" (whether the batch was committed), "updated" and "deleted" row
+        counts, "preview" (one row per changed cell or deleted row, with current and
+        new values) and "conflicts" (rows that no longer match `expected`).
+
+    Raises:
+        ValueError: For unknown columns, a table without a single-column primary key,
+            or a key that is both updated and deleted.
+    """
+    updates = updates or {}
+    deletes = list(deletes or [])
+    expected = expected or {}
+    keys_primary = primary_key(table_name)
+    if len(keys_primary) != 1:
+        raise ValueError(f"Batch edits need a single-column primary key; {table_name} has {len(keys_primary)}")
+    key_column = keys_primary[0]
+    known = column_names(table_name, include_generated=False)
+    both = {str(k) for k in updates} & {str(k) for k in deletes}
+    if both:
+        raise ValueError(f"Rows both updated and deleted: {', '.join(sorted(both))}")
+
+    # Validate every identifier before any SQL is built
+    touched_columns = sorted({c for values in updates.values() for c in values}
+                             | {c for values in expected.values() for c in values})
+    for column in touched_columns:
+        quote_identifier(column, known)
+    if key_column in {c for values in updates.values() for c in values}:
+        raise ValueError(f"The primary key {key_column} cannot be changed")
+    if table_name == "users":
+        # Passwords are only ever stored hashed
+        updates = {k: dict(v, password=protect_password(v["password"])) if "password" in v else v
+                   for k, v in updates.items()}
+    keys = [_to_db(k) for k in list(updates) + deletes]
+    result = {"applied": False, "updated": 0, "deleted": 0,
+              "preview": pd.DataFrame(columns=PREVIEW_COLUMNS), "conflicts": pd.DataFrame(columns=CONFLICT_COLUMNS)}
+    if not keys:
+        return result
+
+    table = quote_identifier(table_name)
+    key = quote_identifier(key_column)
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            if db.DB_BACKEND == "sqlite":
+                cursor.execute("BEGIN IMMEDIATE")
+            current = _lock_rows(cursor, table_name, key_column, keys, touched_columns)
+
+            conflicts, preview = [], []
+            for record_id in list(updates) + deletes:
+                row = current.get(str(_to_db(record_id)))
+                if row is None:
+                    conflicts.append((record_id, None, "(row)", "(deleted)"))
+                    continue
+                for column, value in expected.get(record_id, {}).items():
+                    if not same_value(row[column], value):
+                        conflicts.append((record_id, column, _to_db(value), row[column]))
+                if record_id in updates:
+                    preview.extend((record_id, "update", column, row[column], _to_db(value))
+                                   for column, value in updates[record_id].items())
+                else:
+                    preview.append((record_id, "delete", None, None, None))
+            result["preview"] = pd.DataFrame(preview, columns=PREVIEW_COLUMNS)
+            result["conflicts"] = pd.DataFrame(conflicts, columns=CONFLICT_COLUMNS)
+            if conflicts:
+                conn.rollback()
+                return result
+
+            # One executemany per distinct set of updated columns
+            groups = {}
+            for record_id, values in updates.items():
+                columns = tuple(sorted(values))
+                groups.setdefault(columns, []).append([_to_db(values[c]) for c in columns] + [_to_db(record_id)])
+            for columns, params in groups.items():
+                set_clause = ", ".join(f"{quote_identifier(c)} = %s" for c in columns)
+                cursor.executemany(f"UPDATE {table} SET {set_clause} WHERE {key} = %s", params)
+                result["updated"] += len(params)
+            if deletes:
+                cursor.executemany(f"DELETE FROM {table} WHERE {key} = %s", [(_to_db(k),) for k in deletes])
+                result["deleted"] = len(deletes)
+
+            if dry_run:
+                conn.rollback()
+            else:
+                conn.commit()
+                result["applied"] = True
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+    if result["applied"]:
+        bump_table_version(table_name)
+    return result
@@ -0,0 +1,677 @@
+"""
+Benchmark harness for the dashboard's data access.
+
+Generates a synthetic WMCS database of configurable size, runs the queries
+behind each dashboard function headlessly and writes latency percentiles,
+rows transferred and peak memory to a JSON report that can be compared
+between runs.
+
+Usage:
+    python bench.py generate --sqlite bench.sqlite3 --species 1000 --movement 1000000
+    python bench.py run --sqlite bench.sqlite3 --iterations 50 --output before.json
+    python bench.py compare before.json after.json --threshold 0.2
+
+Against MySQL, point --mysql-database at a local database that already has
+WMCS.sql and WMCS_trig.sql loaded; the triggers then maintain the rollups
+while rows are generated.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+import warnings
+
+import numpy as np
+import pandas as pd
+
+import auth
+import db
+from auth import hash_password, issue_token, verify_token
+from cache import clear_cache
+from counts import count_tables
+from db import get_connection
+from pagination import fetch_page
+from queries import endangered_species_info, insert_row, species_from_large_habitats, species_summary
+from schema import column_names, refresh_catalog
+from search import search
+
+DEFAULT_SIZES = {
+    "habitat": 50,
+    "species": 1000,
+    "users": 1000,
+    "movement": 100000,
+    "health_record": 20000,
+    "interaction": 20000,
+    "audit_log": 10000,
+}
+DEFAULT_ITERATIONS = 20
+DEFAULT_THRESHOLD = 0.2
+# PBKDF2 rounds for generated users, kept low so thousands of users generate quickly.
+# Pass the same --password-iterations to generate and run, or every login rehashes.
+BENCH_PASSWORD_ITERATIONS = 1000
+CHUNK_SIZE = 10000
+
+# Tables counted by the count_records scenario (the Conservationist's view)
+COUNTED_TABLES = ["habitat", "species", "movement", "interaction", "health_record"]
+
+POPULATION_STATUSES = ["Endangered", "Vulnerable", "Near Threatened", "Least Concern"]
+CLASSIFICATIONS = ["Mammal", "Bird", "Reptile", "Amphibian", "Fish"]
+HEALTH_STATUSES = ["Healthy", "Injured", "Sick", "Critical"]
+VACCINATION_STATUSES = ["Up-to-date", "Pending", "N/A"]
+DISEASES = ["None", "Infection", "Poaching injury", "Disease outbreak"]
+INCIDENT_TYPES = ["Poaching attempt", "Crop raiding", "Road collision", "Tourist disturbance", "Entered village",
+                  "Net entanglement"]
+ROLES = ["Conservationist", "Researcher", "Administrator", "Field Technician"]
+
+# Fixes are spread over a year inside the Sundarbans bounding box
+TIME_START = pd.Timestamp("2024-01-01")
+TIME_SPAN_SECONDS = 365 * 24 * 3600
+LATITUDE_RANGE = (21.5, 22.5)
+LONGITUDE_RANGE = (88.0, 89.2)
+
+# The stand-in mirrors WMCS.sql plus the tables added in WMCS_trig.sql, including the
+# partitioning prep: movement has no foreign key to species (triggers enforce it) and
+# the time columns of movement and audit_log are NOT NULL
+SQLITE_SCHEMA = """
+CREATE TABLE habitat (
+    habitat_id INTEGER PRIMARY KEY,
+    name VARCHAR(100),
+    location VARCHAR(255),
+    area_size DECIMAL(10,2),
+    environmental_attributes TEXT
+);
+CREATE TABLE species (
+    species_id INTEGER PRIMARY KEY,
+    population_status VARCHAR(50),
+    common_name VARCHAR(100),
+    scientific_name VARCHAR(100),
+    classification VARCHAR(100),
+    habitat_id INT REFERENCES habitat(habitat_id)
+);
+CREATE TABLE users (
+    user_id INTEGER PRIMARY KEY,
+    name VARCHAR(100),
+    email VARCHAR(100),
+    password VARCHAR(255),
+    role VARCHAR(50)
+);
+CREATE UNIQUE INDEX users_email ON users (email);
+CREATE TABLE movement (
+    movement_id INTEGER PRIMARY KEY,
+    species_id INT,
+    timestamp TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    latitude DECIMAL(9,6),
+    longitude DECIMAL(9,6)
+);
+CREATE INDEX movement_species_id ON movement (species_id);
+CREATE INDEX idx_movement_species_timestamp ON movement (species_id, timestamp);
+CREATE TABLE health_record (
+    health_record_id INTEGER PRIMARY KEY,
+    species_id INT REFERENCES species(species_id),
+    health_status VARCHAR(50),
+    vaccination_status VARCHAR(50),
+    date_recorded DATE,
+    treatment VARCHAR(255),
+    disease VARCHAR(255)
+);
+CREATE INDEX health_record_species_id ON health_record (species_id);
+CREATE TABLE interaction (
+    interaction_id INTEGER PRIMARY KEY,
+    species_id INT REFERENCES species(species_id),
+    mitigation_efforts TEXT,
+    date_recorded DATE,
+    incident_type VARCHAR(100),
+    location VARCHAR(255)
+);
+CREATE INDEX interaction_species_id ON interaction (species_id);
+CREATE TABLE report (
+    report_id INTEGER PRIMARY KEY,
+    user_id INT REFERENCES users(user_id),
+    report_type VARCHAR(50),
+    date DATE
+);
+CREATE TABLE made_on (
+    species_id INT NOT NULL REFERENCES species(species_id),
+    report_id INT NOT NULL REFERENCES report(report_id),
+    report_type VARCHAR(50),
+    PRIMARY KEY (species_id, report_id)
+);
+CREATE TABLE resides_in (
+    species_id INT NOT NULL REFERENCES species(species_id),
+    habitat_id INT NOT NULL REFERENCES habitat(habitat_id),
+    area_size DECIMAL(10,2),
+    PRIMARY KEY (species_id, habitat_id)
+);
+CREATE TABLE audit_log (
+    id INTEGER PRIMARY KEY,
+    table_name VARCHAR(255),
+    operation VARCHAR(50),
+    record_id INT,
+    old_value TEXT,
+    new_value TEXT,
+    changed_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TABLE species_activity_summary (
+    species_id INT PRIMARY KEY REFERENCES species(species_id) ON DELETE CASCADE,
+    movement_count INT NOT NULL DEFAULT 0,
+    last_movement_at TIMESTAMP NULL,
+    health_record_count INT NOT NULL DEFAULT 0,
+    last_health_date DATE NULL,
+    latest_health_status VARCHAR(50),
+    latest_disease VARCHAR(255),
+    interaction_count INT NOT NULL DEFAULT 0,
+    last_interaction_date DATE NULL,
+    latest_incident_type VARCHAR(100)
+);
+CREATE TABLE movement_track_daily (
+    species_id INT NOT NULL REFERENCES species(species_id) ON DELETE CASCADE,
+    day DATE NOT NULL,
+    fix_count INT NOT NULL DEFAULT 0,
+    latitude_sum DOUBLE NOT NULL DEFAULT 0,
+    longitude_sum DOUBLE NOT NULL DEFAULT 0,
+    first_fix_at TIMESTAMP NULL,
+    last_fix_at TIMESTAMP NULL,
+    PRIMARY KEY (species_id, day)
+);
+CREATE TABLE table_row_counts (
+    table_name VARCHAR(64) NOT NULL,
+    slot INT NOT NULL DEFAULT 0,
+    row_count BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (table_name, slot)
+);
+CREATE TABLE change_feed_consumers (
+    consumer VARCHAR(64) PRIMARY KEY,
+    watermark BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+"""
+
+# Tables in the change feed and their keys (see changefeed.py)
+FEED_KEYS = {"habitat": "habitat_id", "species": "species_id", "movement": "movement_id",
+             "health_record": "health_record_id", "interaction": "interaction_id", "report": "report_id",
+             "users": "user_id"}
+
+COUNTED_BY_TRIGGERS = ["habitat", "species", "movement", "health_record", "interaction", "users",
+                       "report", "made_on", "resides_in", "audit_log"]
+
+# Rebuilds the rollups in one pass each after a bulk load (the MySQL triggers keep them current there)
+SQLITE_ROLLUPS = """
+DELETE FROM species_activity_summary;
+INSERT INTO species_activity_summary (species_id, movement_count, last_movement_at, health_record_count,
+                                      last_health_date, latest_health_status, latest_disease,
+                                      interaction_count, last_interaction_date, latest_incident_type)
+SELECT sp.species_id,
+       (SELECT COUNT(*) FROM movement m WHERE m.species_id = sp.species_id),
+       (SELECT MAX(timestamp) FROM movement m WHERE m.species_id = sp.species_id),
+       (SELECT COUNT(*) FROM health_record h WHERE h.species_id = sp.species_id),
+       (SELECT MAX(date_recorded) FROM health_record h WHERE h.species_id = sp.species_id),
+       (SELECT health_status FROM health_record h WHERE h.species_id = sp.species_id
+        ORDER BY date_recorded DESC, health_record_id DESC LIMIT 1),
+       (SELECT disease FROM health_record h WHERE h.species_id = sp.species_id
+        ORDER BY date_recorded DESC, health_record_id DESC LIMIT 1),
+       (SELECT COUNT(*) FROM interaction i WHERE i.species_id = sp.species_id),
+       (SELECT MAX(date_recorded) FROM interaction i WHERE i.species_id = sp.species_id),
+       (SELECT incident_type FROM interaction i WHERE i.species_id = sp.species_id
+        ORDER BY date_recorded DESC, interaction_id DESC LIMIT 1)
+FROM species sp;
+DELETE FROM movement_track_daily;
+INSERT INTO movement_track_daily (species_id, day, fix_count, latitude_sum, longitude_sum, first_fix_at, last_fix_at)
+SELECT species_id, DATE(timestamp), COUNT(*), SUM(latitude), SUM(longitude), MIN(timestamp), MAX(timestamp)
+FROM movement
+WHERE species_id IS NOT NULL AND timestamp IS NOT NULL AND latitude IS NOT NULL AND longitude IS NOT NULL
+GROUP BY species_id, DATE(timestamp);
+"""
+
+# Write-path triggers, created after the bulk load so that write_record pays the same upkeep as on MySQL
+SQLITE_TRIGGERS = """
+CREATE TRIGGER before_movement_insert_species BEFORE INSERT ON movement
+WHEN NEW.species_id IS NOT NULL AND NOT EXISTS (SELECT 1 FROM species WHERE species_id = NEW.species_id)
+BEGIN
+    SELECT RAISE(ABORT, 'movement.species_id does not match any species');
+END;
+CREATE TRIGGER before_movement_update_species BEFORE UPDATE OF species_id ON movement
+WHEN NEW.species_id IS NOT NULL AND NOT EXISTS (SELECT 1 FROM species WHERE species_id = NEW.species_id)
+BEGIN
+    SELECT RAISE(ABORT, 'movement.species_id does not match any species');
+END;
+CREATE TRIGGER before_species_delete_movement BEFORE DELETE ON species
+WHEN EXISTS (SELECT 1 FROM movement WHERE species_id = OLD.species_id)
+BEGIN
+    SELECT RAISE(ABORT, 'Cannot delete a species that still has movement rows');
+END;
+CREATE TRIGGER before_species_update_movement BEFORE UPDATE OF species_id ON species
+WHEN NEW.species_id <> OLD.species_id AND EXISTS (SELECT 1 FROM movement WHERE species_id = OLD.species_id)
+BEGIN
+    SELECT RAISE(ABORT, 'Cannot renumber a species that still has movement rows');
+END;
+CREATE TRIGGER after_species_insert AFTER INSERT ON species
+BEGIN
+    INSERT INTO audit_log (table_name, operation, record_id, new_value)
+    VALUES ('species', 'INSERT', NEW.species_id, NEW.common_name);
+END;
+CREATE TRIGGER after_movement_insert AFTER INSERT ON movement
+WHEN NEW.species_id IS NOT NULL
+BEGIN
+    INSERT INTO species_activity_summary (species_id, movement_count, last_movement_at)
+    VALUES (NEW.species_id, 1, NEW.timestamp)
+    ON CONFLICT (species_id) DO UPDATE SET
+        movement_count = movement_count + 1,
+        last_movement_at = MAX(COALESCE(last_movement_at, excluded.last_movement_at), excluded.last_movement_at);
+END;
+CREATE TRIGGER after_movement_insert_track AFTER INSERT ON movement
+WHEN NEW.species_id IS NOT NULL AND NEW.timestamp IS NOT NULL
+     AND NEW.latitude IS NOT NULL AND NEW.longitude IS NOT NULL
+BEGIN
+    INSERT INTO movement_track_daily (species_id, day, fix_count, latitude_sum, longitude_sum, first_fix_at, last_fix_at)
+    VALUES (NEW.species_id, DATE(NEW.timestamp), 1, NEW.latitude, NEW.longitude, NEW.timestamp, NEW.timestamp)
+    ON CONFLICT (species_id, day) DO UPDATE SET
+        fix_count = fix_count + 1,
+        latitude_sum = latitude_sum + excluded.latitude_sum,
+        longitude_sum = longitude_sum + excluded.longitude_sum,
+        first_fix_at = MIN(first_fix_at, excluded.first_fix_at),
+        last_fix_at = MAX(last_fix_at, excluded.last_fix_at);
+END;
+""" + "".join(f"""
+CREATE TRIGGER after_{table}_insert_count AFTER INSERT ON {table}
+BEGIN
+    UPDATE table_row_counts SET row_count = row_count + 1 WHERE table_name = '{table}';
+END;
+CREATE TRIGGER after_{table}_delete_count AFTER DELETE ON {table}
+BEGIN
+    UPDATE table_row_counts SET row_count = row_count - 1 WHERE table_name = '{table}';
+END;
+""" for table in COUNTED_BY_TRIGGERS) + "".join(f"""
+CREATE TRIGGER after_{table}_update_audit AFTER UPDATE ON {table}
+BEGIN
+    INSERT INTO audit_log (table_name, operation, record_id) SELECT '{table}', 'DELETE', OLD.{key} WHERE NEW.{key} <> OLD.{key};
+    INSERT INTO audit_log (table_name, operation, record_id) VALUES ('{table}', 'UPDATE', NEW.{key});
+END;
+CREATE TRIGGER after_{table}_delete_audit AFTER DELETE ON {table}
+BEGIN
+    INSERT INTO audit_log (table_name, operation, record_id) VALUES ('{table}', 'DELETE', OLD.{key});
+END;
+""" + ("" if table == "species" else f"""
+CREATE TRIGGER after_{table}_insert_audit AFTER INSERT ON {table}
+BEGIN
+    INSERT INTO audit_log (table_name, operation, record_id) VALUES ('{table}', 'INSERT', NEW.{key});
+END;
+""") for table, key in FEED_KEYS.items())
+
+
+def connect(args):
+    """Points the shared pool at the benchmark database chosen on the command line."""
+    if args.sqlite:
+        db.use_sqlite(args.sqlite)
+    else:
+        db.DB_CONFIG["database"] = args.mysql_database
+        db.init_pool()
+    refresh_catalog()
+    clear_cache()
+
+
+def _random_timestamps(rng, n):
+    seconds = rng.integers(0, TIME_SPAN_SECONDS, n)
+    return (TIME_START + pd.to_timedelta(seconds, unit="s")).strftime("%Y-%m-%d %H:%M:%S").tolist()
+
+
+def _random_dates(rng, n):
+    days = rng.integers(0, 365, n)
+    return (TIME_START + pd.to_timedelta(days, unit="D")).strftime("%Y-%m-%d").tolist()
+
+
+def _insert_chunks(conn, table, columns, make_chunk, total):
+    """Inserts `total` generated rows with executemany, committing once per chunk."""
+    placeholders = ", ".join(["%s"] * len(columns))
+    query = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders})"
+    cursor = conn.cursor()
+    for start in range(0, total, CHUNK_SIZE):
+        rows = make_chunk(start, min(CHUNK_SIZE, total - start))
+        cursor.executemany(query, rows)
+        conn.commit()
+    cursor.close()
+
+
+def _ids(conn, table, key):
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT {key} FROM {table}")
+    ids = np.array([row[0] for row in cursor.fetchall()], dtype=np.int64)
+    cursor.close()
+    return ids
+
+
+def generate(conn, sizes, seed=0, sqlite=False, password_iterations=None):
+    """
+    Fills the benchmark database with synthetic rows.
+
+    Args:
+        conn: An open connection to the benchmark database.
+        sizes (dict): Number of rows to generate per table (see DEFAULT_SIZES).
+        seed (int): Random seed, so the same sizes always produce the same data.
+        sqlite (bool): Create the stand-in schema first and build its rollups after loading.
+    """
+    rng = np.random.default_rng(seed)
+    if sqlite:
+        cursor = conn.cursor()
+        cursor._cursor.executescript(SQLITE_SCHEMA)
+        cursor.close()
+
+    def pick(values, n):
+        return np.asarray(values, dtype=object)[rng.integers(0, len(values), n)].tolist()
+
+    def habitats(start, n):
+        names = [f"Habitat {i}" for i in range(start + 1, start + n + 1)]
+        areas = np.round(rng.uniform(100, 5000, n), 2).tolist()
+        return list(zip(names, ["West Bengal"] * n, areas, pick(["Mangrove", "Wetland", "Grassland"], n)))
+
+    _insert_chunks(conn, "habitat", ["name", "location", "area_size", "environmental_attributes"],
+                   habitats, sizes["habitat"])
+    habitat_ids = _ids(conn, "habitat", "habitat_id")
+
+    def species(start, n):
+        names = [f"Species {i}" for i in range(start + 1, start + n + 1)]
+        scientific = [f"Genus species{i}" for i in range(start + 1, start + n + 1)]
+        homes = rng.choice(habitat_ids, n).tolist()
+        return list(zip(pick(POPULATION_STATUSES, n), names, scientific, pick(CLASSIFICATIONS, n), homes))
+
+    _insert_chunks(conn, "species", ["population_status", "common_name", "scientific_name", "classification",
+                                     "habitat_id"], species, sizes["species"])
+    species_ids = _ids(conn, "species", "species_id")
+
+    def users(start, n):
+        numbers = range(start + 1, start + n + 1)
+        return [(f"User {i}", f"user{i}@example.com", hash_password(f"password{i}", password_iterations), role)
+                for i, role in zip(numbers, pick(ROLES, n))]
+
+    _insert_chunks(conn, "users", ["name", "email", "password", "role"], users, sizes["users"])
+
+    def movements(start, n):
+        return list(zip(rng.choice(species_ids, n).tolist(), _random_timestamps(rng, n),
+                        np.round(rng.uniform(*LATITUDE_RANGE, n), 6).tolist(),
+                        np.round(rng.uniform(*LONGITUDE_RANGE, n), 6).tolist()))
+
+    _insert_chunks(conn, "movement", ["species_id", "timestamp", "latitude", "longitude"],
+                   movements, sizes["movement"])
+
+    def health_records(start, n):
+        return list(zip(rng.choice(species_ids, n).tolist(), pick(HEALTH_STATUSES, n),
+                        pick(VACCINATION_STATUSES, n), _random_dates(rng, n), pick(["None", "Antibiotics"], n),
+                        pick(DISEASES, n)))
+
+    _insert_chunks(conn, "health_record", ["species_id", "health_status", "vaccination_status", "date_recorded",
+                                           "treatment", "disease"], health_records, sizes["health_record"])
+
+    def interactions(start, n):
+        return list(zip(rng.choice(species_ids, n).tolist(), pick(["Increased patrolling", "Fencing"], n),
+                        _random_dates(rng, n), pick(INCIDENT_TYPES, n), pick(["Core Area", "Buffer Zone"], n)))
+
+    _insert_chunks(conn, "interaction", ["species_id", "mitigation_efforts", "date_recorded", "incident_type",
+                                         "location"], interactions, sizes["interaction"])
+
+    def audit_entries(start, n):
+        return list(zip(pick(["species", "movement"], n), pick(["INSERT", "UPDATE", "DELETE"], n),
+                        rng.choice(species_ids, n).tolist(), _random_timestamps(rng, n)))
+
+    _insert_chunks(conn, "audit_log", ["table_name", "operation", "record_id", "changed_at"],
+                   audit_entries, sizes["audit_log"])
+
+    if sqlite:
+        cursor = conn.cursor()
+        cursor._cursor.executescript(SQLITE_ROLLUPS)
+        cursor.executemany("INSERT INTO table_row_counts (table_name, row_count) VALUES (%s, 0)",
+                           [(table,) for table in COUNTED_BY_TRIGGERS])
+        for table in COUNTED_BY_TRIGGERS:
+            cursor.execute(f"UPDATE table_row_counts SET row_count = (SELECT COUNT(*) FROM {table}) "
+                           f"WHERE table_name = %s", (table,))
+        cursor._cursor.executescript(SQLITE_TRIGGERS)
+        conn.commit()
+        cursor.close()
+
+
+def build_scenarios(seed=0):
+    """
+    Returns the benchmarked calls, keyed by the dashboard function they stand in for.
+
+    Each scenario is a function of the iteration number that returns the result
+    the dashboard would render, so rows transferred can be counted.
+    """
+    rng = np.random.default_rng(seed)
+    movement_columns = column_names("movement", include_generated=False)
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT MAX(movement_id), COUNT(*) FROM movement")
+        max_movement, _ = cursor.fetchone()
+        cursor.execute("SELECT species_id FROM species")
+        species_ids = [row[0] for row in cursor.fetchall()]
+        cursor.execute("SELECT COUNT(*) FROM users")
+        user_count = cursor.fetchone()[0]
+        cursor.close()
+    deep_key = int((max_movement or 0) * 0.9)
+
+    def write_record(i):
+        timestamp = (TIME_START + pd.Timedelta(seconds=int(rng.integers(0, TIME_SPAN_SECONDS)))).to_pydatetime()
+        insert_row("movement", ["species_id", "timestamp", "latitude", "longitude"],
+                   [int(rng.choice(species_ids)), timestamp, round(float(rng.uniform(*LATITUDE_RANGE)), 6),
+                    round(float(rng.uniform(*LONGITUDE_RANGE)), 6)])
+        return 1
+
+    def check_login(i):
+        # Imported here so a changed auth module is always picked up
+        from auth import check_user
+        n = int(rng.integers(1, user_count + 1)) if user_count else 1
+        return check_user(f"user{n}@example.com", f"password{n}")
+
+    token = issue_token({"user_id": 1, "name": "User 1", "role": ROLES[0]})
+
+    return {
+        "display_table": lambda i: fetch_page("movement", "movement_id", movement_columns)["data"],
+        "display_table_deep": lambda i: fetch_page("movement", "movement_id", movement_columns,
+                                                   after=deep_key)["data"],
+        "count_records": lambda i: count_tables(COUNTED_TABLES),
+        "display_species_summary": lambda i: species_summary(),
+        "display_species_info": lambda i: endangered_species_info(),
+        "get_species_from_large_habitats": lambda i: species_from_large_habitats(2500),
+        "check_user": check_login,
+        "verify_session": lambda i: verify_token(token),
+        "search": lambda i: search("net entanglements near the buffer zone", page=i % 3)["data"],
+        "write_record": write_record,
+    }
+
+
+def rows_in(result):
+    """Counts the rows a scenario transferred from the database."""
+    if result is None:
+        return 0
+    if isinstance(result, (pd.DataFrame, list)):
+        return len(result)
+    if isinstance(result, int):
+        return result
+    return 1
+
+
+def run_scenario(scenario, iterations, warm_cache=False):
+    """
+    Times one scenario.
+
+    Timed iterations run without tracing; one extra traced call measures peak
+    Python memory, which tracemalloc would otherwise inflate the timings of.
+
+    Returns:
+        dict: Latency percentiles in milliseconds, rows per call and peak memory in bytes.
+    """
+    timings = []
+    rows = 0
+    for i in range(iterations):
+        if not warm_cache:
+            clear_cache()
+            auth.clear_user_cache()
+        start = time.perf_counter()
+        result = scenario(i)
+        timings.append((time.perf_counter() - start) * 1000)
+        rows += rows_in(result)
+
+    if not warm_cache:
+        clear_cache()
+        auth.clear_user_cache()
+    tracemalloc.start()
+    scenario(iterations)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    timings = np.array(timings)
+    return {
+        "iterations": iterations,
+        "p50_ms": float(np.percentile(timings, 50)),
+        "p95_ms": float(np.percentile(timings, 95)),
+        "p99_ms": float(np.percentile(timings, 99)),
+        "mean_ms": float(timings.mean()),
+        "rows_per_call": rows / iterations,
+        "peak_memory_bytes": peak,
+    }
+
+
+def table_sizes():
+    sizes = {}
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        for table in DEFAULT_SIZES:
+            cursor.execute(f"SELECT COUNT(*) FROM {table}")
+            sizes[table] = cursor.fetchone()[0]
+        cursor.close()
+    return sizes
+
+
+def run(args):
+    connect(args)
+    auth.PASSWORD_ITERATIONS = args.password_iterations
+    scenarios = build_scenarios(args.seed)
+    names = args.scenarios or list(scenarios)
+    unknown = [name for name in names if name not in scenarios]
+    if unknown:
+        raise SystemExit(f"Unknown scenarios: {', '.join(unknown)}")
+
+    report = {
+        "backend": db.DB_BACKEND,
+        "database": args.sqlite or args.mysql_database,
+        "python": platform.python_version(),
+        "started_at": pd.Timestamp.now().isoformat(),
+        "warm_cache": args.warm_cache,
+        "sizes": table_sizes(),
+        "scenarios": {},
+    }
+    for name in names:
+        result = run_scenario(scenarios[name], args.iterations, warm_cache=args.warm_cache)
+        report["scenarios"][name] = result
+        print(f"{name:34} p50 {result['p50_ms']:9.2f} ms  p95 {result['p95_ms']:9.2f} ms  "
+              f"p99 {result['p99_ms']:9.2f} ms  rows {result['rows_per_call']:9.1f}  "
+              f"peak {result['peak_memory_bytes'] / 1024:9.1f} KiB")
+
+    with open(args.output, "w") as handle:
+        json.dump(report, handle, indent=2)
+    print(f"Wrote {args.output}")
+
+
+def compare(baseline, current, threshold=DEFAULT_THRESHOLD, metric="p95_ms"):
+    """
+    Compares two benchmark reports.
+
+    Args:
+        baseline (dict): Report of the reference run.
+        current (dict): Report of the new run.
+        threshold (float): Allowed relative slowdown, e.g. 0.2 for 20%.
+        metric (str): Scenario metric to compare.
+
+    Returns:
+        list: (scenario, baseline value, current value, relative change, regressed) tuples.
+    """
+    results = []
+    for name, before in baseline["scenarios"].items():
+        after = current["scenarios"].get(name)
+        if after is None:
+            continue
+        change = (after[metric] - before[metric]) / before[metric] if before[metric] else 0.0
+        results.append((name, before[metric], after[metric], change, change > threshold))
+    return results
+
+
+def compare_command(args):
+    with open(args.baseline) as handle:
+        baseline = json.load(handle)
+    with open(args.current) as handle:
+        current = json.load(handle)
+    if baseline.get("sizes") != current.get("sizes"):
+        print("Warning: the two runs used different data sizes", file=sys.stderr)
+
+    regressions = 0
+    for name, before, after, change, regressed in compare(baseline, current, args.threshold, args.metric):
+        regressions += regressed
+        flag = "REGRESSION" if regressed else ""
+        print(f"{name:34} {before:9.2f} -> {after:9.2f} {args.metric}  {change:+7.1%}  {flag}")
+    if regressions:
+        print(f"{regressions} scenario(s) slower than the {args.threshold:.0%} threshold", file=sys.stderr)
+        sys.exit(1)
+
+
+def generate_command(args):
+    sizes = {table: getattr(args, table) for table in DEFAULT_SIZES}
+    if args.sqlite:
+        if os.path.exists(args.sqlite):
+            os.remove(args.sqlite)
+        conn = db.SQLiteConnection(args.sqlite)
+    else:
+        conn = db.create_connection(database=args.mysql_database)
+    start = time.perf_counter()
+    try:
+        generate(conn, sizes, seed=args.seed, sqlite=bool(args.sqlite), password_iterations=args.password_iterations)
+    finally:
+        conn.close()
+    print(f"Generated {sum(sizes.values())} rows in {time.perf_counter() - start:.1f}s")
+
+
+def add_target(command):
+    """Adds the options choosing the benchmark database to an argument parser (see connect)."""
+    target = command.add_mutually_exclusive_group(required=True)
+    target.add_argument("--sqlite", help="Path of a SQLite stand-in database")
+    target.add_argument("--mysql-database", help="Name of a local MySQL database with the WMCS schema loaded")
+    command.add_argument("--seed", type=int, default=0)
+    command.add_argument("--password-iterations", type=int, default=BENCH_PASSWORD_ITERATIONS,
+                         help="PBKDF2 rounds for generated and checked passwords")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    generate_parser = commands.add_parser("generate", help="Create synthetic data")
+    add_target(generate_parser)
+    for table, size in DEFAULT_SIZES.items():
+        generate_parser.add_argument(f"--{table.replace('_', '-')}", dest=table, type=int, default=size)
+
+    run_parser = commands.add_parser("run", help="Time the dashboard queries")
+    add_target(run_parser)
+    run_parser.add_argument("--iterations", type=int, default=DEFAULT_ITERATIONS)
+    run_parser.add_argument("--warm-cache", action="store_true", help="Keep the query cache between iterations")
+    run_parser.add_argument("--scenarios", nargs="+", help="Only run these scenarios")
+    run_parser.add_argument("--output", default="bench.json")
+
+    compare_parser = commands.add_parser("compare", help="Compare two reports")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    compare_parser.add_argument("--metric", default="p95_ms", choices=["p50_ms", "p95_ms", "p99_ms", "mean_ms"])
+
+    args = parser.parse_args(argv)
+    # pandas warns on every read through a plain DBAPI connection, as the app does
+    warnings.filterwarnings("ignore", message="pandas only supports SQLAlchemy")
+    if args.command == "generate":
+        generate_command(args)
+    elif args.command == "run":
+        run(args)
+    else:
+        compare_command(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import pandas as pd
+
+import db
+from compact import compact_frame
+from db import get_connection
+
+# Memory budget for cached results, in bytes
+CACHE_BYTES = int(os.environ.get("WMCS_CACHE_BYTES", 64 * 1024 * 1024))
+
+# Tables that triggers in WMCS_trig.sql (or ON DELETE CASCADE) write to as a side effect of writing another table
+TRIGGER_TABLES = {
+    "habitat": ["audit_log"],
+    "species": ["audit_log", "species_activity_summary", "movement_track_daily"],
+    "movement": ["species_activity_summary", "movement_track_daily", "audit_log", "movement_position"],
+    "health_record": ["species_activity_summary", "audit_log"],
+    "interaction": ["species_activity_summary", "audit_log"],
+    "report": ["audit_log"],
+    "users": ["audit_log"],
+}
+
+_TABLE_PATTERN = re.compile(r"\b(?:from|join)\s+`?(\w+)`?", re.IGNORECASE)
+
+
+def normalize_sql(query):
+    """Collapses whitespace and trailing semicolons so equivalent queries share a cache key."""
+    return " ".join(query.split()).rstrip(";").strip()
+
+
+def tables_in_query(query):
+    """
+    Finds the tables a query reads from.
+
+    Args:
+        query (str): SQL query text.
+
+    Returns:
+        list: Table names that follow FROM or JOIN, lower-cased.
+    """
+    return sorted({name.lower() for name in _TABLE_PATTERN.findall(query)})
+
+
+class QueryCache:
+    """
+    An LRU cache of query results bounded by memory, invalidated by table writes.
+
+    Every table has a version counter. A cached result remembers the versions
+    of the tables it read, and is thrown away as soon as any of them changes.
+
+    Args:
+        max_bytes (int): Memory budget for all cached DataFrames.
+    """
+
+    def __init__(self, max_bytes=CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._changed_at = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0, "uncacheable": 0}
+
+    def _snapshot(self, tables):
+        return tuple(self._versions.get(table, 0) for table in tables)
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self._bytes -= entry["size"]
+
+    def get(self, key, tables):
+        """Returns the cached DataFrame for `key`, or None if it is missing or stale."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            if entry["versions"] != self._snapshot(tables):
+                self._remove(key)
+                self._stats["invalidations"] += 1
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            return entry["data"]
+
+    def put(self, key, tables, versions, data):
+        """
+        Stores a result, evicting least recently used entries to stay within budget.
+
+        `versions` must be the table versions read before the query ran, so a write
+        that lands while the query is in flight makes the entry stale immediately.
+        """
+        size = int(data.memory_usage(index=True, deep=True).sum())
+        with self._lock:
+            if size > self.max_bytes:
+                self._stats["uncacheable"] += 1
+                return
+            if key in self._entries:
+                self._remove(key)
+            while self._entries and self._bytes + size > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self._stats["evictions"] += 1
+            self._entries[key] = {"data": data, "versions": versions, "size": size}
+            self._bytes += size
+
+    def versions(self, tables):
+        """Returns the current version of each table."""
+        with self._lock:
+            return self._snapshot(tables)
+
+    def bump(self, table_name):
+        """Marks a table (and any table its triggers write to) as changed."""
+        table = table_name.lower()
+        with self._lock:
+            now = time.monotonic()
+            for name in [table] + TRIGGER_TABLES.get(table, []):
+                self._versions[name] = self._versions.get(name, 0) + 1
+                self._changed_at[name] = now
+
+    def changed_within(self, tables, seconds):
+        """Returns whether any of `tables` was bumped in the last `seconds` seconds."""
+        cutoff = time.monotonic() - seconds
+        with self._lock:
+            return any(self._changed_at.get(name, float("-inf")) > cutoff for name in tables)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        """
+        Returns cache counters for the administrator view.
+
+        Returns:
+            dict: Hits, misses, evictions, invalidations, entry count and memory use.
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+            stats["bytes"] = self._bytes
+            stats["max_bytes"] = self.max_bytes
+            stats["table_versions"] = dict(self._versions)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+
+_cache = QueryCache()
+
+
+def cached_read_sql(query, params=None, tables=None):
+    """
+    Runs a read query through the shared result cache.
+
+    Results are converted to compact dtypes (see compact.py). The returned
+    DataFrame is shared between callers and must be treated as read-only.
+
+    Args:
+        query (str): SQL query to run.
+        params (tuple): Query parameters.
+        tables (list): Tables the query depends on. Detected from the SQL when omitted.
+
+    Returns:
+        DataFrame: The query result.
+    """
+    tables = sorted({t.lower() for t in tables}) if tables else tables_in_query(query)
+    key = (normalize_sql(query), tuple(params) if params else ())
+
+    data = _cache.get(key, tables)
+    if data is not None:
+        return data
+
+    versions = _cache.versions(tables)
+    # A replica may not have caught up with a recent write yet, and its answer would stay cached
+    read_only = not _cache.changed_within(tables, db.STICKY_SECONDS)
+    with get_connection(read_only=read_only) as conn:
+        data = pd.read_sql(query, conn, params=params)
+    data = compact_frame(data, tables)
+    _cache.put(key, tables, versions, data)
+    return data
+
+
+def bump_table_version(table_name):
+    """Invalidates every cached result that read from `table_name`. Call after each write."""
+    _cache.bump(table_name)
+
+
+def table_versions(tables):
+    """Returns the current version of each table, for callers keeping their own caches."""
+    return _cache.versions([table.lower() for table in tables])
+
+
+def cache_stats():
+    """Returns the shared cache's counters."""
+    return _cache.stats()
+
+
+def clear_cache():
+    """Drops every cached result."""
+    _cache.clear()
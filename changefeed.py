@@ -0,0 +1,295 @@
+"""
+Change feed over audit_log.
+
+Triggers in WMCS_trig.sql append one (table_name, operation, record_id) row
+to audit_log for every write to the tables the dashboards show. Readers keep
+the last audit_log.id they have seen as a watermark, ask for the changes
+since then and patch only the affected rows instead of re-reading whole
+tables. Consumers report their watermarks to change_feed_consumers so that
+entries everyone has read can be compacted away.
+
+audit_log ids are handed out when a row is inserted but only become visible
+when its transaction commits, so a slow writer can commit an id below one a
+reader has already passed. Ids skipped over are therefore remembered as gaps
+and looked up again on later calls until they show up or are old enough to
+belong to a rolled-back transaction.
+"""
+import os
+import threading
+import time
+
+import pandas as pd
+
+import db
+from cache import bump_table_version, clear_cache
+from compact import compact_frame
+from db import get_connection
+from schema import column_names, primary_key
+
+# Tables whose writes are logged (see the change feed triggers in WMCS_trig.sql)
+FEED_TABLES = ("habitat", "species", "movement", "health_record", "interaction", "report", "users")
+# Most entries read per call; callers that get `truncated` back should ask again
+MAX_CHANGES = 10000
+# How often the process-wide cache sync polls the feed, in seconds
+SYNC_INTERVAL = 1.0
+# Seconds a skipped id is waited for before it is taken to be a rolled-back insert
+GAP_SECONDS = float(os.environ.get("WMCS_FEED_GAP_SECONDS", 300))
+# Most skipped ids remembered at once; the oldest are given up first
+MAX_GAPS = 10000
+
+
+def _empty_delta(watermark):
+    return {"watermark": watermark, "tables": {}, "truncated": False, "reset": False, "gaps": {}}
+
+
+def current_watermark():
+    """Returns the newest audit_log.id, or 0 when the log is empty."""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT COALESCE(MAX(id), 0) FROM audit_log")
+        watermark = cursor.fetchone()[0]
+        cursor.close()
+    return int(watermark)
+
+
+def changes_since(watermark, tables=None, limit=MAX_CHANGES, gaps=None):
+    """
+    Returns the net effect of the changes logged after `watermark`.
+
+    Several changes to one row collapse into its final state: a row that was
+    updated and then deleted is only reported as deleted, and a row deleted
+    and re-inserted is reported as upserted. Writes to one row commit in id
+    order, so an entry that turns up late in a gap never overrides a later
+    change to the same row.
+
+    Args:
+        watermark (int): The last audit_log.id the caller has applied.
+        tables (list): Only report these tables. The watermark still advances past other tables' entries.
+        limit (int): Most entries to read in one call.
+        gaps (dict): The "gaps" returned by the previous call, if any.
+
+    Returns:
+        dict: "watermark" to pass next time; "tables" mapping each changed table to
+        {"upserted": set of keys, "deleted": set of keys}; "gaps", the ids below the
+        watermark still waited for, to pass next time; "truncated" when more
+        entries remain; and "reset" when entries after `watermark` were already
+        compacted away, in which case the caller must reload from scratch.
+    """
+    now = time.time()
+    waiting = {int(entry_id): seen for entry_id, seen in (gaps or {}).items() if now - seen < GAP_SECONDS}
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT MIN(id) FROM audit_log")
+        oldest = cursor.fetchone()[0]
+        cursor.execute("SELECT id, table_name, operation, record_id FROM audit_log "
+                       "WHERE id > %s ORDER BY id LIMIT %s", (int(watermark), int(limit)))
+        entries = cursor.fetchall()
+        filled = []
+        if waiting:
+            gap_ids = sorted(waiting)
+            cursor.execute("SELECT id, table_name, operation, record_id FROM audit_log "
+                           f"WHERE id IN ({', '.join(['%s'] * len(gap_ids))})", tuple(gap_ids))
+            filled = cursor.fetchall()
+        cursor.close()
+
+    delta = _empty_delta(int(watermark))
+    delta["reset"] = bool(watermark) and oldest is not None and oldest > watermark + 1
+    delta["truncated"] = len(entries) >= limit
+    for entry in filled:
+        waiting.pop(int(entry[0]), None)
+    previous = int(watermark)
+    for entry in entries:
+        # Every id between two we can see belongs to a transaction that has not committed (yet)
+        first = max(previous + 1, int(entry[0]) - MAX_GAPS)
+        waiting.update((skipped, now) for skipped in range(first, int(entry[0])))
+        previous = int(entry[0])
+    if len(waiting) > MAX_GAPS:
+        waiting = dict(sorted(waiting.items())[-MAX_GAPS:])
+    delta["gaps"] = waiting
+
+    wanted = set(tables) if tables else set(FEED_TABLES)
+    for entry_id, table_name, operation, record_id in sorted(filled) + list(entries):
+        delta["watermark"] = max(delta["watermark"], int(entry_id))
+        if table_name not in wanted or record_id is None:
+            continue
+        changes = delta["tables"].setdefault(table_name, {"upserted": set(), "deleted": set()})
+        key = int(record_id)
+        if operation == "DELETE":
+            changes["upserted"].discard(key)
+            changes["deleted"].add(key)
+        else:
+            changes["deleted"].discard(key)
+            changes["upserted"].add(key)
+    return delta
+
+
+def safe_watermark(delta):
+    """
+    Returns the watermark a consumer can acknowledge after applying `delta`.
+
+    It stays below every gap still waited for, so compact_change_log cannot
+    delete a late entry before it has been read.
+    """
+    return min([delta["watermark"]] + [entry_id - 1 for entry_id in delta["gaps"]])
+
+
+def merge_changes(pending, delta):
+    """Folds a newer delta into accumulated per-table changes, in place, and returns them."""
+    for table_name, changes in delta["tables"].items():
+        merged = pending.setdefault(table_name, {"upserted": set(), "deleted": set()})
+        merged["upserted"] = (merged["upserted"] - changes["deleted"]) | changes["upserted"]
+        merged["deleted"] = (merged["deleted"] - changes["upserted"]) | changes["deleted"]
+    return pending
+
+
+def fetch_rows(table_name, keys, columns=None, chunk_size=1000):
+    """
+    Reads the current version of specific rows by primary key.
+
+    Args:
+        table_name (str): Table to read.
+        keys (iterable): Primary key values.
+        columns (list): Columns to read; all non-generated columns by default.
+        chunk_size (int): Keys per IN list.
+
+    Returns:
+        DataFrame: The rows that still exist, with compact dtypes.
+    """
+    key_column = primary_key(table_name)[0]
+    columns = columns or column_names(table_name, include_generated=False)
+    if key_column not in columns:
+        columns = [key_column] + list(columns)
+    keys = sorted(keys)
+    select_list = ", ".join(f"`{c}`" for c in columns)
+    frames = []
+    with get_connection() as conn:
+        for start in range(0, len(keys), chunk_size):
+            chunk = keys[start:start + chunk_size]
+            query = (f"SELECT {select_list} FROM `{table_name}` "
+                     f"WHERE `{key_column}` IN ({', '.join(['%s'] * len(chunk))})")
+            frames.append(pd.read_sql(query, conn, params=tuple(chunk)))
+    if not frames:
+        return pd.DataFrame(columns=columns)
+    return compact_frame(pd.concat(frames, ignore_index=True), [table_name])
+
+
+def apply_changes(frame, table_name, changes, key_range=None):
+    """
+    Patches a DataFrame read earlier so it reflects `changes`.
+
+    Deleted rows are dropped. Upserted rows are re-read by key and replace or
+    join the existing ones, keeping the frame sorted by key.
+
+    Args:
+        frame (DataFrame): Rows of `table_name`, including its primary key column.
+        table_name (str): Table the frame was read from.
+        changes (dict): {"upserted": keys, "deleted": keys} for this table.
+        key_range (tuple): (low, high) inclusive bounds. Upserts outside them are ignored,
+            e.g. to keep a page to its window.
+
+    Returns:
+        DataFrame: The patched frame.
+    """
+    key_column = primary_key(table_name)[0]
+    upserted = set(changes["upserted"])
+    if key_range is not None:
+        low, high = key_range
+        upserted = {key for key in upserted if (low is None or key >= low) and (high is None or key <= high)}
+    touched = upserted | set(changes["deleted"])
+    if not touched:
+        return frame
+
+    patched = frame[~frame[key_column].isin(list(touched))]
+    if upserted:
+        fresh = fetch_rows(table_name, upserted, columns=list(frame.columns))[list(frame.columns)]
+        patched = pd.concat([patched, fresh], ignore_index=True)
+    return patched.sort_values(key_column).reset_index(drop=True)
+
+
+def acknowledge(consumer, watermark):
+    """
+    Records that `consumer` has applied every change up to `watermark`.
+
+    Args:
+        consumer (str): Stable name of the reader, e.g. a session id.
+        watermark (int): The last audit_log.id it applied.
+    """
+    if db.DB_BACKEND == "sqlite":
+        query = ("INSERT INTO change_feed_consumers (consumer, watermark, updated_at) "
+                 "VALUES (%s, %s, CURRENT_TIMESTAMP) ON CONFLICT (consumer) DO UPDATE SET "
+                 "watermark = excluded.watermark, updated_at = CURRENT_TIMESTAMP")
+    else:
+        query = ("INSERT INTO change_feed_consumers (consumer, watermark) VALUES (%s, %s) "
+                 "ON DUPLICATE KEY UPDATE watermark = VALUES(watermark)")
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(query, (consumer, int(watermark)))
+        conn.commit()
+        cursor.close()
+
+
+def compact_change_log(retention_hours=24 * 7, stale_hours=24):
+    """
+    Deletes audit_log entries that every active consumer has applied.
+
+    Consumers that have not acknowledged anything for `stale_hours` are ignored
+    (and dropped), so an abandoned session cannot hold the log back forever;
+    if it comes back, changes_since reports a reset. Entries younger than
+    `retention_hours` are always kept for the Administrator's audit view.
+
+    Returns:
+        int: Number of entries deleted.
+    """
+    if db.DB_BACKEND == "sqlite":
+        stale = f"datetime('now', '-{int(stale_hours)} hours')"
+        retained = f"datetime('now', '-{int(retention_hours)} hours')"
+    else:
+        stale = f"NOW() - INTERVAL {int(stale_hours)} HOUR"
+        retained = f"NOW() - INTERVAL {int(retention_hours)} HOUR"
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"DELETE FROM change_feed_consumers WHERE updated_at < {stale}")
+        cursor.execute("SELECT MIN(watermark) FROM change_feed_consumers")
+        consumed = cursor.fetchone()[0]
+        deleted = 0
+        if consumed is not None:
+            # The last consumed entry stays behind so changes_since can still tell a gap from an empty log
+            cursor.execute(f"DELETE FROM audit_log WHERE id < %s AND changed_at < {retained}", (int(consumed),))
+            deleted = cursor.rowcount
+        conn.commit()
+        cursor.close()
+    bump_table_version("audit_log")
+    return deleted
+
+
+_sync_lock = threading.Lock()
+_sync_state = {"watermark": None, "gaps": {}, "checked_at": 0.0}
+
+
+def sync_cache(interval=SYNC_INTERVAL):
+    """
+    Invalidates cached results for tables written by other processes.
+
+    The query cache only sees writes made through this process. Polling the
+    feed at most once per `interval` seconds catches the rest (the ingest CLI,
+    other app instances, manual SQL) for the cost of one indexed read.
+
+    Returns:
+        list: Tables whose cached results were invalidated.
+    """
+    with _sync_lock:
+        now = time.monotonic()
+        if now - _sync_state["checked_at"] < interval:
+            return []
+        _sync_state["checked_at"] = now
+        if _sync_state["watermark"] is None:
+            _sync_state["watermark"] = current_watermark()
+            return []
+        delta = changes_since(_sync_state["watermark"], gaps=_sync_state["gaps"])
+        _sync_state["watermark"] = delta["watermark"]
+        _sync_state["gaps"] = delta["gaps"]
+    if delta["reset"]:
+        clear_cache()
+    for table_name in delta["tables"]:
+        bump_table_version(table_name)
+    return list(delta["tables"])
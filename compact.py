@@ -0,0 +1,190 @@
+"""
+Compact, typed DataFrames for query results.
+
+The driver hands back Python objects: strings, Decimals, dates. compact_frame
+converts each column in one vectorized step to the smallest pandas dtype that
+holds its SQL type. The type is looked up in the schema catalog, or inferred
+from the values for computed columns and aliases.
+"""
+import datetime
+import decimal
+import re
+
+import numpy as np
+import pandas as pd
+from db import get_connection
+from schema import column_names, get_table, primary_key
+
+# Nullable integer dtype per SQL integer type
+INTEGER_DTYPES = {"tinyint": "Int8", "smallint": "Int16", "mediumint": "Int32", "int": "Int32",
+                  "integer": "Int32", "bigint": "Int64"}
+# float32 keeps about 7 significant digits; wider decimals (e.g. coordinates at decimal(9,6)) need float64
+FLOAT32_MAX_PRECISION = 7
+DATETIME_TYPES = ("date", "datetime", "timestamp")
+STRING_TYPES = ("char", "varchar", "enum")
+
+# Strings become categories only in results at least this long with at most this share of distinct values
+CATEGORY_MIN_ROWS = 64
+CATEGORY_MAX_RATIO = 0.5
+
+
+def _sql_dtype(column):
+    """Maps a catalog column entry to a pandas dtype, "category?" for candidate categories, or None."""
+    data_type = column["data_type"]
+    if data_type in INTEGER_DTYPES:
+        return INTEGER_DTYPES[data_type]
+    if data_type == "decimal":
+        match = re.search(r"\((\d+)", column["column_type"] or "")
+        precision = int(match.group(1)) if match else 10
+        return "float32" if precision <= FLOAT32_MAX_PRECISION else "float64"
+    if data_type in ("float", "real"):
+        return "float32"
+    if data_type == "double":
+        return "float64"
+    if data_type in DATETIME_TYPES:
+        return "datetime64[ns]"
+    if data_type in STRING_TYPES:
+        return "category?"
+    return None
+
+
+def column_dtypes(tables):
+    """
+    Returns the target dtype of every column of `tables`, keyed by column name.
+
+    When several tables share a column name the first table wins, which is
+    right for join keys such as species_id.
+    """
+    dtypes = {}
+    for table in tables or []:
+        try:
+            columns = get_table(table)["columns"]
+        except KeyError:
+            continue
+        for column in columns:
+            dtype = _sql_dtype(column)
+            if dtype is not None:
+                dtypes.setdefault(column["name"], dtype)
+    return dtypes
+
+
+def _infer_dtype(series):
+    """Picks a dtype for a column that is not in the catalog, from its first non-null value."""
+    non_null = series.dropna()
+    if non_null.empty:
+        return None
+    sample = non_null.iloc[0]
+    if isinstance(sample, decimal.Decimal):
+        return "float64"
+    if isinstance(sample, (datetime.date, datetime.datetime)):
+        return "datetime64[ns]"
+    if isinstance(sample, str):
+        return "category?"
+    return None
+
+
+def _is_textual(series):
+    return series.dtype == object or pd.api.types.is_string_dtype(series.dtype)
+
+
+def _convert(series, dtype, categories=True):
+    if dtype == "category?":
+        if not categories or not _is_textual(series) or len(series) < CATEGORY_MIN_ROWS:
+            return series
+        if series.nunique(dropna=True) > len(series) * CATEGORY_MAX_RATIO:
+            return series
+        return series.astype("category")
+    if dtype == "datetime64[ns]":
+        if pd.api.types.is_datetime64_any_dtype(series.dtype):
+            return series
+        try:
+            return pd.to_datetime(series, format="ISO8601")
+        except (TypeError, ValueError):
+            return pd.to_datetime(series)
+    if dtype.startswith("float"):
+        return pd.to_numeric(series).astype(dtype)
+    if dtype.startswith("Int"):
+        if _is_textual(series):
+            series = pd.to_numeric(series)
+        return series.astype(dtype)
+    return series
+
+
+def compact_frame(data, tables=None, categories=True):
+    """
+    Converts a query result to compact dtypes.
+
+    Integers become nullable Int8/16/32/64. Decimals become float32 or float64
+    depending on their precision. Dates and timestamps become datetime64.
+    Repetitive strings become categories. A column that fails to convert is
+    left as it was.
+
+    Args:
+        data (DataFrame): Result as returned by pd.read_sql.
+        tables (list): Tables the query read, used to look up column types.
+        categories (bool): Whether strings may become categories. Turn it off when
+            chunks of one result are converted separately and must share a schema.
+
+    Returns:
+        DataFrame: A new DataFrame with converted columns.
+    """
+    if data.empty:
+        return data
+    dtypes = column_dtypes(tables)
+    converted = {}
+    for name in data.columns:
+        series = data[name]
+        dtype = dtypes.get(name) or (_infer_dtype(series) if _is_textual(series) else None)
+        if dtype is None:
+            continue
+        try:
+            converted[name] = _convert(series, dtype, categories=categories)
+        except (TypeError, ValueError, OverflowError):
+            continue
+    return data.assign(**converted) if converted else data
+
+
+def memory_report(before, after):
+    """
+    Compares the memory used by each column of two versions of a result.
+
+    Args:
+        before (DataFrame): The result as read by pd.read_sql.
+        after (DataFrame): The same result after compact_frame.
+
+    Returns:
+        DataFrame: Per-column dtypes and bytes before and after, plus a total row.
+    """
+    before_bytes = before.memory_usage(index=False, deep=True)
+    after_bytes = after.memory_usage(index=False, deep=True)
+    report = pd.DataFrame({
+        "column": list(before.columns),
+        "dtype_before": [str(before[c].dtype) for c in before.columns],
+        "bytes_before": before_bytes.to_numpy(),
+        "dtype_after": [str(after[c].dtype) for c in before.columns],
+        "bytes_after": after_bytes.to_numpy(),
+    })
+    total = pd.DataFrame({"column": ["TOTAL"], "dtype_before": [""], "bytes_before": [before_bytes.sum()],
+                          "dtype_after": [""], "bytes_after": [after_bytes.sum()]})
+    report = pd.concat([report, total], ignore_index=True)
+    report["saved"] = 1 - report["bytes_after"] / report["bytes_before"].replace(0, np.nan)
+    return report
+
+
+def table_memory_report(table_name, limit=10000):
+    """
+    Reads up to `limit` rows of a table both ways and reports the memory saved.
+
+    Args:
+        table_name (str): Table to sample.
+        limit (int): Number of rows to read.
+
+    Returns:
+        DataFrame: See memory_report.
+    """
+    columns = ", ".join(f"`{c}`" for c in column_names(table_name, include_generated=False))
+    order = ", ".join(f"`{c}`" for c in primary_key(table_name)) or "1"
+    with get_connection(read_only=True) as conn:
+        raw = pd.read_sql(f"SELECT {columns} FROM `{table_name}` ORDER BY {order} LIMIT %s", conn,
+                          params=(int(limit),))
+    return memory_report(raw, compact_frame(raw, [table_name]))
@@ -0,0 +1,102 @@
+"""
+Row counts for the dashboards that never scan a table.
+
+Exact counts are kept in table_row_counts by triggers (see WMCS_trig.sql).
+Approximate counts come from the database's statistics: information_schema
+on MySQL and sqlite_stat1 (filled by ANALYZE) on the SQLite stand-in.
+"""
+import pandas as pd
+
+import db
+from cache import cached_read_sql
+from db import get_connection
+
+
+def _placeholders(values):
+    return ", ".join(["%s"] * len(values))
+
+
+def exact_counts(tables):
+    """Reads trigger-maintained counts from table_row_counts for all `tables` in one query, summing their slots."""
+    query = f"""
+        SELECT table_name, SUM(row_count) AS row_count
+        FROM table_row_counts
+        WHERE table_name IN ({_placeholders(tables)})
+        GROUP BY table_name
+    """
+    return cached_read_sql(query, tuple(tables), tables=tables)
+
+
+def _sqlite_estimates(tables):
+    """Reads the row estimates ANALYZE left in sqlite_stat1; tables it has not analyzed are missing."""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'")
+        analyzed = cursor.fetchone()[0] > 0
+        cursor.close()
+    if not analyzed:
+        return pd.DataFrame(columns=["table_name", "row_count"])
+    # stat starts with the row count of the table (or index) it describes
+    query = f"""
+        SELECT tbl AS table_name, MAX(CAST(stat AS INTEGER)) AS row_count
+        FROM sqlite_stat1
+        WHERE tbl IN ({_placeholders(tables)})
+        GROUP BY tbl
+    """
+    return cached_read_sql(query, tuple(tables), tables=tables)
+
+
+def approximate_counts(tables):
+    """Reads the statistics' row estimates for all `tables` in one query."""
+    if db.DB_BACKEND == "sqlite":
+        return _sqlite_estimates(tables)
+    query = f"""
+        SELECT TABLE_NAME AS table_name, TABLE_ROWS AS row_count
+        FROM information_schema.TABLES
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME IN ({_placeholders(tables)})
+    """
+    return cached_read_sql(query, tuple(tables), tables=tables)
+
+
+def count_tables(tables, approximate=False):
+    """
+    Returns row counts for several tables without scanning any of them.
+
+    Exact counts come from table_row_counts (see WMCS_trig.sql). Tables that
+    have no counter row fall back to the statistics estimate, and are marked
+    as not exact.
+
+    Args:
+        tables (list): Table names to count.
+        approximate (bool): Use the statistics estimate for every table (on MySQL; the
+            SQLite stand-in still reads its counters and reports them as exact).
+
+    Returns:
+        DataFrame: table_name, row_count and exact, in the order of `tables`.
+    """
+    tables = list(tables)
+    if not tables:
+        return pd.DataFrame(columns=["table_name", "row_count", "exact"])
+
+    counts = {}
+    exact = set()
+    # The stand-in's statistics only exist after ANALYZE, and its counters are just as cheap to read
+    if not approximate or db.DB_BACKEND == "sqlite":
+        for row in exact_counts(tables).itertuples(index=False):
+            counts[row.table_name] = int(row.row_count)
+            exact.add(row.table_name)
+    missing = [table for table in tables if table not in counts]
+    if missing:
+        for row in approximate_counts(missing).itertuples(index=False):
+            counts[row.table_name] = None if pd.isna(row.row_count) else int(row.row_count)
+
+    return pd.DataFrame({
+        "table_name": tables,
+        "row_count": [counts.get(table) for table in tables],
+        "exact": [table in exact for table in tables],
+    })
+
+
+def count_table(table_name, approximate=False):
+    """Returns the row count of one table, or None if it is unknown."""
+    return count_tables([table_name], approximate=approximate)["row_count"].iloc[0]
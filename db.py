@@ -1,10 +1,582 @@
+import contextvars
+import itertools
+import os
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
 import mysql.connector
+from instrumentation import INSTRUMENT, InstrumentedConnection
+
+DB_CONFIG = {
+    "host": "localhost",
+    "user": "root",
+    "password": "QWE,rty123",
+    "database": "WMCS",
+}
+
+# "mysql" for the real database, "sqlite" for a local stand-in file (benchmarks, offline work)
+DB_BACKEND = os.environ.get("WMCS_DB_BACKEND", "mysql")
+SQLITE_PATH = os.environ.get("WMCS_SQLITE_PATH", "wmcs.sqlite3")
+
+# Pool sizing can be tuned per deployment without touching the code
+POOL_SIZE = int(os.environ.get("WMCS_POOL_SIZE", 5))
+POOL_TIMEOUT = float(os.environ.get("WMCS_POOL_TIMEOUT", 10))
+# Connections idle for longer than this are pinged before being handed out
+POOL_RECYCLE = float(os.environ.get("WMCS_POOL_RECYCLE", 300))
 
-def create_connection():
-    connection = mysql.connector.connect(
-        host="localhost",
-        user="root",
-        password="QWE,rty123",
-        database="WMCS"
-    )
+# Read replicas as comma-separated host[:port] entries, e.g. "10.0.0.2,10.0.0.3:3307".
+# Empty means every query goes to the primary (DB_CONFIG).
+REPLICA_HOSTS = [h.strip() for h in os.environ.get("WMCS_REPLICAS", "").split(",") if h.strip()]
+# "least_loaded" picks the replica with the fewest checked-out connections, "round_robin" rotates
+REPLICA_STRATEGY = os.environ.get("WMCS_REPLICA_STRATEGY", "least_loaded")
+# Replicas further behind than this many seconds (or not replicating) are skipped
+REPLICA_MAX_LAG = float(os.environ.get("WMCS_REPLICA_MAX_LAG", 5))
+REPLICA_CHECK_INTERVAL = float(os.environ.get("WMCS_REPLICA_CHECK_INTERVAL", 2))
+# After a session commits a write its reads stay on the primary this long, so it sees its own
+# writes; keep it at least REPLICA_MAX_LAG
+STICKY_SECONDS = float(os.environ.get("WMCS_STICKY_SECONDS", REPLICA_MAX_LAG))
+
+
+def create_connection(**options):
+    """Opens a new connection. Extra keyword arguments are passed to the driver (e.g. allow_local_infile)."""
+    if DB_BACKEND == "sqlite":
+        return SQLiteConnection(options.get("database", SQLITE_PATH))
+    connection = mysql.connector.connect(**{**DB_CONFIG, **options})
     return connection
+
+
+def replica_config(host):
+    """Returns DB_CONFIG pointed at a replica given as host[:port]."""
+    name, _, port = host.partition(":")
+    config = {**DB_CONFIG, "host": name}
+    if port:
+        config["port"] = int(port)
+    return config
+
+
+class SQLiteCursor:
+    """
+    A sqlite3 cursor that accepts the mysql.connector calling conventions used
+    throughout the app: %s placeholders and dictionary rows.
+    """
+
+    def __init__(self, cursor, dictionary=False):
+        self._cursor = cursor
+        self._dictionary = dictionary
+
+    @staticmethod
+    def _translate(query):
+        return query.replace("%s", "?")
+
+    def execute(self, query, params=None):
+        self._cursor.execute(self._translate(query), tuple(params) if params else ())
+        return self
+
+    def executemany(self, query, seq_of_params):
+        self._cursor.executemany(self._translate(query), seq_of_params)
+        return self
+
+    def _row(self, row):
+        if row is None or not self._dictionary:
+            return row
+        return dict(zip([column[0] for column in self._cursor.description], row))
+
+    def fetchone(self):
+        return self._row(self._cursor.fetchone())
+
+    def fetchmany(self, size=1):
+        return [self._row(row) for row in self._cursor.fetchmany(size)]
+
+    def fetchall(self):
+        return [self._row(row) for row in self._cursor.fetchall()]
+
+    def __iter__(self):
+        return (self._row(row) for row in self._cursor)
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    @property
+    def lastrowid(self):
+        return self._cursor.lastrowid
+
+    def close(self):
+        self._cursor.close()
+
+
+class SQLiteConnection:
+    """
+    A sqlite3 connection that behaves like a mysql.connector connection, so the
+    pool, pandas and the app code run against a local stand-in database file.
+
+    Args:
+        path (str): Path of the SQLite database file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA foreign_keys = ON")
+
+    def cursor(self, dictionary=False, **kwargs):
+        return SQLiteCursor(self._conn.cursor(), dictionary=dictionary)
+
+    def commit(self):
+        self._conn.commit()
+
+    def rollback(self):
+        self._conn.rollback()
+
+    def close(self):
+        self._conn.close()
+
+    def ping(self, reconnect=False, attempts=1, delay=0):
+        self._conn.execute("SELECT 1")
+
+    def is_connected(self):
+        try:
+            self._conn.execute("SELECT 1")
+            return True
+        except sqlite3.Error:
+            return False
+
+
+class ConnectionPool:
+    """
+    A fixed-size pool of reusable database connections.
+
+    Connections are created lazily up to `size`; once the pool is full,
+    callers wait up to `timeout` seconds for one to be returned.
+
+    Args:
+        size (int): Maximum number of open connections.
+        timeout (float): Seconds to wait for a free connection before giving up.
+        recycle (float): Idle seconds after which a connection is health-checked.
+        factory (callable): Function that opens a new raw connection.
+    """
+
+    def __init__(self, size=POOL_SIZE, timeout=POOL_TIMEOUT, recycle=POOL_RECYCLE, factory=create_connection):
+        self.size = size
+        self.timeout = timeout
+        self.recycle = recycle
+        self.factory = factory
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._open = 0
+        self._stats = {
+            "checkouts": 0,
+            "misses": 0,
+            "timeouts": 0,
+            "created": 0,
+            "health_checks": 0,
+            "reconnects": 0,
+            "discarded": 0,
+            "wait_time": 0.0,
+        }
+
+    def _count(self, key, amount=1):
+        with self._lock:
+            self._stats[key] += amount
+
+    def _new_connection(self):
+        conn = self.factory()
+        self._count("created")
+        return conn
+
+    def _is_healthy(self, conn, idle_for):
+        """Checks a pooled connection, reconnecting it if the server dropped it."""
+        if idle_for < self.recycle:
+            return True
+        self._count("health_checks")
+        try:
+            conn.ping(reconnect=True, attempts=1, delay=0)
+            return True
+        except Exception:
+            return False
+
+    def get(self):
+        """
+        Checks a connection out of the pool.
+
+        Returns:
+            connection: An open database connection. Must be handed back with `put`.
+        """
+        start = time.perf_counter()
+        returned_at = None
+        try:
+            conn, returned_at = self._idle.get_nowait()
+        except queue.Empty:
+            conn = None
+            self._count("misses")
+
+        if conn is None:
+            # Open a new connection if we are still under the size limit
+            with self._lock:
+                can_open = self._open < self.size
+                if can_open:
+                    self._open += 1
+            if can_open:
+                conn = self._open_slot()
+            else:
+                try:
+                    conn, returned_at = self._idle.get(timeout=self.timeout)
+                except queue.Empty:
+                    self._count("timeouts")
+                    raise TimeoutError(f"No database connection available after {self.timeout} seconds")
+
+        if conn is not None and returned_at is not None:
+            if not self._is_healthy(conn, time.monotonic() - returned_at):
+                self._discard(conn)
+                with self._lock:
+                    self._open += 1
+                    self._stats["reconnects"] += 1
+                conn = self._open_slot()
+
+        with self._lock:
+            self._stats["checkouts"] += 1
+            self._stats["wait_time"] += time.perf_counter() - start
+        return conn
+
+    def _open_slot(self):
+        """Opens a connection for a slot already reserved in `_open`."""
+        try:
+            return self._new_connection()
+        except Exception:
+            with self._lock:
+                self._open -= 1
+            raise
+
+    def put(self, conn):
+        """
+        Returns a connection to the pool.
+
+        Any open transaction is rolled back so the next user starts from a clean
+        snapshot. Broken connections are discarded instead of being reused.
+        """
+        try:
+            conn.rollback()
+        except Exception:
+            self._discard(conn)
+            return
+        self._idle.put((conn, time.monotonic()))
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+        with self._lock:
+            self._open -= 1
+            self._stats["discarded"] += 1
+
+    @contextmanager
+    def connection(self):
+        """Context manager that checks a connection out and always returns it."""
+        conn = self.get()
+        try:
+            yield conn
+        finally:
+            self.put(conn)
+
+    def stats(self):
+        """
+        Returns usage counters for sizing the pool.
+
+        Returns:
+            dict: Checkouts, misses, timeouts, wait times and open/idle connection counts.
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats["open"] = self._open
+        stats["idle"] = self._idle.qsize()
+        stats["size"] = self.size
+        stats["avg_wait_ms"] = (stats["wait_time"] / stats["checkouts"] * 1000) if stats["checkouts"] else 0.0
+        return stats
+
+    def close(self):
+        """Closes every idle connection in the pool."""
+        while True:
+            try:
+                conn, _ = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(conn)
+
+
+class Replica:
+    """
+    A read replica with its own connection pool and a cached health check.
+
+    The replica is usable while it answers and its replication lag is within
+    REPLICA_MAX_LAG. The check runs at most every REPLICA_CHECK_INTERVAL
+    seconds; a failed checkout marks the replica down until the next one.
+
+    Args:
+        host (str): host[:port] of the replica.
+        size (int): Pool size for this replica.
+    """
+
+    def __init__(self, host, size=POOL_SIZE):
+        self.host = host
+        self.pool = ConnectionPool(size=size, factory=lambda: create_connection(**replica_config(host)))
+        self.healthy = True
+        self.lag = None
+        self.error = None
+        self.checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def _measure_lag(self):
+        conn = self.pool.get()
+        try:
+            cursor = conn.cursor(dictionary=True)
+            try:
+                cursor.execute("SHOW REPLICA STATUS")
+            except mysql.connector.Error:
+                # Servers before 8.0.22 only know the old name
+                cursor.execute("SHOW SLAVE STATUS")
+            status = cursor.fetchone()
+            cursor.close()
+        finally:
+            self.pool.put(conn)
+        if status is None:
+            # Not replicating from anything: a standalone copy the operator chose to read from
+            return 0.0
+        lag = status.get("Seconds_Behind_Source", status.get("Seconds_Behind_Master"))
+        return None if lag is None else float(lag)
+
+    def is_usable(self):
+        """Returns whether reads may go here, re-checking health when the last check is stale."""
+        with self._lock:
+            if time.monotonic() - self.checked_at < REPLICA_CHECK_INTERVAL:
+                return self.healthy
+            self.checked_at = time.monotonic()
+        try:
+            lag = self._measure_lag()
+            healthy, error = lag is not None and lag <= REPLICA_MAX_LAG, None if lag is not None else "not replicating"
+        except Exception as e:
+            lag, healthy, error = None, False, str(e)
+        with self._lock:
+            self.lag, self.healthy, self.error = lag, healthy, error
+        return healthy
+
+    def mark_down(self, error):
+        with self._lock:
+            self.healthy = False
+            self.error = str(error)
+            self.checked_at = time.monotonic()
+
+    def in_use(self):
+        stats = self.pool.stats()
+        return stats["open"] - stats["idle"]
+
+
+_replicas = []
+_replicas_lock = threading.Lock()
+_round_robin = itertools.count()
+
+# Which session the current thread works for (see set_session) and when each session last wrote
+_session = contextvars.ContextVar("wmcs_db_session", default=None)
+_last_write = {}
+_last_write_lock = threading.Lock()
+
+
+def set_session(session_id):
+    """
+    Tags the current thread's queries with a session, for read-your-writes routing.
+
+    Call it at the start of every request (e.g. each Streamlit rerun). Threads
+    that never call it share one anonymous session.
+    """
+    _session.set(session_id)
+
+
+def note_write():
+    """Records that the current session committed a write, pinning its reads to the primary for a while."""
+    now = time.monotonic()
+    with _last_write_lock:
+        _last_write[_session.get()] = now
+        # Forget sessions whose window has long passed
+        if len(_last_write) > 1000:
+            for session_id, at in list(_last_write.items()):
+                if now - at > STICKY_SECONDS:
+                    del _last_write[session_id]
+
+
+def is_sticky():
+    """Returns whether the current session wrote recently enough that replicas may not have its writes yet."""
+    with _last_write_lock:
+        at = _last_write.get(_session.get())
+    return at is not None and time.monotonic() - at < STICKY_SECONDS
+
+
+class _PrimaryConnection:
+    """Passes everything through to a primary connection, noting each commit as a write."""
+
+    def __init__(self, connection):
+        self.raw = connection
+
+    def commit(self):
+        self.raw.commit()
+        note_write()
+
+    def __getattr__(self, name):
+        return getattr(self.raw, name)
+
+
+def get_replicas():
+    """Returns the configured replicas, creating their pools on first use. Always empty on SQLite."""
+    global _replicas
+    if DB_BACKEND == "sqlite" or not REPLICA_HOSTS:
+        return []
+    if not _replicas:
+        with _replicas_lock:
+            if not _replicas:
+                _replicas = [Replica(host) for host in REPLICA_HOSTS]
+    return _replicas
+
+
+def choose_replica():
+    """
+    Picks the replica for a read, or None when the read should go to the primary.
+
+    Returns:
+        Replica: A healthy replica chosen by REPLICA_STRATEGY, or None when the session
+        is sticky or no replica is usable.
+    """
+    replicas = get_replicas()
+    if not replicas or is_sticky():
+        return None
+    usable = [replica for replica in replicas if replica.is_usable()]
+    if not usable:
+        return None
+    if REPLICA_STRATEGY == "round_robin":
+        return usable[next(_round_robin) % len(usable)]
+    return min(usable, key=lambda replica: replica.in_use())
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def init_pool(size=POOL_SIZE, timeout=POOL_TIMEOUT, recycle=POOL_RECYCLE, factory=create_connection):
+    """
+    (Re)creates the shared connection pool.
+
+    Args:
+        size (int): Maximum number of open connections.
+        timeout (float): Seconds to wait for a free connection.
+        recycle (float): Idle seconds after which a connection is health-checked.
+        factory (callable): Function that opens a new raw connection.
+
+    Returns:
+        ConnectionPool: The new shared pool.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+        _pool = ConnectionPool(size=size, timeout=timeout, recycle=recycle, factory=factory)
+        return _pool
+
+
+def use_sqlite(path=SQLITE_PATH, size=POOL_SIZE):
+    """
+    Switches the whole app to a SQLite stand-in database and resets the pool.
+
+    Args:
+        path (str): Path of the SQLite database file.
+        size (int): Pool size for the new pool.
+
+    Returns:
+        ConnectionPool: The new shared pool.
+    """
+    global DB_BACKEND, SQLITE_PATH
+    DB_BACKEND = "sqlite"
+    SQLITE_PATH = path
+    return init_pool(size=size, factory=lambda: SQLiteConnection(path))
+
+
+def get_pool():
+    """Returns the shared connection pool, creating it on first use."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool()
+    return _pool
+
+
+@contextmanager
+def _checkout(read_only):
+    """Checks out a replica connection for reads when one is usable, else a primary connection."""
+    replica = choose_replica() if read_only else None
+    if replica is not None:
+        try:
+            conn = replica.pool.get()
+        except Exception as e:
+            # Down or saturated: fall back to the primary and skip this replica until its next check
+            replica.mark_down(e)
+            replica = None
+    if replica is not None:
+        try:
+            yield conn
+        except (mysql.connector.errors.OperationalError, mysql.connector.errors.InterfaceError) as e:
+            # Lost the replica mid-query; later reads go to the primary until it passes a check again
+            replica.mark_down(e)
+            raise
+        finally:
+            replica.pool.put(conn)
+        return
+    with get_pool().connection() as conn:
+        yield conn if read_only else _PrimaryConnection(conn)
+
+
+@contextmanager
+def get_connection(read_only=False):
+    """
+    Checks a connection out of the shared pool for the duration of a `with` block.
+
+    Writes, DDL and anything that must see the latest data use the primary.
+    Pass read_only=True for queries that may be answered by a read replica;
+    they still go to the primary when no replica is configured or healthy,
+    or for a short while after this session committed a write.
+
+    Example:
+        with get_connection(read_only=True) as conn:
+            data = pd.read_sql(query, conn)
+    """
+    start = time.perf_counter()
+    with _checkout(read_only) as conn:
+        if not INSTRUMENT:
+            yield conn
+            return
+        # Every statement run through the app is timed (see instrumentation.py)
+        wrapped = InstrumentedConnection(conn, wait_ms=(time.perf_counter() - start) * 1000)
+        try:
+            yield wrapped
+        finally:
+            wrapped.finish()
+
+
+def pool_stats():
+    """Returns the shared pool's usage counters."""
+    return get_pool().stats()
+
+
+def replica_stats():
+    """
+    Returns the state of every read replica.
+
+    Returns:
+        list: Per replica, its host, health, last measured lag in seconds, last error and pool counters.
+    """
+    return [{"host": replica.host, "healthy": replica.healthy, "lag": replica.lag, "error": replica.error,
+             **replica.pool.stats()} for replica in get_replicas()]
@@ -0,0 +1,204 @@
+"""
+Streaming export of tables and canned queries to CSV, gzip-CSV or Parquet.
+
+Rows are read through an unbuffered cursor in fixed-size chunks and each
+chunk is written out before the next one is fetched, so memory stays flat
+however large the table is.
+
+Usage:
+    python export.py movement movement.parquet
+    python export.py audit_log audit.csv.gz --chunk-size 50000
+    python export.py species_summary summary.csv
+"""
+import argparse
+import csv
+import gzip
+import io
+import sys
+import time
+
+import pandas as pd
+from cache import tables_in_query
+from compact import compact_frame
+from db import get_connection
+from pagination import quote_identifier
+from queries import ENDANGERED_SPECIES_QUERY, SPECIES_SUMMARY_QUERY
+from schema import column_names, get_catalog, primary_key
+
+DEFAULT_CHUNK_SIZE = 10000
+EXPORT_FORMATS = ("csv", "csv.gz", "parquet")
+
+# Named queries that can be exported like tables
+CANNED_QUERIES = {
+    "species_summary": SPECIES_SUMMARY_QUERY,
+    "endangered_species_info": ENDANGERED_SPECIES_QUERY,
+}
+
+
+def detect_format(path):
+    """Picks the export format from the file extension, defaulting to CSV."""
+    if path.endswith(".parquet"):
+        return "parquet"
+    if path.endswith(".gz"):
+        return "csv.gz"
+    return "csv"
+
+
+def source_query(source):
+    """
+    Returns the SQL that reads an export source.
+
+    Args:
+        source (str): A table name or a key of CANNED_QUERIES.
+
+    Returns:
+        str: The query. Tables are read in primary key order without generated columns.
+
+    Raises:
+        ValueError: If the source is neither a known table nor a canned query.
+    """
+    if source in CANNED_QUERIES:
+        return CANNED_QUERIES[source]
+    table = quote_identifier(source, get_catalog())
+    columns = ", ".join(quote_identifier(c) for c in column_names(source, include_generated=False))
+    order = ", ".join(quote_identifier(c) for c in primary_key(source))
+    return f"SELECT {columns} FROM {table}" + (f" ORDER BY {order}" if order else "")
+
+
+def iter_chunks(query, params=None, chunk_size=DEFAULT_CHUNK_SIZE, tables=None):
+    """
+    Streams a query's result in chunks.
+
+    The default mysql.connector cursor is unbuffered, so rows stay on the server
+    until fetchmany asks for them. The connection is held until the generator
+    is exhausted or closed.
+
+    Args:
+        query (str): SQL query to run.
+        params (tuple): Query parameters.
+        chunk_size (int): Rows per chunk.
+        tables (list): Tables the query reads, for typing the chunks. Detected from the SQL when omitted.
+
+    Yields:
+        DataFrame: Up to `chunk_size` rows with compact dtypes. Strings are never made
+        categories, so every chunk of a column has the same type.
+    """
+    with get_connection(read_only=True) as conn:
+        cursor = conn.cursor()
+        try:
+            yield from cursor_chunks(cursor, query, params, chunk_size, tables)
+        finally:
+            cursor.close()
+
+
+def cursor_chunks(cursor, query, params=None, chunk_size=DEFAULT_CHUNK_SIZE, tables=None):
+    """
+    Streams a query's result in chunks through a cursor the caller owns, e.g. inside its transaction.
+
+    Args and chunks are as for iter_chunks; the cursor is left open.
+    """
+    tables = tables or tables_in_query(query)
+    cursor.execute(query, params)
+    columns = [column[0] for column in cursor.description]
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            break
+        chunk = pd.DataFrame.from_records(rows, columns=columns)
+        yield compact_frame(chunk, tables, categories=False)
+
+
+def write_csv(chunks, handle):
+    """Writes chunks to a text handle, with the header taken from the first chunk."""
+    rows = 0
+    header = True
+    for chunk in chunks:
+        chunk.to_csv(handle, header=header, index=False, quoting=csv.QUOTE_MINIMAL)
+        header = False
+        rows += len(chunk)
+    return rows
+
+
+def write_parquet(chunks, handle):
+    """
+    Writes chunks to a binary handle as one Parquet row group per chunk.
+
+    The schema comes from the first chunk. Columns that are entirely NULL there
+    are stored as strings, and later chunks are cast to that schema.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    writer = None
+    schema = None
+    rows = 0
+    try:
+        for chunk in chunks:
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+            if writer is None:
+                schema = pa.schema([pa.field(f.name, pa.string()) if pa.types.is_null(f.type) else f
+                                    for f in table.schema])
+                writer = pq.ParquetWriter(handle, schema)
+            writer.write_table(table.cast(schema, safe=False), row_group_size=len(chunk))
+            rows += len(chunk)
+    finally:
+        if writer is not None:
+            writer.close()
+    return rows
+
+
+def export(source, output, fmt=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Exports a table or canned query to a file or binary handle.
+
+    Args:
+        source (str): A table name or a key of CANNED_QUERIES.
+        output: Destination path, or a binary file object.
+        fmt (str): One of EXPORT_FORMATS. Guessed from the path when omitted.
+        chunk_size (int): Rows fetched and written at a time.
+
+    Returns:
+        int: Number of rows written.
+    """
+    if fmt is None:
+        fmt = detect_format(output) if isinstance(output, str) else "csv"
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format: {fmt}")
+    tables = None if source in CANNED_QUERIES else [source]
+    chunks = iter_chunks(source_query(source), chunk_size=chunk_size, tables=tables)
+
+    handle = open(output, "wb") if isinstance(output, str) else output
+    try:
+        if fmt == "parquet":
+            return write_parquet(chunks, handle)
+        binary = gzip.GzipFile(fileobj=handle, mode="wb") if fmt == "csv.gz" else handle
+        text = io.TextIOWrapper(binary, encoding="utf-8", newline="")
+        try:
+            return write_csv(chunks, text)
+        finally:
+            text.flush()
+            text.detach()
+            if binary is not handle:
+                binary.close()
+    finally:
+        chunks.close()
+        if isinstance(output, str):
+            handle.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export a table or canned query without loading it into memory.")
+    parser.add_argument("source", help=f"Table name or one of: {', '.join(CANNED_QUERIES)}")
+    parser.add_argument("output", help="Destination file, or - for stdout")
+    parser.add_argument("--format", choices=EXPORT_FORMATS, help="Defaults to the output file's extension")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    args = parser.parse_args(argv)
+
+    output = sys.stdout.buffer if args.output == "-" else args.output
+    start = time.perf_counter()
+    rows = export(args.source, output, fmt=args.format, chunk_size=args.chunk_size)
+    print(f"Exported {rows} rows from {args.source} in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,372 @@
+"""
+Bulk loader for high-volume tables such as movement (GPS collar fixes).
+
+Usage:
+    python ingest.py fixes.csv
+    python ingest.py fixes.ndjson --table movement --batch-size 5000 --transaction-size 50000
+    cat fixes.ndjson | python ingest.py - --format ndjson --checkpoint fixes.ckpt --dead-letter bad.ndjson
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import pandas as pd
+from auth import protect_password
+from cache import bump_table_version
+from db import create_connection, get_connection
+from schema import get_table
+
+DEFAULT_BATCH_SIZE = 5000
+DEFAULT_TRANSACTION_SIZE = 50000
+
+INTEGER_TYPES = ("tinyint", "smallint", "mediumint", "int", "bigint")
+NUMERIC_TYPES = INTEGER_TYPES + ("decimal", "float", "double")
+DATETIME_TYPES = ("date", "datetime", "timestamp")
+
+# Value ranges checked for any table that has these columns
+RANGE_CHECKS = {
+    "latitude": (-90, 90),
+    "longitude": (-180, 180),
+}
+
+# Foreign keys the schema no longer declares because partitioned tables cannot
+# have them (see WMCS_trig.sql); triggers enforce them, and rows breaking them
+# are still dead-lettered here rather than failing the whole transaction.
+UNDECLARED_FOREIGN_KEYS = {
+    "movement": [{"column": "species_id", "ref_table": "species", "ref_column": "species_id"}],
+}
+
+
+def detect_format(source):
+    """Guesses the input format from the file extension, defaulting to CSV."""
+    if source.endswith((".ndjson", ".jsonl", ".json")):
+        return "ndjson"
+    return "csv"
+
+
+def read_chunks(source, fmt, chunk_size):
+    """
+    Parses a CSV or NDJSON source lazily.
+
+    Args:
+        source (str): File path, or "-" for stdin.
+        fmt (str): "csv" or "ndjson".
+        chunk_size (int): Number of records per chunk.
+
+    Yields:
+        DataFrame: Up to `chunk_size` raw records, all columns as strings.
+    """
+    handle = sys.stdin if source == "-" else source
+    if fmt == "ndjson":
+        reader = pd.read_json(handle, lines=True, chunksize=chunk_size, dtype=False)
+    else:
+        reader = pd.read_csv(handle, chunksize=chunk_size, dtype=str, keep_default_na=False, na_values=[""])
+    with reader:
+        for chunk in reader:
+            yield chunk
+
+
+def load_foreign_keys(table, table_name):
+    """
+    Loads the set of valid keys for each foreign key column of a table,
+    including those listed in UNDECLARED_FOREIGN_KEYS.
+
+    Args:
+        table (dict): Catalog entry from schema.get_table.
+        table_name (str): Name of the table, to look up UNDECLARED_FOREIGN_KEYS.
+
+    Returns:
+        dict: Column name -> set of referenced key values.
+    """
+    declared = {fk["column"] for fk in table["foreign_keys"]}
+    foreign_keys = table["foreign_keys"] + [fk for fk in UNDECLARED_FOREIGN_KEYS.get(table_name, [])
+                                           if fk["column"] not in declared]
+    known = {}
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        for fk in foreign_keys:
+            cursor.execute(f"SELECT `{fk['ref_column']}` FROM `{fk['ref_table']}`")
+            known[fk["column"]] = {row[0] for row in cursor.fetchall()}
+        cursor.close()
+    return known
+
+
+def validate_chunk(table, chunk, foreign_keys):
+    """
+    Coerces a chunk of raw records to the table's column types.
+
+    Every check is vectorized over the whole chunk. Rows that fail any check are
+    returned separately with the reason in an `error` column.
+
+    Args:
+        table (dict): Catalog entry from schema.get_table.
+        chunk (DataFrame): Raw records.
+        foreign_keys (dict): Valid keys per foreign key column, from load_foreign_keys.
+
+    Returns:
+        tuple: (good_rows, bad_rows) DataFrames.
+    """
+    errors = pd.Series("", index=chunk.index)
+    clean = pd.DataFrame(index=chunk.index)
+
+    def flag(mask, message):
+        errors[mask & (errors == "")] = message
+
+    for column in table["columns"]:
+        name = column["name"]
+        if column["generated"]:
+            continue
+        if name not in chunk.columns:
+            if not column["nullable"] and not column["auto_increment"]:
+                flag(pd.Series(True, index=chunk.index), f"missing required column {name}")
+            continue
+
+        raw = chunk[name]
+        missing = raw.isna() | (raw.astype(str).str.strip() == "")
+        data_type = column["data_type"]
+        if data_type in NUMERIC_TYPES:
+            values = pd.to_numeric(raw, errors="coerce")
+            flag(values.isna() & ~missing, f"{name} is not a number")
+            if data_type in INTEGER_TYPES:
+                fractional = values.notna() & (values % 1 != 0)
+                flag(fractional, f"{name} is not an integer")
+                values = values.where(~fractional).round().astype("Int64")
+        elif data_type in DATETIME_TYPES:
+            values = pd.to_datetime(raw, errors="coerce", format="ISO8601")
+            flag(values.isna() & ~missing, f"{name} is not a valid date/time")
+        else:
+            values = raw.where(~missing)
+            if column["char_length"]:
+                flag(values.str.len() > column["char_length"], f"{name} is longer than {column['char_length']}")
+
+        if not column["nullable"] and not column["auto_increment"]:
+            flag(missing, f"{name} is required")
+        if name in RANGE_CHECKS:
+            low, high = RANGE_CHECKS[name]
+            flag((values < low) | (values > high), f"{name} out of range [{low}, {high}]")
+        if name in foreign_keys:
+            flag(values.notna() & ~values.isin(foreign_keys[name]), f"unknown {name}")
+        clean[name] = values
+
+    bad = errors != ""
+    rejected = chunk[bad].copy()
+    rejected["error"] = errors[bad]
+    return clean[~bad], rejected
+
+
+def protect_passwords(table_name, data):
+    """
+    Hashes the passwords of users rows before they are written, as every other write path does.
+
+    Hashing is deliberately slow (see auth.PASSWORD_ITERATIONS), so loading
+    many users takes a while; rows that already hold a hash are kept as they are.
+    """
+    if table_name != "users" or "password" not in data.columns:
+        return data
+    passwords = data["password"].map(lambda value: protect_password(value) if pd.notna(value) else value)
+    return data.assign(password=passwords)
+
+
+def to_rows(data):
+    """Converts a validated DataFrame into tuples of plain Python values for the driver."""
+    columns = {}
+    for name in data.columns:
+        series = data[name]
+        if pd.api.types.is_datetime64_any_dtype(series):
+            series = pd.Series(list(series.dt.to_pydatetime()), index=series.index, dtype=object)
+        else:
+            series = series.astype(object)
+        columns[name] = series.where(data[name].notna(), None)
+    return list(pd.DataFrame(columns).itertuples(index=False, name=None))
+
+
+def insert_batch(cursor, table_name, columns, rows):
+    """Inserts rows with a single executemany call, which the driver sends as one multi-row INSERT."""
+    column_list = ", ".join(f"`{c}`" for c in columns)
+    placeholders = ", ".join(["%s"] * len(columns))
+    cursor.executemany(f"INSERT INTO `{table_name}` ({column_list}) VALUES ({placeholders})", rows)
+
+
+def load_data_batch(cursor, table_name, data):
+    """Bulk loads rows through LOAD DATA LOCAL INFILE using a temporary CSV file."""
+    with tempfile.NamedTemporaryFile("w", suffix=".csv", delete=False, newline="") as handle:
+        data.to_csv(handle, index=False, header=False, na_rep="\\N", date_format="%Y-%m-%d %H:%M:%S")
+        path = handle.name
+    try:
+        column_list = ", ".join(f"`{c}`" for c in data.columns)
+        cursor.execute(
+            f"LOAD DATA LOCAL INFILE %s INTO TABLE `{table_name}` "
+            "FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '\"' LINES TERMINATED BY '\\n' "
+            f"({column_list})",
+            (path,),
+        )
+    finally:
+        os.remove(path)
+
+
+def read_checkpoint(path):
+    """Returns the saved checkpoint, or an empty one if there is none yet."""
+    if path and os.path.exists(path):
+        with open(path) as handle:
+            return json.load(handle)
+    return {"records_done": 0, "rows_inserted": 0, "rows_rejected": 0}
+
+
+def write_checkpoint(path, checkpoint):
+    """Atomically replaces the checkpoint file so a crash never leaves it half written."""
+    if not path:
+        return
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as handle:
+        json.dump(checkpoint, handle)
+    os.replace(tmp_path, path)
+
+
+def write_dead_letters(path, rejected):
+    """Appends rejected rows (with their error) to the dead-letter file as NDJSON."""
+    if not path or rejected.empty:
+        return
+    with open(path, "a") as handle:
+        rejected.to_json(handle, orient="records", lines=True, date_format="iso")
+
+
+def ingest(source, table_name="movement", fmt=None, batch_size=DEFAULT_BATCH_SIZE,
+           transaction_size=DEFAULT_TRANSACTION_SIZE, method="insert", checkpoint_path=None,
+           dead_letter_path=None, report=print):
+    """
+    Streams records from a file or stdin into a table in batched transactions.
+
+    Records are parsed `batch_size` at a time, validated against the schema
+    catalog, and inserted with one multi-row statement per batch. A commit is
+    issued every `transaction_size` rows, after which the checkpoint is saved,
+    so a rerun with the same checkpoint resumes after the last committed record.
+
+    Args:
+        source (str): File path, or "-" for stdin.
+        table_name (str): Table to load into.
+        fmt (str): "csv" or "ndjson". Detected from the file extension when omitted.
+        batch_size (int): Records parsed and inserted per statement.
+        transaction_size (int): Records per transaction.
+        method (str): "insert" for batched INSERTs or "load_data" for LOAD DATA LOCAL INFILE.
+        checkpoint_path (str): File used to record progress for resuming.
+        dead_letter_path (str): File that receives rejected rows as NDJSON.
+        report (callable): Called with a progress message after each commit.
+
+    Returns:
+        dict: Totals for inserted and rejected rows, elapsed seconds and rows/sec.
+    """
+    if method not in ("insert", "load_data"):
+        raise ValueError(f"Unknown ingest method: {method}")
+    fmt = fmt or detect_format(source)
+    table = get_table(table_name)
+    known_columns = {column["name"] for column in table["columns"]}
+    foreign_keys = load_foreign_keys(table, table_name)
+
+    checkpoint = read_checkpoint(checkpoint_path)
+    checkpoint["source"] = source
+    checkpoint["table"] = table_name
+    skip = checkpoint["records_done"]
+    previously_inserted = checkpoint["rows_inserted"]
+    previously_rejected = checkpoint["rows_rejected"]
+
+    if method == "load_data":
+        conn = create_connection(allow_local_infile=True)
+    else:
+        conn = create_connection()
+    cursor = conn.cursor()
+
+    start = time.perf_counter()
+    inserted = rejected_count = pending = 0
+    pending_rejects = []
+    seen = 0
+
+    def commit():
+        nonlocal pending, pending_rejects
+        conn.commit()
+        for rejected in pending_rejects:
+            write_dead_letters(dead_letter_path, rejected)
+        checkpoint["records_done"] = seen
+        checkpoint["rows_inserted"] = previously_inserted + inserted
+        checkpoint["rows_rejected"] = previously_rejected + rejected_count
+        write_checkpoint(checkpoint_path, checkpoint)
+        pending = 0
+        pending_rejects = []
+        elapsed = time.perf_counter() - start
+        report(f"{seen} records read, {inserted} inserted, {rejected_count} rejected, "
+               f"{inserted / elapsed if elapsed else 0:.0f} rows/sec")
+
+    try:
+        for chunk in read_chunks(source, fmt, batch_size):
+            # Skip records that were already committed by a previous run
+            if seen + len(chunk) <= skip:
+                seen += len(chunk)
+                continue
+            if seen < skip:
+                chunk = chunk.iloc[skip - seen:]
+                seen = skip
+
+            unknown = set(chunk.columns) - known_columns
+            if unknown:
+                raise ValueError(f"Columns not in {table_name}: {', '.join(sorted(unknown))}")
+
+            good, rejected = validate_chunk(table, chunk, foreign_keys)
+            good = protect_passwords(table_name, good)
+            if not good.empty:
+                if method == "load_data":
+                    load_data_batch(cursor, table_name, good)
+                else:
+                    insert_batch(cursor, table_name, list(good.columns), to_rows(good))
+            if not rejected.empty:
+                pending_rejects.append(rejected)
+
+            seen += len(chunk)
+            inserted += len(good)
+            rejected_count += len(rejected)
+            pending += len(chunk)
+            if pending >= transaction_size:
+                commit()
+        if pending or pending_rejects:
+            commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+        conn.close()
+        bump_table_version(table_name)
+
+    elapsed = time.perf_counter() - start
+    return {
+        "rows_inserted": inserted,
+        "rows_rejected": rejected_count,
+        "records_read": seen,
+        "seconds": elapsed,
+        "rows_per_sec": inserted / elapsed if elapsed else 0.0,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk load CSV/NDJSON records into a WMCS table.")
+    parser.add_argument("source", help="Input file, or - for stdin")
+    parser.add_argument("--table", default="movement", help="Target table (default: movement)")
+    parser.add_argument("--format", choices=["csv", "ndjson"], help="Input format (default: from extension)")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="Rows per INSERT statement")
+    parser.add_argument("--transaction-size", type=int, default=DEFAULT_TRANSACTION_SIZE, help="Rows per commit")
+    parser.add_argument("--method", choices=["insert", "load_data"], default="insert",
+                        help="Batched INSERTs or LOAD DATA LOCAL INFILE")
+    parser.add_argument("--checkpoint", help="Checkpoint file for resuming an interrupted load")
+    parser.add_argument("--dead-letter", help="File that receives rejected rows as NDJSON")
+    args = parser.parse_args(argv)
+
+    result = ingest(args.source, table_name=args.table, fmt=args.format, batch_size=args.batch_size,
+                    transaction_size=args.transaction_size, method=args.method,
+                    checkpoint_path=args.checkpoint, dead_letter_path=args.dead_letter,
+                    report=lambda message: print(message, file=sys.stderr))
+    print(json.dumps(result))
+
+
+if __name__ == "__main__":
+    main()
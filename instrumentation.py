@@ -0,0 +1,415 @@
+"""
+Per-query instrumentation for every connection handed out by db.get_connection.
+
+Each statement is recorded with the function that issued it, its normalized
+SQL, a fingerprint of its parameters (never the values themselves), wall
+time, rows and bytes returned, and the time spent waiting for the pooled
+connection. Records are kept in a bounded in-memory window from which the
+slow-query panel builds its rankings and latency histograms.
+"""
+import hashlib
+import json
+import os
+import re
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+# Set WMCS_INSTRUMENT=0 to hand out raw connections
+INSTRUMENT = os.environ.get("WMCS_INSTRUMENT", "1") != "0"
+# Number of most recent statements kept for the rankings and histograms
+HISTORY_SIZE = int(os.environ.get("WMCS_QUERY_HISTORY", 10000))
+# Statements slower than this are kept as slow, with their EXPLAIN plan when capture is on
+SLOW_QUERY_MS = float(os.environ.get("WMCS_SLOW_QUERY_MS", 500))
+EXPLAIN_SLOW = os.environ.get("WMCS_EXPLAIN_SLOW", "0") == "1"
+QUERY_LOG_PATH = os.environ.get("WMCS_QUERY_LOG", "wmcs_queries.ndjson")
+
+HISTOGRAM_BUCKETS_MS = [1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+
+# Frames from these modules are plumbing, not the caller we want to blame
+_PLUMBING = ("instrumentation", "db", "cache", "pandas", "contextlib", "streamlit", "concurrent", "threading")
+
+_LITERAL_PATTERNS = [
+    (re.compile(r"'(?:[^'\\]|\\.|'')*'"), "?"),
+    (re.compile(r"\b\d+(?:\.\d+)?\b"), "?"),
+    (re.compile(r"%s|\?"), "?"),
+    (re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)"), "(?+)"),
+]
+
+
+def fingerprint_sql(query):
+    """
+    Normalizes a statement so that calls differing only in literals or IN-list length group together.
+
+    Args:
+        query (str): SQL statement.
+
+    Returns:
+        str: The statement with literals and placeholders replaced by ?.
+    """
+    query = " ".join(query.split()).rstrip(";").strip()
+    for pattern, replacement in _LITERAL_PATTERNS:
+        query = pattern.sub(replacement, query)
+    return query
+
+
+def fingerprint_params(params):
+    """Returns a short hash of the parameters, so repeated values can be spotted without logging them."""
+    if not params:
+        return ""
+    return hashlib.blake2b(repr(tuple(params) if not isinstance(params, dict) else sorted(params.items())).encode(),
+                           digest_size=6).hexdigest()
+
+
+def _row_bytes(row):
+    values = row.values() if isinstance(row, dict) else row
+    return sum(len(value) if isinstance(value, (str, bytes, bytearray)) else 8 for value in values)
+
+
+def _caller():
+    """Names the first function on the stack outside the database plumbing."""
+    frame = sys._getframe(2)
+    while frame is not None:
+        module = frame.f_globals.get("__name__", "")
+        if module.split(".")[0] not in _PLUMBING:
+            return f"{module}.{frame.f_code.co_name}"
+        frame = frame.f_back
+    return "unknown"
+
+
+class QueryLog:
+    """
+    Bounded, thread-safe store of statement records.
+
+    Args:
+        size (int): Number of most recent records to keep.
+        slow_ms (float): Threshold above which a statement counts as slow.
+        explain (bool): Whether to capture the EXPLAIN plan of slow SELECTs.
+    """
+
+    def __init__(self, size=HISTORY_SIZE, slow_ms=SLOW_QUERY_MS, explain=EXPLAIN_SLOW):
+        self.slow_ms = slow_ms
+        self.explain = explain
+        self._records = deque(maxlen=size)
+        self._slow = deque(maxlen=100)
+        self._plans = {}
+        self._lock = threading.Lock()
+        self._totals = {"statements": 0, "slow": 0, "rows": 0, "bytes": 0, "wall_ms": 0.0}
+        # Full statements with their parameters, only while capture_statements is active
+        self.captured = None
+
+    def add(self, record):
+        with self._lock:
+            self._records.append(record)
+            self._totals["statements"] += 1
+            self._totals["rows"] += record["rows"]
+            self._totals["bytes"] += record["bytes"]
+            self._totals["wall_ms"] += record["wall_ms"]
+            if record["wall_ms"] >= self.slow_ms:
+                self._totals["slow"] += 1
+                self._slow.append(record)
+
+    def has_plan(self, sql):
+        with self._lock:
+            return sql in self._plans
+
+    def add_plan(self, sql, plan):
+        with self._lock:
+            self._plans[sql] = plan
+
+    def plan(self, sql):
+        with self._lock:
+            return self._plans.get(sql)
+
+    def records(self):
+        with self._lock:
+            return list(self._records)
+
+    def slow(self):
+        with self._lock:
+            return list(self._slow)
+
+    def totals(self):
+        with self._lock:
+            return dict(self._totals)
+
+    def clear(self):
+        with self._lock:
+            self._records.clear()
+            self._slow.clear()
+            self._plans.clear()
+            for key in self._totals:
+                self._totals[key] = 0
+
+
+_log = QueryLog()
+
+
+def _explain(raw_conn, query, params):
+    """Captures the plan of a slow SELECT once per normalized statement, without recording it."""
+    import db
+    prefix = "EXPLAIN QUERY PLAN " if db.DB_BACKEND == "sqlite" else "EXPLAIN "
+    try:
+        cursor = raw_conn.cursor(dictionary=True)
+        cursor.execute(prefix + query, params)
+        plan = cursor.fetchall()
+        cursor.close()
+        return [{key: str(value) for key, value in row.items()} for row in plan]
+    except Exception as error:
+        return [{"error": str(error)}]
+
+
+class InstrumentedCursor:
+    """
+    Wraps a driver cursor and records each statement when its results have been read.
+
+    A statement is finished when the next one starts or when the cursor is closed,
+    so wall time covers both execution and fetching.
+    """
+
+    def __init__(self, cursor, connection):
+        self._cursor = cursor
+        self._connection = connection
+        self._current = None
+
+    def _start(self, query, params, executemany=False):
+        self._finish()
+        caller = _caller()
+        captured = _log.captured
+        if captured is not None and not executemany:
+            captured.append({"caller": caller, "query": query, "params": params})
+        self._current = {
+            "query": query,
+            "params": params,
+            "executemany": executemany,
+            "caller": caller,
+            "started": time.perf_counter(),
+            "rows": 0,
+            "bytes": 0,
+        }
+
+    def _finish(self):
+        current, self._current = self._current, None
+        if current is None:
+            return
+        wall_ms = (time.perf_counter() - current["started"]) * 1000
+        query = current["query"]
+        sql = fingerprint_sql(query)
+        rows = current["rows"]
+        if not rows and not query.lstrip().lower().startswith(("select", "with", "show", "explain", "pragma")):
+            # Writes report affected rows instead
+            rows = max(getattr(self._cursor, "rowcount", 0) or 0, 0)
+        record = {
+            "at": time.time(),
+            "caller": current["caller"],
+            "sql": sql,
+            "params": "many" if current["executemany"] else fingerprint_params(current["params"]),
+            "wall_ms": wall_ms,
+            "rows": rows,
+            "bytes": current["bytes"],
+            "wait_ms": self._connection.take_wait_ms(),
+        }
+        _log.add(record)
+        if (_log.explain and wall_ms >= _log.slow_ms and not current["executemany"]
+                and query.lstrip().lower().startswith("select") and not _log.has_plan(sql)):
+            _log.add_plan(sql, _explain(self._connection.raw, query, current["params"]))
+
+    def _fetched(self, rows):
+        if self._current is not None:
+            self._current["rows"] += len(rows)
+            self._current["bytes"] += sum(_row_bytes(row) for row in rows)
+        return rows
+
+    def execute(self, query, params=None, *args, **kwargs):
+        self._start(query, params)
+        return self._cursor.execute(query, params, *args, **kwargs)
+
+    def executemany(self, query, seq_of_params, *args, **kwargs):
+        self._start(query, None, executemany=True)
+        return self._cursor.executemany(query, seq_of_params, *args, **kwargs)
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        if row is not None:
+            self._fetched([row])
+        return row
+
+    def fetchmany(self, size=1):
+        return self._fetched(self._cursor.fetchmany(size))
+
+    def fetchall(self):
+        return self._fetched(self._cursor.fetchall())
+
+    def __iter__(self):
+        for row in self._cursor:
+            self._fetched([row])
+            yield row
+
+    def close(self):
+        self._cursor.close()
+        self._finish()
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class InstrumentedConnection:
+    """
+    Wraps a pooled connection so every cursor it opens is instrumented.
+
+    Args:
+        connection: The raw driver connection.
+        wait_ms (float): Time spent waiting for it, charged to its first statement.
+    """
+
+    def __init__(self, connection, wait_ms=0.0):
+        self.raw = connection
+        self._wait_ms = wait_ms
+        self._cursors = []
+
+    def take_wait_ms(self):
+        wait_ms, self._wait_ms = self._wait_ms, 0.0
+        return wait_ms
+
+    def cursor(self, *args, **kwargs):
+        cursor = InstrumentedCursor(self.raw.cursor(*args, **kwargs), self)
+        self._cursors.append(cursor)
+        return cursor
+
+    def finish(self):
+        """Records statements whose cursors were never closed."""
+        for cursor in self._cursors:
+            cursor._finish()
+        self._cursors.clear()
+
+    def __getattr__(self, name):
+        return getattr(self.raw, name)
+
+
+def query_records():
+    """Returns the recorded statements in the current window as a DataFrame."""
+    columns = ["at", "caller", "sql", "params", "wall_ms", "rows", "bytes", "wait_ms"]
+    return pd.DataFrame(_log.records(), columns=columns)
+
+
+def summarize_queries(records=None):
+    """
+    Aggregates recorded statements by normalized SQL and caller.
+
+    Returns:
+        DataFrame: calls, total/mean/p95/max wall time, rows, bytes and wait time per statement.
+    """
+    records = query_records() if records is None else records
+    if records.empty:
+        return pd.DataFrame(columns=["caller", "sql", "calls", "total_ms", "mean_ms", "p95_ms", "max_ms",
+                                     "rows", "bytes", "wait_ms", "distinct_params"])
+    grouped = records.groupby(["caller", "sql"], sort=False)
+    summary = grouped.agg(calls=("wall_ms", "size"), total_ms=("wall_ms", "sum"), mean_ms=("wall_ms", "mean"),
+                          p95_ms=("wall_ms", lambda values: np.percentile(values, 95)), max_ms=("wall_ms", "max"),
+                          rows=("rows", "sum"), bytes=("bytes", "sum"), wait_ms=("wait_ms", "sum"),
+                          distinct_params=("params", "nunique"))
+    return summary.reset_index()
+
+
+def slowest_queries(n=10):
+    """Returns the `n` statements with the highest p95 wall time in the current window."""
+    return summarize_queries().sort_values("p95_ms", ascending=False).head(n).reset_index(drop=True)
+
+
+def frequent_queries(n=10):
+    """Returns the `n` most frequently run statements in the current window."""
+    return summarize_queries().sort_values("calls", ascending=False).head(n).reset_index(drop=True)
+
+
+def latency_histogram(sql=None):
+    """
+    Counts statements per latency bucket.
+
+    Args:
+        sql (str): Only count this normalized statement. All statements when omitted.
+
+    Returns:
+        DataFrame: One row per bucket with its upper bound in milliseconds and a count.
+    """
+    records = query_records()
+    if sql is not None:
+        records = records[records["sql"] == sql]
+    edges = [0] + HISTOGRAM_BUCKETS_MS + [np.inf]
+    counts, _ = np.histogram(records["wall_ms"].to_numpy(dtype=float), bins=edges)
+    labels = [f"<= {edge} ms" for edge in HISTOGRAM_BUCKETS_MS] + [f"> {HISTOGRAM_BUCKETS_MS[-1]} ms"]
+    return pd.DataFrame({"bucket": labels, "count": counts})
+
+
+def slow_queries():
+    """Returns the most recent slow statements, each with its EXPLAIN plan when one was captured."""
+    return [dict(record, plan=_log.plan(record["sql"])) for record in _log.slow()]
+
+
+def query_totals():
+    """Returns statement, slow statement, row, byte and wall time totals since the last reset."""
+    return _log.totals()
+
+
+def export_query_log(path=QUERY_LOG_PATH):
+    """
+    Appends the current window to an NDJSON file for offline analysis.
+
+    Args:
+        path (str): File to append to.
+
+    Returns:
+        int: Number of records written.
+    """
+    records = _log.records()
+    with open(path, "a") as handle:
+        for record in records:
+            handle.write(json.dumps(dict(record, plan=_log.plan(record["sql"]))) + "\n")
+    return len(records)
+
+
+def configure_slow_queries(slow_ms=None, explain=None):
+    """
+    Changes how statements recorded from now on are treated.
+
+    Args:
+        slow_ms (float): New slow-statement threshold in milliseconds.
+        explain (bool): Turn EXPLAIN capture for slow SELECTs on or off.
+    """
+    if slow_ms is not None:
+        _log.slow_ms = slow_ms
+    if explain is not None:
+        _log.explain = explain
+
+
+def slow_query_settings():
+    """Returns the current slow-statement threshold and whether EXPLAIN capture is on."""
+    return {"slow_ms": _log.slow_ms, "explain": _log.explain}
+
+
+@contextmanager
+def capture_statements():
+    """
+    Collects every statement run inside the block, with its SQL text and parameters.
+
+    Unlike the recorded window, which keeps only fingerprints, captured statements
+    can be run again, e.g. under EXPLAIN (see plans.py).
+
+    Yields:
+        list: Dicts with "caller", "query" and "params", filled as statements run.
+    """
+    captured = []
+    _log.captured = captured
+    try:
+        yield captured
+    finally:
+        _log.captured = None
+
+
+def reset_query_stats():
+    """Forgets every recorded statement and captured plan."""
+    _log.clear()
@@ -0,0 +1,143 @@
+from cache import cached_read_sql
+
+DEFAULT_PAGE_SIZE = 50
+
+# Comparison operators a user may push down into the WHERE clause
+FILTER_OPERATORS = {
+    "=": "=",
+    "!=": "<>",
+    "<": "<",
+    "<=": "<=",
+    ">": ">",
+    ">=": ">=",
+    "contains": "LIKE",
+}
+
+
+def quote_identifier(name, allowed=None):
+    """
+    Quotes a column or table name after validating it.
+
+    Identifiers cannot be passed as query parameters, so anything that ends up
+    in the SQL text must be a plain identifier and, when `allowed` is given,
+    one of the names we already know about.
+
+    Args:
+        name (str): The identifier to quote.
+        allowed (list): Valid identifiers for this position, or None to only check the syntax.
+
+    Returns:
+        str: The backtick-quoted identifier.
+    """
+    if not isinstance(name, str) or not name.isidentifier() or (allowed is not None and name not in allowed):
+        raise ValueError(f"Unknown column or table: {name}")
+    return f"`{name}`"
+
+
+def to_python(value):
+    """Converts numpy scalars from a DataFrame into plain values the driver accepts as parameters."""
+    return value.item() if hasattr(value, "item") else value
+
+
+def build_filter(filter_column, filter_op, filter_value, columns):
+    """
+    Builds a parameterized WHERE fragment for a single column filter.
+
+    Args:
+        filter_column (str): Column to filter on, or None for no filter.
+        filter_op (str): One of the keys of FILTER_OPERATORS.
+        filter_value: Value to compare against.
+        columns (list): Valid column names for the table.
+
+    Returns:
+        tuple: (sql_fragment, params). The fragment is empty when no filter applies.
+    """
+    if not filter_column or filter_value in (None, ""):
+        return "", []
+    if filter_op not in FILTER_OPERATORS:
+        raise ValueError(f"Unsupported filter operator: {filter_op}")
+    column = quote_identifier(filter_column, columns)
+    if filter_op == "contains":
+        return f"{column} LIKE %s", [f"%{filter_value}%"]
+    return f"{column} {FILTER_OPERATORS[filter_op]} %s", [filter_value]
+
+
+def fetch_page(table_name, key_column, table_columns, page_size=DEFAULT_PAGE_SIZE, after=None,
+               before=None, start_at=None, columns=None, filter_column=None, filter_op="=",
+               filter_value=None):
+    """
+    Fetches one window of rows using keyset pagination on `key_column`.
+
+    Only `page_size` rows are read from the server. Pass `after` to move
+    forward from the last key of the current page, `before` to move back from
+    its first key, or `start_at` to jump to a specific key.
+
+    Args:
+        table_name (str): Name of the table to browse.
+        key_column (str): Unique, ordered column to paginate on (usually the primary key).
+        table_columns (list): All column names of the table, used to validate identifiers.
+        page_size (int): Number of rows per page.
+        after: Return rows with keys strictly greater than this value.
+        before: Return rows with keys strictly smaller than this value.
+        start_at: Return rows with keys greater than or equal to this value.
+        columns (list): Columns to project. The key column is always included.
+        filter_column (str): Optional column to filter on.
+        filter_op (str): Filter operator, one of FILTER_OPERATORS.
+        filter_value: Value for the filter.
+
+    Returns:
+        dict: The page `data` plus `first_key`, `last_key`, `has_next` and `has_prev`.
+    """
+    table = quote_identifier(table_name)
+    key = quote_identifier(key_column, table_columns)
+
+    if columns:
+        selected = [key_column] + [c for c in columns if c != key_column]
+        select_list = ", ".join(quote_identifier(c, table_columns) for c in selected)
+    else:
+        select_list = "*"
+
+    conditions = []
+    params = []
+    filter_sql, filter_params = build_filter(filter_column, filter_op, filter_value, table_columns)
+    if filter_sql:
+        conditions.append(filter_sql)
+        params.extend(filter_params)
+
+    backwards = before is not None
+    if backwards:
+        conditions.append(f"{key} < %s")
+        params.append(before)
+    elif after is not None:
+        conditions.append(f"{key} > %s")
+        params.append(after)
+    elif start_at is not None:
+        conditions.append(f"{key} >= %s")
+        params.append(start_at)
+
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    order = "DESC" if backwards else "ASC"
+    # Fetch one extra row to find out whether there is another page
+    query = f"SELECT {select_list} FROM {table} {where} ORDER BY {key} {order} LIMIT %s"
+    params.append(int(page_size) + 1)
+
+    data = cached_read_sql(query, tuple(params), tables=[table_name])
+
+    has_more = len(data) > page_size
+    data = data.iloc[:page_size]
+    if backwards:
+        data = data.iloc[::-1]
+    data = data.reset_index(drop=True)
+
+    if backwards:
+        has_next, has_prev = True, has_more
+    else:
+        has_next, has_prev = has_more, after is not None or start_at is not None
+
+    return {
+        "data": data,
+        "first_key": to_python(data[key_column].iloc[0]) if not data.empty else None,
+        "last_key": to_python(data[key_column].iloc[-1]) if not data.empty else None,
+        "has_next": has_next,
+        "has_prev": has_prev,
+    }
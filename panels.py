@@ -0,0 +1,84 @@
+"""
+Concurrent loading of independent dashboard panels.
+
+Each panel's data is fetched on a bounded, shared thread pool (each worker
+checks out its own pooled connection), and results are handed back as soon
+as they complete so the page can fill in progressively. A panel that fails
+or runs past its timeout is reported on its own without holding up the rest.
+"""
+import contextvars
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import db
+
+# Never run more panels at once than there are pooled connections to serve them
+PANEL_WORKERS = int(os.environ.get("WMCS_PANEL_WORKERS", db.POOL_SIZE))
+PANEL_TIMEOUT = float(os.environ.get("WMCS_PANEL_TIMEOUT", 15))
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """Returns the shared panel thread pool, creating it on first use."""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=max(1, min(PANEL_WORKERS, db.POOL_SIZE)),
+                                               thread_name_prefix="panel")
+    return _executor
+
+
+def _timed(loader):
+    start = time.perf_counter()
+    data = loader()
+    return data, time.perf_counter() - start
+
+
+def load_panels(loaders, timeout=PANEL_TIMEOUT, timeouts=None):
+    """
+    Runs panel loaders concurrently and yields each result as it completes.
+
+    Loaders run on worker threads and must only fetch data; rendering (and any
+    use of Streamlit's session state) belongs on the calling thread.
+
+    Args:
+        loaders (dict): Panel name -> function that takes no arguments and returns the panel's data.
+        timeout (float): Seconds each panel may take.
+        timeouts (dict): Per-panel overrides of `timeout`.
+
+    Yields:
+        dict: "name", "data", "error" (None on success, the exception otherwise) and "elapsed" seconds.
+    """
+    timeouts = timeouts or {}
+    start = time.monotonic()
+    executor = get_executor()
+    # Each loader runs in a copy of the caller's context, so its reads are routed for the caller's session
+    names = {executor.submit(contextvars.copy_context().run, _timed, loader): name for name, loader in loaders.items()}
+    deadlines = {future: start + timeouts.get(name, timeout) for future, name in names.items()}
+    pending = set(names)
+
+    while pending:
+        next_deadline = min(deadlines[future] for future in pending)
+        done, pending = wait(pending, timeout=max(0.0, next_deadline - time.monotonic()),
+                             return_when=FIRST_COMPLETED)
+        for future in done:
+            try:
+                data, elapsed = future.result()
+                yield {"name": names[future], "data": data, "error": None, "elapsed": elapsed}
+            except Exception as error:
+                yield {"name": names[future], "data": None, "error": error, "elapsed": time.monotonic() - start}
+
+        now = time.monotonic()
+        expired = {future for future in pending if deadlines[future] <= now}
+        for future in expired:
+            # A running query cannot be interrupted; it finishes in the background and returns its connection
+            future.cancel()
+            limit = deadlines[future] - start
+            yield {"name": names[future], "data": None, "elapsed": now - start,
+                   "error": TimeoutError(f"{names[future]} did not finish within {limit:g} seconds")}
+        pending -= expired
@@ -0,0 +1,426 @@
+"""
+Monthly partitions and cold archival for the append-only tables.
+
+movement and audit_log are range-partitioned by month on their time column.
+Upcoming months are created ahead of time, and months older than the
+retention window are written to Parquet under ARCHIVE_DIR and then dropped
+from the database. read_range answers time-range queries from both the live
+table and the archive files, reading only the months that overlap the range.
+
+Usage:
+    python partitions.py init                # partition both tables (once, after WMCS_trig.sql)
+    python partitions.py maintain --retention-months 12 --months-ahead 3
+    python partitions.py status
+"""
+import argparse
+import glob
+import os
+import re
+
+import pandas as pd
+
+import db
+from cache import bump_table_version
+from compact import compact_frame
+from db import get_connection
+from export import cursor_chunks, write_parquet
+from schema import column_names
+
+# Partitioned table -> (time column, primary key column)
+PARTITIONED_TABLES = {
+    "movement": ("timestamp", "movement_id"),
+    "audit_log": ("changed_at", "id"),
+}
+ARCHIVE_DIR = os.environ.get("WMCS_ARCHIVE_DIR", "archive")
+RETENTION_MONTHS = int(os.environ.get("WMCS_RETENTION_MONTHS", 12))
+MONTHS_AHEAD = int(os.environ.get("WMCS_MONTHS_AHEAD", 3))
+
+FUTURE_PARTITION = "p_future"
+# Rows whose time was unknown before partitioning (backfilled to FROM_UNIXTIME(1) by WMCS_trig.sql)
+# share this catch-all partition below the first month, and are never archived
+BEFORE_PARTITION = "p_before"
+
+
+def month_start(value):
+    """Returns the first instant of the month containing `value`."""
+    return pd.Timestamp(value).to_period("M").to_timestamp()
+
+
+def partition_name(month):
+    return f"p{pd.Timestamp(month):%Y%m}"
+
+
+def _epoch(month):
+    # Partition bounds are UNIX timestamps, i.e. months are cut at UTC midnight
+    return int(pd.Timestamp(month).tz_localize(None).timestamp())
+
+
+def _partition_clause(month):
+    return f"PARTITION {partition_name(month)} VALUES LESS THAN ({_epoch(month + pd.offsets.MonthBegin(1))})"
+
+
+def list_partitions(table_name):
+    """
+    Returns the table's partitions, oldest first.
+
+    Returns:
+        list: Dicts with name, month (None for p_before and p_future) and estimated rows. Empty if unpartitioned.
+    """
+    query = """
+        SELECT PARTITION_NAME, TABLE_ROWS FROM information_schema.PARTITIONS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND PARTITION_NAME IS NOT NULL
+        ORDER BY PARTITION_ORDINAL_POSITION
+    """
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(query, (table_name,))
+        rows = cursor.fetchall()
+        cursor.close()
+    special = (BEFORE_PARTITION, FUTURE_PARTITION)
+    return [{"name": name, "rows": rows,
+             "month": None if name in special else pd.Timestamp(f"{name[1:5]}-{name[5:7]}-01")}
+            for name, rows in rows]
+
+
+def _time_bounds(table_name):
+    time_column, _ = PARTITIONED_TABLES[table_name]
+    # The backfilled placeholder for unknown times is not a month of data
+    known = f"{time_column} > '1970-01-02'" if db.DB_BACKEND == "sqlite" else f"UNIX_TIMESTAMP({time_column}) > 1"
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"SELECT MIN({time_column}), MAX({time_column}) FROM {table_name} WHERE {known}")
+        oldest, newest = cursor.fetchone()
+        cursor.close()
+    return oldest, newest
+
+
+def init_partitions(table_name, months_ahead=MONTHS_AHEAD, now=None):
+    """
+    Range-partitions an existing table by month, from its oldest row to `months_ahead` months from now.
+
+    Rows older than that (only the placeholder time of rows that had none)
+    go to a single p_before partition.
+
+    Rewrites the whole table, so run it once during a maintenance window.
+    Does nothing when the table is already partitioned.
+
+    Returns:
+        int: Number of monthly partitions created.
+    """
+    if db.DB_BACKEND == "sqlite" or list_partitions(table_name):
+        return 0
+    time_column, _ = PARTITIONED_TABLES[table_name]
+    oldest, _ = _time_bounds(table_name)
+    current = month_start(now or pd.Timestamp.now())
+    first = month_start(oldest) if oldest is not None else current
+    months = pd.date_range(first, current + pd.DateOffset(months=months_ahead), freq="MS")
+    clauses = [f"PARTITION {BEFORE_PARTITION} VALUES LESS THAN ({_epoch(first)})"]
+    clauses += [_partition_clause(month) for month in months]
+    clauses.append(f"PARTITION {FUTURE_PARTITION} VALUES LESS THAN MAXVALUE")
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"ALTER TABLE {table_name} PARTITION BY RANGE (UNIX_TIMESTAMP({time_column})) "
+                       f"({', '.join(clauses)})")
+        cursor.close()
+    return len(months)
+
+
+def ensure_partitions(table_name, months_ahead=MONTHS_AHEAD, now=None):
+    """
+    Creates the monthly partitions up to `months_ahead` months from now.
+
+    New months are split off the empty p_future partition, which is cheap as
+    long as nothing has been written that far ahead.
+
+    Returns:
+        list: Names of the partitions created.
+    """
+    if db.DB_BACKEND == "sqlite":
+        return []
+    existing = [p["month"] for p in list_partitions(table_name) if p["month"] is not None]
+    if not existing:
+        return []
+    target = month_start(now or pd.Timestamp.now()) + pd.DateOffset(months=months_ahead)
+    months = pd.date_range(max(existing) + pd.DateOffset(months=1), target, freq="MS")
+    if len(months) == 0:
+        return []
+    clauses = [_partition_clause(month) for month in months]
+    clauses.append(f"PARTITION {FUTURE_PARTITION} VALUES LESS THAN MAXVALUE")
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"ALTER TABLE {table_name} REORGANIZE PARTITION {FUTURE_PARTITION} INTO ({', '.join(clauses)})")
+        cursor.close()
+    return [partition_name(month) for month in months]
+
+
+def archive_path(table_name, month):
+    return os.path.join(ARCHIVE_DIR, table_name, f"{table_name}_{pd.Timestamp(month):%Y%m}.parquet")
+
+
+def archive_files(table_name):
+    """Returns (month, path) for every archive file of a table, oldest month first."""
+    pattern = re.compile(rf"^{table_name}_(\d{{4}})(\d{{2}})(_\d+)?\.parquet$")
+    files = []
+    for path in glob.glob(os.path.join(ARCHIVE_DIR, table_name, "*.parquet")):
+        match = pattern.match(os.path.basename(path))
+        if match:
+            files.append((pd.Timestamp(int(match.group(1)), int(match.group(2)), 1), path))
+    return sorted(files)
+
+
+def _new_archive_path(table_name, month):
+    path = archive_path(table_name, month)
+    if os.path.exists(path):
+        # A later batch for an already archived month (e.g. late fixes) goes to its own file
+        path = path.replace(".parquet", f"_{pd.Timestamp.now():%Y%m%d%H%M%S%f}.parquet")
+    return path
+
+
+def _archive_rows(cursor, table_name, source, condition="", params=()):
+    """
+    Writes the rows of `source` that match `condition` to Parquet, one file per month of their time column.
+
+    Files are written under temporary names and renamed only once the rows
+    they hold add up to the rows counted in `source`.
+
+    Returns:
+        int: Number of rows archived.
+
+    Raises:
+        RuntimeError: If the files do not hold exactly the counted rows; nothing is renamed.
+    """
+    import pyarrow.parquet as pq
+
+    time_column, key_column = PARTITIONED_TABLES[table_name]
+    where = f" WHERE {condition}" if condition else ""
+    cursor.execute(f"SELECT COUNT(*), MIN({time_column}), MAX({time_column}) FROM {source}{where}", params)
+    expected, oldest, newest = cursor.fetchone()
+    if not expected:
+        return 0
+    columns = ", ".join(column_names(table_name, include_generated=False))
+    written = []
+    try:
+        for month in pd.date_range(month_start(oldest), month_start(newest), freq="MS"):
+            bounds = (month.to_pydatetime(), (month + pd.DateOffset(months=1)).to_pydatetime())
+            query = (f"SELECT {columns} FROM {source} WHERE {condition + ' AND ' if condition else ''}"
+                     f"{time_column} >= %s AND {time_column} < %s ORDER BY {key_column}")
+            path = _new_archive_path(table_name, month)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temporary = path + ".tmp"
+            written.append((temporary, path))
+            with open(temporary, "wb") as handle:
+                rows = write_parquet(cursor_chunks(cursor, query, tuple(params) + bounds, tables=[table_name]), handle)
+            if rows == 0:
+                os.remove(temporary)
+                written.pop()
+        stored = sum(pq.ParquetFile(temporary).metadata.num_rows for temporary, _ in written)
+        if stored != expected:
+            raise RuntimeError(f"Archive of {table_name} holds {stored} rows, expected {expected}")
+    except BaseException:
+        for temporary, _ in written:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+        raise
+    for temporary, path in written:
+        os.replace(temporary, path)
+    return expected
+
+
+def _staging_table(table_name):
+    return f"{table_name}_archive_staging"
+
+
+def _table_exists(cursor, table_name):
+    cursor.execute("SELECT COUNT(*) FROM information_schema.TABLES WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s",
+                   (table_name,))
+    return cursor.fetchone()[0] > 0
+
+
+def _archive_staging(conn, cursor, table_name):
+    """
+    Archives the rows swapped into the staging table, fixes up what the row triggers maintain, then drops it.
+
+    The staging rows are deleted in the same transaction as the fix-ups, so a
+    crash leaves either everything to redo or nothing.
+    """
+    staging = _staging_table(table_name)
+    _, key_column = PARTITIONED_TABLES[table_name]
+    rows = _archive_rows(cursor, table_name, staging)
+    # Swapping a partition out skips the row triggers; derive the fix-ups from the same rows
+    # A count is the sum of its slots, so taking the rows off slot 0 alone is enough
+    cursor.execute("UPDATE table_row_counts SET row_count = row_count - %s WHERE table_name = %s AND slot = 0",
+                   (rows, table_name))
+    if table_name == "movement":
+        cursor.execute(f"DELETE FROM movement_position WHERE movement_id IN (SELECT {key_column} FROM {staging})")
+    cursor.execute(f"DELETE FROM {staging}")
+    conn.commit()
+    cursor.execute(f"DROP TABLE {staging}")
+    return rows
+
+
+def archive_month(table_name, month):
+    """
+    Moves one month of a table to Parquet files and removes it from the database.
+
+    On MySQL the month's partition is swapped into an empty staging table with
+    EXCHANGE PARTITION, so exactly the rows the partition held are archived,
+    whatever their time zone or how late they arrived. The files are checked
+    against the staging row count before the rows are deleted, and the now
+    empty partition is dropped under a table lock only if nothing was written
+    to it meanwhile; otherwise it is left for the next run. A staging table
+    left by an interrupted run is archived first.
+
+    On the SQLite stand-in the month is read and deleted in one write
+    transaction. Rows already in an archive file for that month are kept;
+    read_range removes duplicates by key.
+
+    Returns:
+        int: Number of rows archived.
+    """
+    time_column, _ = PARTITIONED_TABLES[table_name]
+    start = month_start(month)
+    end = start + pd.DateOffset(months=1)
+
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            if db.DB_BACKEND == "sqlite":
+                condition = f"{time_column} >= %s AND {time_column} < %s"
+                params = (start.to_pydatetime(), end.to_pydatetime())
+                cursor.execute("BEGIN IMMEDIATE")
+                rows = _archive_rows(cursor, table_name, table_name, condition, params)
+                cursor.execute(f"DELETE FROM {table_name} WHERE {condition}", params)
+                conn.commit()
+            else:
+                staging = _staging_table(table_name)
+                partition = partition_name(start)
+                rows = _archive_staging(conn, cursor, table_name) if _table_exists(cursor, staging) else 0
+                cursor.execute(f"CREATE TABLE {staging} LIKE {table_name}")
+                cursor.execute(f"ALTER TABLE {staging} REMOVE PARTITIONING")
+                cursor.execute(f"ALTER TABLE {table_name} EXCHANGE PARTITION {partition} WITH TABLE {staging}")
+                rows += _archive_staging(conn, cursor, table_name)
+                cursor.execute(f"LOCK TABLES {table_name} WRITE")
+                try:
+                    cursor.execute(f"SELECT COUNT(*) FROM {table_name} PARTITION ({partition})")
+                    if cursor.fetchone()[0] == 0:
+                        cursor.execute(f"ALTER TABLE {table_name} DROP PARTITION {partition}")
+                finally:
+                    cursor.execute("UNLOCK TABLES")
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+    bump_table_version(table_name)
+    return rows
+
+
+def expired_months(table_name, retention_months=RETENTION_MONTHS, now=None):
+    """Returns the months of live data older than the retention window, oldest first."""
+    cutoff = month_start(now or pd.Timestamp.now()) - pd.DateOffset(months=retention_months)
+    if db.DB_BACKEND != "sqlite":
+        return [p["month"] for p in list_partitions(table_name) if p["month"] is not None and p["month"] < cutoff]
+    oldest, newest = _time_bounds(table_name)
+    if oldest is None:
+        return []
+    last = min(month_start(newest), cutoff - pd.DateOffset(months=1))
+    return list(pd.date_range(month_start(oldest), last, freq="MS"))
+
+
+def maintain(retention_months=RETENTION_MONTHS, months_ahead=MONTHS_AHEAD, now=None):
+    """
+    Pre-creates upcoming partitions and archives expired months for every partitioned table.
+
+    Returns:
+        dict: Per table, the partitions created and the rows archived per month.
+    """
+    report = {}
+    for table_name in PARTITIONED_TABLES:
+        created = ensure_partitions(table_name, months_ahead, now=now)
+        archived = {f"{month:%Y-%m}": archive_month(table_name, month)
+                    for month in expired_months(table_name, retention_months, now=now)}
+        report[table_name] = {"created": created, "archived": archived}
+    return report
+
+
+def read_range(table_name, start, end, columns=None, filters=None):
+    """
+    Reads rows with `start <= time < end` from the live table and the archive together.
+
+    Only archive files for months overlapping the range are opened, and
+    Parquet row-group statistics skip the rest; the live query is pruned to
+    the matching partitions by MySQL.
+
+    Args:
+        table_name (str): "movement" or "audit_log".
+        start: Start of the range (inclusive).
+        end: End of the range (exclusive).
+        columns (list): Columns to return; all non-generated columns by default.
+        filters (dict): Column -> list of accepted values, e.g. {"species_id": [1, 2]}.
+
+    Returns:
+        DataFrame: Matching rows ordered by time and key.
+    """
+    time_column, key_column = PARTITIONED_TABLES[table_name]
+    start, end = pd.Timestamp(start), pd.Timestamp(end)
+    columns = list(columns or column_names(table_name, include_generated=False))
+    for needed in (key_column, time_column):
+        if needed not in columns:
+            columns.append(needed)
+    filters = filters or {}
+
+    conditions = [f"{time_column} >= %s", f"{time_column} < %s"]
+    params = [start.to_pydatetime(), end.to_pydatetime()]
+    for column, values in filters.items():
+        conditions.append(f"{column} IN ({', '.join(['%s'] * len(values))})")
+        params.extend(values)
+    with get_connection(read_only=True) as conn:
+        hot = pd.read_sql(f"SELECT {', '.join(columns)} FROM {table_name} WHERE {' AND '.join(conditions)}",
+                          conn, params=tuple(params))
+    frames = [compact_frame(hot, [table_name], categories=False)]
+
+    first, last = month_start(start), month_start(end - pd.Timedelta(microseconds=1))
+    parquet_filters = [(time_column, ">=", start), (time_column, "<", end)]
+    parquet_filters += [(column, "in", list(values)) for column, values in filters.items()]
+    for month, path in archive_files(table_name):
+        if first <= month <= last:
+            frames.append(pd.read_parquet(path, columns=columns, filters=parquet_filters))
+    frames = [frame for frame in frames if not frame.empty]
+    if not frames:
+        return hot
+    result = pd.concat(frames, ignore_index=True).drop_duplicates(subset=[key_column])
+    return result.sort_values([time_column, key_column]).reset_index(drop=True)
+
+
+def status():
+    """Returns partitions and archive files per table, for the CLI and the Administrator view."""
+    rows = []
+    for table_name in PARTITIONED_TABLES:
+        for partition in list_partitions(table_name) if db.DB_BACKEND != "sqlite" else []:
+            rows.append({"table": table_name, "location": "database", "name": partition["name"],
+                         "rows": partition["rows"]})
+        for _, path in archive_files(table_name):
+            rows.append({"table": table_name, "location": "archive", "name": os.path.basename(path),
+                         "rows": None, "bytes": os.path.getsize(path)})
+    return pd.DataFrame(rows, columns=["table", "location", "name", "rows", "bytes"])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Manage monthly partitions and the cold archive.")
+    parser.add_argument("command", choices=["init", "maintain", "status"])
+    parser.add_argument("--retention-months", type=int, default=RETENTION_MONTHS)
+    parser.add_argument("--months-ahead", type=int, default=MONTHS_AHEAD)
+    args = parser.parse_args(argv)
+
+    if args.command == "init":
+        for table_name in PARTITIONED_TABLES:
+            print(f"{table_name}: {init_partitions(table_name, args.months_ahead)} monthly partitions")
+    elif args.command == "maintain":
+        for table_name, result in maintain(args.retention_months, args.months_ahead).items():
+            print(f"{table_name}: created {result['created'] or 'none'}, archived {result['archived'] or 'none'}")
+    else:
+        print(status().to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,473 @@
+"""
+Query plan checker and index advisor.
+
+Runs the dashboard's reads against a benchmark database (see bench.py),
+captures every SELECT they issue and explains each one: EXPLAIN ANALYZE on
+MySQL, EXPLAIN QUERY PLAN on the SQLite stand-in. Plans are flagged for full
+table scans, filesorts and temporary tables, composite or covering indexes
+are proposed for the tables involved, and a report can be compared with a
+stored baseline so a plan that gets worse fails the check.
+
+Usage:
+    python bench.py generate --sqlite bench.sqlite3 --movement 1000000
+    python plans.py explain --sqlite bench.sqlite3 --output plans_baseline.json
+    python plans.py explain --sqlite bench.sqlite3 --baseline plans_baseline.json --output plans.json
+    python plans.py compare plans_baseline.json plans.json
+
+SQLite reports no actual row counts, so there only the scan, sort and
+temporary-table flags are compared.
+"""
+import argparse
+import json
+import re
+import sys
+import time
+import warnings
+
+import pandas as pd
+
+import auth
+import bench
+import db
+from cache import clear_cache
+from db import get_connection
+from instrumentation import capture_statements, fingerprint_sql
+from queries import fetch_record
+from schema import get_catalog, primary_key
+from tracks import get_track
+
+# Tables with a record form (update and delete look records up by primary key)
+FORM_TABLES = ["habitat", "species", "movement", "health_record", "interaction", "report", "users"]
+# bench.py scenarios left out: they write
+SKIPPED_SCENARIOS = {"write_record"}
+
+# Allowed growth in rows examined before a plan counts as worse, e.g. 0.5 for 50%
+DEFAULT_ROWS_THRESHOLD = 0.5
+# Growth below this many rows is noise, whatever the ratio
+MIN_ROWS_CHANGE = 100
+# Widest index proposed; wider ones are cut back to their key columns instead of covering
+MAX_INDEX_COLUMNS = 4
+
+_SQL_KEYWORDS = {"where", "on", "join", "left", "right", "inner", "outer", "cross", "natural", "group", "order",
+                 "limit", "union", "using", "set", "force", "use", "ignore", "having", "window", "for", "lateral",
+                 "straight_join", "as", "select", "and", "or", "not", "in", "is", "null", "desc", "asc", "by"}
+_FROM = re.compile(r"\b(?:from|join)\s+`?(\w+)`?(?!\s*\.)(?:\s+(?:as\s+)?`?(\w+)`?)?", re.IGNORECASE)
+_COLUMN = r"(?:`?(\w+)`?\.)?`?(\w+)`?"
+_PREDICATE = re.compile(_COLUMN + r"\s*(<=>|<=|>=|<>|!=|=|<|>|\bin\b|\bbetween\b|\blike\b)", re.IGNORECASE)
+# A join condition between two tables, e.g. "sp.species_id = sa.species_id"
+_JOIN = re.compile(r"`?(\w+)`?\.`?(\w+)`?\s*=\s*`?(\w+)`?\.`?(\w+)`?", re.IGNORECASE)
+_REFERENCE = re.compile(r"(?<![\w'])" + _COLUMN + r"(?![\w'(])")
+_ORDER_BY = re.compile(r"\border\s+by\s+(.+?)(?:\blimit\b|$)", re.IGNORECASE | re.DOTALL)
+_LIMIT_ONLY = re.compile(r"^(?!.*\bwhere\b).*\blimit\b", re.IGNORECASE | re.DOTALL)
+_STRING = re.compile(r"'(?:[^'\\]|\\.|'')*'")
+
+# One access step of a MySQL EXPLAIN ANALYZE tree
+_MYSQL_ACCESS = re.compile(r"-> (?P<kind>(?:[\w-]+ )*?(?:scan|lookup|search)) on (?P<alias>`?<?[\w-]+>?`?)"
+                           r"(?: using (?P<index>`?\w+`?))?", re.IGNORECASE)
+_MYSQL_ACTUAL = re.compile(r"\(actual time=[\d.e+-]+\.\.(?P<ms>[\d.e+-]+) rows=(?P<rows>[\d.e+-]+) "
+                           r"loops=(?P<loops>\d+)\)")
+# One access step of a SQLite EXPLAIN QUERY PLAN
+_SQLITE_ACCESS = re.compile(r"^(?P<kind>SCAN|SEARCH) (?P<alias>\w+)(?: USING (?P<how>.*?INDEX) (?P<index>\w+))?",
+                            re.IGNORECASE)
+
+
+def collect_queries(seed=0):
+    """
+    Runs the dashboard's reads once and returns the distinct SELECTs they issued.
+
+    Covers the bench.py scenarios, the record form lookup of every table in
+    FORM_TABLES and a species' track at daily and raw resolution. The query
+    cache is cleared before each call so every statement reaches the database.
+
+    Returns:
+        list: Dicts with "sql" (the fingerprint), "caller", "query" and "params",
+        one per fingerprint, in the order first seen.
+    """
+    scenarios = bench.build_scenarios(seed)
+    keys = {}
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        for table_name in FORM_TABLES:
+            key_column = primary_key(table_name)[0]
+            cursor.execute(f"SELECT MIN({key_column}) FROM {table_name}")
+            keys[table_name] = (key_column, cursor.fetchone()[0])
+        cursor.execute("SELECT species_id FROM movement ORDER BY movement_id DESC LIMIT 1")
+        row = cursor.fetchone()
+        cursor.close()
+    species_id = row[0] if row else None
+
+    with capture_statements() as captured:
+        for name, scenario in scenarios.items():
+            if name not in SKIPPED_SCENARIOS:
+                clear_cache()
+                scenario(0)
+        for table_name, (key_column, record_id) in keys.items():
+            if record_id is not None:
+                clear_cache()
+                fetch_record(table_name, key_column, record_id, bench.column_names(table_name, include_generated=False))
+        if species_id is not None:
+            for resolution in ("day", "raw"):
+                clear_cache()
+                get_track(species_id, resolution=resolution)
+
+    queries = {}
+    for statement in captured:
+        if not statement["query"].lstrip().lower().startswith(("select", "with")):
+            continue
+        sql = fingerprint_sql(statement["query"])
+        queries.setdefault(sql, dict(statement, sql=sql))
+    return list(queries.values())
+
+
+def table_aliases(query):
+    """
+    Maps each alias in a query's FROM and JOIN clauses to its table.
+
+    Returns:
+        dict: Alias (or the table's own name) -> table name, for tables in the schema catalog.
+    """
+    catalog = get_catalog()
+    aliases = {}
+    for table, alias in _FROM.findall(_STRING.sub("''", query)):
+        if table.lower() not in catalog:
+            continue
+        aliases[table.lower()] = table.lower()
+        if alias and alias.lower() not in _SQL_KEYWORDS:
+            aliases[alias.lower()] = table.lower()
+    return aliases
+
+
+def _explain_mysql(cursor, query, params):
+    start = time.perf_counter()
+    cursor.execute("EXPLAIN ANALYZE " + query, params)
+    lines = "\n".join(str(row[0]) for row in cursor.fetchall()).splitlines()
+    ms = (time.perf_counter() - start) * 1000
+    steps, filesort, temporary = [], False, False
+    for line in lines:
+        text = line.strip()
+        lower = text.lower()
+        filesort = filesort or lower.startswith("-> sort")
+        temporary = temporary or "temporary" in lower or lower.startswith("-> materialize")
+        match = _MYSQL_ACCESS.search(text)
+        if not match:
+            continue
+        kind = match["kind"].lower()
+        actual = _MYSQL_ACTUAL.search(text)
+        steps.append({
+            "alias": match["alias"].strip("`"),
+            "access": "full_scan" if kind in ("table scan", "index scan") else
+                      "covering_scan" if kind == "covering index scan" else "index",
+            "index": match["index"].strip("`") if match["index"] else None,
+            "rows": round(float(actual["rows"]) * int(actual["loops"])) if actual else 0,
+        })
+    return lines, steps, filesort, temporary, ms
+
+
+def _explain_sqlite(cursor, query, params):
+    cursor.execute("EXPLAIN QUERY PLAN " + query, params)
+    lines = [str(row[3]) for row in cursor.fetchall()]
+    # No actual row counts here; time the query itself instead
+    start = time.perf_counter()
+    cursor.execute(query, params)
+    cursor.fetchall()
+    ms = (time.perf_counter() - start) * 1000
+    steps, filesort, temporary = [], False, False
+    for text in lines:
+        upper = text.upper()
+        if upper.startswith("USE TEMP B-TREE"):
+            if "ORDER BY" in upper:
+                filesort = True
+            else:
+                temporary = True
+        temporary = temporary or upper.startswith("MATERIALIZE")
+        match = _SQLITE_ACCESS.match(text)
+        if not match or match["alias"].upper() == "CONSTANT":
+            continue
+        how = (match["how"] or "").upper()
+        full = match["kind"].upper() == "SCAN"
+        steps.append({
+            "alias": match["alias"],
+            "access": ("covering_scan" if "COVERING" in how else "full_scan") if full else "index",
+            "index": match["index"],
+            "rows": None,
+        })
+    return lines, steps, filesort, temporary, ms
+
+
+def explain_query(query, params=None):
+    """
+    Explains one query and summarizes its plan.
+
+    On MySQL the query runs under EXPLAIN ANALYZE, so rows examined are actual
+    counts. Steps on derived tables (<temporary>, <subquery2>, ...) are not
+    counted as scans of a table, nor is an unfiltered, unsorted read under a LIMIT.
+
+    Returns:
+        dict: "full_scans" (tables read end to end), "filesort", "temporary",
+        "rows_examined" (None on SQLite), "ms" and "plan" (the raw plan lines).
+    """
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        explain = _explain_sqlite if db.DB_BACKEND == "sqlite" else _explain_mysql
+        lines, steps, filesort, temporary, ms = explain(cursor, query, params)
+        cursor.close()
+    aliases = table_aliases(query)
+    full_scans = sorted({aliases[step["alias"].lower()] for step in steps
+                         if step["access"] == "full_scan" and step["alias"].lower() in aliases})
+    if full_scans and not filesort and _LIMIT_ONLY.search(query):
+        # An unfiltered scan in index order under a LIMIT stops after a page, e.g. pagination's first page
+        full_scans = []
+    rows = None if db.DB_BACKEND == "sqlite" else sum(step["rows"] for step in steps
+                                                        if step["alias"].lower() in aliases)
+    return {"full_scans": full_scans, "filesort": filesort, "temporary": temporary,
+            "rows_examined": rows, "ms": round(ms, 3), "plan": lines}
+
+
+def _columns_by_table(query, aliases):
+    """Sorts the columns a query compares, orders by and references by the table they belong to."""
+    catalog = get_catalog()
+    tables = set(aliases.values())
+    owners = {}
+    for table in tables:
+        for column in catalog[table]["columns"]:
+            owners.setdefault(column["name"].lower(), set()).add(table)
+
+    def resolve(qualifier, column):
+        column = column.lower()
+        if qualifier:
+            table = aliases.get(qualifier.lower())
+            return [table] if table and column in {c["name"].lower() for c in catalog[table]["columns"]} else []
+        return sorted(owners.get(column, ()))
+
+    text = _STRING.sub("''", query)
+    found = {table: {"equality": [], "range": [], "join": [], "order": [], "referenced": []} for table in tables}
+
+    def add(kind, table, column):
+        if column not in found[table][kind]:
+            found[table][kind].append(column)
+
+    for left_qualifier, left, right_qualifier, right in _JOIN.findall(text):
+        for qualifier, column in ((left_qualifier, left), (right_qualifier, right)):
+            for table in resolve(qualifier, column):
+                add("join", table, column.lower())
+    for qualifier, column, operator in _PREDICATE.findall(_JOIN.sub("", text)):
+        candidates = resolve(qualifier, column)
+        # An unqualified column several tables have cannot be placed
+        if len(candidates) == 1:
+            kind = "equality" if operator.lower() in ("=", "<=>", "in") else "range"
+            add(kind, candidates[0], column.lower())
+    order = _ORDER_BY.search(text)
+    if order:
+        for term in order.group(1).split(","):
+            match = re.match(r"\s*" + _COLUMN + r"\s*(?:asc|desc)?\s*$", term, re.IGNORECASE)
+            candidates = resolve(match.group(1), match.group(2)) if match else []
+            # Only an ORDER BY entirely on one table can be served by an index
+            if len(candidates) != 1:
+                for table in tables:
+                    found[table]["order"] = None
+                break
+            if found[candidates[0]]["order"] is not None:
+                add("order", candidates[0], match.group(2).lower())
+    for qualifier, column in _REFERENCE.findall(text):
+        for table in resolve(qualifier, column):
+            add("referenced", table, column.lower())
+    return found, "select *" in " ".join(text.lower().split())
+
+
+def suggest_indexes(query, summary):
+    """
+    Proposes indexes for the tables a plan scans or sorts.
+
+    Equality columns come first, then either the ORDER BY columns (when they all
+    belong to the table) or one range column. When the remaining referenced
+    columns fit within MAX_INDEX_COLUMNS they are appended so the index covers
+    the query. Proposals whose key columns lead an existing index are dropped.
+
+    Args:
+        query (str): The SQL text.
+        summary (dict): Its plan, as returned by explain_query.
+
+    Returns:
+        list: CREATE INDEX statements.
+    """
+    aliases = table_aliases(query)
+    if not aliases:
+        return []
+    catalog = get_catalog()
+    columns, select_all = _columns_by_table(query, aliases)
+    targets = set(summary["full_scans"])
+    if summary["filesort"]:
+        targets |= {table for table, found in columns.items() if found["order"]}
+    suggestions = []
+    for table in sorted(targets):
+        found = columns[table]
+        key = list(found["equality"])
+        if not key and not found["range"] and not found["order"]:
+            # Join columns only matter for a table read from the inner side of a join
+            key = list(found["join"])
+        order = [c for c in found["order"] or [] if c not in key]
+        ranges = [c for c in found["range"] if c not in key]
+        if order and (not ranges or ranges == order[:1]):
+            key += order
+        elif ranges:
+            key.append(ranges[0])
+        if not key:
+            continue
+        key = key[:MAX_INDEX_COLUMNS]
+        existing = [[c.lower() for c in index["columns"]] for index in catalog[table]["indexes"].values()]
+        if any(index[:len(key)] == key for index in existing):
+            continue
+        # InnoDB secondary indexes (and SQLite rowid tables) already carry the primary key
+        implicit = {c.lower() for c in primary_key(table)}
+        extra = [c for c in found["referenced"] if c not in key and c not in implicit]
+        if not select_all and len(key) + len(extra) <= MAX_INDEX_COLUMNS:
+            key += extra
+        name = f"idx_{table}_{'_'.join(key)}"[:64]
+        suggestions.append(f"CREATE INDEX {name} ON {table} ({', '.join(key)});")
+    return suggestions
+
+
+def check_plans(seed=0):
+    """
+    Collects, explains and advises on every dashboard query.
+
+    Returns:
+        dict: Fingerprint -> caller, query text, plan summary and "advice".
+    """
+    results = {}
+    for statement in collect_queries(seed):
+        try:
+            summary = explain_query(statement["query"], statement["params"])
+        except Exception as error:
+            results[statement["sql"]] = {"caller": statement["caller"], "query": statement["query"],
+                                         "error": str(error)}
+            continue
+        results[statement["sql"]] = dict(summary, caller=statement["caller"], query=statement["query"],
+                                         advice=suggest_indexes(statement["query"], summary))
+    return results
+
+
+def compare(baseline, current, rows_threshold=DEFAULT_ROWS_THRESHOLD):
+    """
+    Compares two plan reports query by query.
+
+    A plan is worse when it scans a table it did not, gains a filesort or a
+    temporary table, or examines more than `rows_threshold` more rows (and at
+    least MIN_ROWS_CHANGE more). Timings are reported but never compared.
+
+    Returns:
+        list: (fingerprint, caller, problems) tuples for the queries in both reports;
+        problems is empty when the plan is no worse.
+    """
+    results = []
+    for sql, before in baseline["queries"].items():
+        after = current["queries"].get(sql)
+        if after is None or "error" in before or "error" in after:
+            continue
+        problems = [f"full scan of {table}" for table in after["full_scans"] if table not in before["full_scans"]]
+        if after["filesort"] and not before["filesort"]:
+            problems.append("filesort")
+        if after["temporary"] and not before["temporary"]:
+            problems.append("temporary table")
+        rows_before, rows_after = before.get("rows_examined"), after.get("rows_examined")
+        if rows_before is not None and rows_after is not None and rows_after - rows_before >= MIN_ROWS_CHANGE \
+                and rows_after > rows_before * (1 + rows_threshold):
+            problems.append(f"rows examined {rows_before} -> {rows_after}")
+        results.append((sql, after["caller"], problems))
+    return results
+
+
+def _short(sql, width=90):
+    return sql if len(sql) <= width else sql[:width - 3] + "..."
+
+
+def report_regressions(baseline, current, rows_threshold):
+    """Prints the comparison and returns the number of queries whose plan got worse."""
+    if baseline.get("sizes") != current.get("sizes"):
+        print("Warning: the two reports used different data sizes", file=sys.stderr)
+    regressions = 0
+    for sql, caller, problems in compare(baseline, current, rows_threshold):
+        regressions += bool(problems)
+        flag = f"WORSE: {', '.join(problems)}" if problems else "ok"
+        print(f"{caller:40} {_short(sql, 60):60} {flag}")
+    for sql in current["queries"].keys() - baseline["queries"].keys():
+        print(f"{current['queries'][sql]['caller']:40} {_short(sql, 60):60} new (not in baseline)")
+    return regressions
+
+
+def explain_command(args):
+    bench.connect(args)
+    auth.PASSWORD_ITERATIONS = args.password_iterations
+    report = {
+        "backend": db.DB_BACKEND,
+        "database": args.sqlite or args.mysql_database,
+        "started_at": pd.Timestamp.now().isoformat(),
+        "sizes": bench.table_sizes(),
+        "queries": check_plans(args.seed),
+    }
+    advice = set()
+    for sql, result in report["queries"].items():
+        if "error" in result:
+            print(f"{result['caller']:40} {_short(sql)}\n    error: {result['error']}")
+            continue
+        flags = [f"full scan of {table}" for table in result["full_scans"]]
+        flags += [name for name in ("filesort", "temporary") if result[name]]
+        rows = "" if result["rows_examined"] is None else f"  rows examined {result['rows_examined']}"
+        print(f"{result['caller']:40} {result['ms']:9.2f} ms{rows}  {', '.join(flags) or 'ok'}\n    {_short(sql)}")
+        for statement in result["advice"]:
+            print(f"    suggest: {statement}")
+        advice.update(result["advice"])
+    if advice:
+        print("\nSuggested indexes:")
+        for statement in sorted(advice):
+            print(f"  {statement}")
+
+    with open(args.output, "w") as handle:
+        json.dump(report, handle, indent=2, default=str)
+    print(f"Wrote {args.output}")
+    if args.baseline:
+        with open(args.baseline) as handle:
+            baseline = json.load(handle)
+        regressions = report_regressions(baseline, report, args.rows_threshold)
+        if regressions:
+            print(f"{regressions} query plan(s) worse than the baseline", file=sys.stderr)
+            sys.exit(1)
+
+
+def compare_command(args):
+    with open(args.baseline) as handle:
+        baseline = json.load(handle)
+    with open(args.current) as handle:
+        current = json.load(handle)
+    regressions = report_regressions(baseline, current, args.rows_threshold)
+    if regressions:
+        print(f"{regressions} query plan(s) worse than the baseline", file=sys.stderr)
+        sys.exit(1)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    explain_parser = commands.add_parser("explain", help="Explain every dashboard query and suggest indexes")
+    bench.add_target(explain_parser)
+    explain_parser.add_argument("--output", default="plans.json")
+    explain_parser.add_argument("--baseline", help="Fail if any plan is worse than in this report")
+    explain_parser.add_argument("--rows-threshold", type=float, default=DEFAULT_ROWS_THRESHOLD)
+
+    compare_parser = commands.add_parser("compare", help="Compare two plan reports")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--rows-threshold", type=float, default=DEFAULT_ROWS_THRESHOLD)
+
+    args = parser.parse_args(argv)
+    # pandas warns on every read through a plain DBAPI connection, as the app does
+    warnings.filterwarnings("ignore", message="pandas only supports SQLAlchemy")
+    if args.command == "explain":
+        explain_command(args)
+    else:
+        compare_command(args)
+
+
+if __name__ == "__main__":
+    main()
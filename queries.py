@@ -0,0 +1,151 @@
+"""
+Data access used by the dashboard, kept free of Streamlit so it can also be
+driven headlessly (see bench.py).
+"""
+from cache import bump_table_version, cached_read_sql
+from db import get_connection
+
+
+def insert_row(table_name, columns, values):
+    """
+    Inserts a new record into the specified table.
+
+    Args:
+        table_name (str): Name of the table to insert the record into.
+        columns (list): List of column names in the table.
+        values (list): List of values to insert into the columns.
+    """
+    placeholders = ', '.join(['%s'] * len(values))  # For parameterized query
+    columns_str = ', '.join(columns)
+    query = f"INSERT INTO {table_name} ({columns_str}) VALUES ({placeholders})"
+
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(query, list(values))
+        conn.commit()
+        cursor.close()
+    bump_table_version(table_name)
+
+
+def update_row(table_name, primary_key_column, record_id, new_values):
+    """
+    Updates a record in the specified table based on the primary key column and record ID.
+
+    Args:
+        table_name (str): Name of the table to update.
+        primary_key_column (str): The primary key column for the table.
+        record_id (int): The ID of the record to update.
+        new_values (dict): Column names mapped to their new values.
+    """
+    # Build the UPDATE query dynamically based on new values
+    set_clause = ", ".join([f"{col} = %s" for col in new_values.keys()])
+    values = list(new_values.values()) + [record_id]
+    query = f"UPDATE {table_name} SET {set_clause} WHERE {primary_key_column} = %s"
+
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(query, values)
+        conn.commit()
+        cursor.close()
+    bump_table_version(table_name)
+
+
+def delete_row(table_name, primary_key_column, record_id):
+    """
+    Deletes a record from the specified table based on the primary key column and record ID.
+
+    Args:
+        table_name (str): Name of the table.
+        primary_key_column (str): The primary key column for the table.
+        record_id (int): The ID of the record to delete.
+    """
+    query = f"DELETE FROM {table_name} WHERE {primary_key_column} = %s"
+
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(query, (record_id,))
+        conn.commit()
+        cursor.close()
+    bump_table_version(table_name)
+
+
+def fetch_record(table_name, primary_key_column, record_id, columns):
+    """
+    Returns one record by primary key, as the update form shows it.
+
+    Args:
+        table_name (str): Name of the table.
+        primary_key_column (str): The primary key column for the table.
+        record_id: The key of the record.
+        columns (list): Columns to read.
+
+    Returns:
+        DataFrame: The record, or no rows if it does not exist.
+    """
+    query = f"SELECT {', '.join(columns)} FROM {table_name} WHERE {primary_key_column} = %s"
+    return cached_read_sql(query, (record_id,), tables=[table_name])
+
+
+def species_from_large_habitats(threshold):
+    """Returns the common names of species living in habitats larger than `threshold`."""
+    # Define the nested query
+    query = """
+    SELECT common_name
+    FROM species
+    WHERE habitat_id IN (
+        SELECT habitat_id
+        FROM habitat
+        WHERE area_size > %s
+    );
+    """
+
+    # Execute the query and fetch the results, reusing a cached result when nothing changed
+    return cached_read_sql(query, (threshold,))
+
+
+# One row per species from the trigger-maintained rollup (see WMCS_trig.sql)
+ENDANGERED_SPECIES_QUERY = """
+    SELECT
+        sp.common_name,
+        sp.population_status,
+        sa.last_movement_at AS movement_time,
+        sa.latest_health_status AS health_status,
+        sa.latest_disease AS disease,
+        sa.latest_incident_type AS incident_type,
+        sa.movement_count,
+        sa.health_record_count,
+        sa.interaction_count
+    FROM
+        species sp
+    JOIN
+        species_activity_summary sa ON sp.species_id = sa.species_id
+    WHERE
+        sp.population_status = 'Endangered';
+"""
+
+# Counts come from the trigger-maintained rollup instead of a fan-out join
+SPECIES_SUMMARY_QUERY = """
+    SELECT
+        sp.population_status,
+        sp.common_name,
+        COALESCE(sa.movement_count, 0) AS movement_count,
+        COALESCE(sa.health_record_count, 0) AS health_record_count,
+        COALESCE(sa.interaction_count, 0) AS interaction_count,
+        sa.last_movement_at
+    FROM
+        species sp
+    LEFT JOIN
+        species_activity_summary sa ON sp.species_id = sa.species_id
+    ORDER BY
+        sp.population_status, movement_count DESC;
+"""
+
+
+def endangered_species_info():
+    """Returns the latest movement, health and interaction details of each endangered species."""
+    return cached_read_sql(ENDANGERED_SPECIES_QUERY)
+
+
+def species_summary():
+    """Returns movement, health record and interaction counts for every species."""
+    return cached_read_sql(SPECIES_SUMMARY_QUERY)
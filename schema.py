@@ -0,0 +1,201 @@
+import re
+import threading
+
+import db
+from db import get_connection
+
+# Columns, foreign keys and indexes for the whole database, fetched in a single round trip
+CATALOG_QUERY = """
+    SELECT 'column' AS kind, TABLE_NAME AS table_name, COLUMN_NAME AS name,
+           DATA_TYPE AS data_type, COLUMN_TYPE AS detail, IS_NULLABLE AS flag,
+           EXTRA AS extra, ORDINAL_POSITION AS position,
+           CHARACTER_MAXIMUM_LENGTH AS char_length, NUMERIC_SCALE AS numeric_scale,
+           NULL AS ref_table, NULL AS ref_column
+    FROM information_schema.COLUMNS
+    WHERE TABLE_SCHEMA = DATABASE()
+    UNION ALL
+    SELECT 'foreign_key', TABLE_NAME, COLUMN_NAME, NULL, CONSTRAINT_NAME, NULL,
+           NULL, ORDINAL_POSITION, NULL, NULL, REFERENCED_TABLE_NAME, REFERENCED_COLUMN_NAME
+    FROM information_schema.KEY_COLUMN_USAGE
+    WHERE TABLE_SCHEMA = DATABASE() AND REFERENCED_TABLE_NAME IS NOT NULL
+    UNION ALL
+    SELECT 'index', TABLE_NAME, COLUMN_NAME, NULL, INDEX_NAME, CAST(NON_UNIQUE AS CHAR),
+           NULL, SEQ_IN_INDEX, NULL, NULL, NULL, NULL
+    FROM information_schema.STATISTICS
+    WHERE TABLE_SCHEMA = DATABASE()
+    ORDER BY table_name, kind, position
+"""
+
+_catalog = None
+_catalog_lock = threading.Lock()
+
+
+def _new_table():
+    return {"columns": [], "primary_key": [], "foreign_keys": [], "indexes": {}}
+
+
+def build_catalog(rows):
+    """
+    Groups the rows returned by CATALOG_QUERY into a per-table catalog.
+
+    Args:
+        rows (list): Dictionaries with the CATALOG_QUERY columns.
+
+    Returns:
+        dict: Table name -> {"columns", "primary_key", "foreign_keys", "indexes"}.
+    """
+    catalog = {}
+    for row in rows:
+        table = catalog.setdefault(row["table_name"], _new_table())
+        if row["kind"] == "column":
+            table["columns"].append({
+                "name": row["name"],
+                "data_type": row["data_type"].lower(),
+                "column_type": row["detail"],
+                "nullable": row["flag"] == "YES",
+                "auto_increment": "auto_increment" in (row["extra"] or "").lower(),
+                "generated": "generated" in (row["extra"] or "").lower(),
+                "char_length": row["char_length"],
+                "numeric_scale": row["numeric_scale"],
+            })
+        elif row["kind"] == "foreign_key":
+            table["foreign_keys"].append({
+                "constraint": row["detail"],
+                "column": row["name"],
+                "ref_table": row["ref_table"],
+                "ref_column": row["ref_column"],
+            })
+        elif row["kind"] == "index":
+            index = table["indexes"].setdefault(row["detail"], {"columns": [], "unique": row["flag"] == "0"})
+            index["columns"].append(row["name"])
+
+    for table in catalog.values():
+        primary = table["indexes"].get("PRIMARY")
+        table["primary_key"] = list(primary["columns"]) if primary else []
+    return catalog
+
+
+def _sqlite_rows(cursor):
+    """
+    Produces CATALOG_QUERY-shaped rows from SQLite's PRAGMAs for the stand-in database.
+
+    SQLite has no information_schema, so this costs a few local queries per table.
+    """
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' ORDER BY name")
+    tables = [row["name"] for row in cursor.fetchall()]
+    rows = []
+    empty = {"data_type": None, "detail": None, "flag": None, "extra": None, "char_length": None,
+             "numeric_scale": None, "ref_table": None, "ref_column": None}
+    for table in tables:
+        cursor.execute(f"PRAGMA table_xinfo(`{table}`)")
+        columns = cursor.fetchall()
+        key_columns = sorted((c for c in columns if c["pk"]), key=lambda c: c["pk"])
+        for column in columns:
+            declared = (column["type"] or "").lower()
+            match = re.match(r"(\w+)\s*(?:\((\d+)(?:\s*,\s*(\d+))?\))?", declared)
+            data_type = match.group(1) if match else declared
+            extra = []
+            if len(key_columns) == 1 and column["pk"] and data_type in ("int", "integer"):
+                extra.append("auto_increment")
+            if column["hidden"] in (2, 3):
+                extra.append("stored generated")
+            rows.append(dict(empty, kind="column", table_name=table, name=column["name"],
+                             data_type=data_type, detail=declared,
+                             flag="NO" if column["notnull"] or column["pk"] else "YES",
+                             extra=" ".join(extra), position=column["cid"] + 1,
+                             char_length=int(match.group(2)) if match and match.group(2) and data_type in ("varchar", "char") else None,
+                             numeric_scale=int(match.group(3)) if match and match.group(3) else None))
+        for position, column in enumerate(key_columns, start=1):
+            rows.append(dict(empty, kind="index", table_name=table, name=column["name"], detail="PRIMARY",
+                             flag="0", position=position))
+        cursor.execute(f"PRAGMA foreign_key_list(`{table}`)")
+        for fk in cursor.fetchall():
+            rows.append(dict(empty, kind="foreign_key", table_name=table, name=fk["from"],
+                             detail=f"{table}_fk_{fk['id']}", position=fk["seq"] + 1,
+                             ref_table=fk["table"], ref_column=fk["to"]))
+        cursor.execute(f"PRAGMA index_list(`{table}`)")
+        for index in cursor.fetchall():
+            if index["origin"] == "pk":
+                continue
+            cursor.execute(f"PRAGMA index_info(`{index['name']}`)")
+            for part in cursor.fetchall():
+                rows.append(dict(empty, kind="index", table_name=table, name=part["name"], detail=index["name"],
+                                 flag="0" if index["unique"] else "1", position=part["seqno"] + 1))
+    return rows
+
+
+def load_catalog():
+    """Reads the schema of every table in the current database."""
+    with get_connection() as conn:
+        cursor = conn.cursor(dictionary=True)
+        if db.DB_BACKEND == "sqlite":
+            rows = _sqlite_rows(cursor)
+        else:
+            cursor.execute(CATALOG_QUERY)
+            rows = cursor.fetchall()
+        cursor.close()
+    return build_catalog(rows)
+
+
+def get_catalog():
+    """Returns the in-memory schema catalog, loading it on first use."""
+    global _catalog
+    if _catalog is None:
+        with _catalog_lock:
+            if _catalog is None:
+                _catalog = load_catalog()
+    return _catalog
+
+
+def refresh_catalog():
+    """Forgets the cached catalog so the next lookup reloads it. Call after any DDL."""
+    global _catalog
+    with _catalog_lock:
+        _catalog = None
+
+
+def get_table(table_name):
+    """
+    Looks up one table in the catalog.
+
+    Args:
+        table_name (str): Name of the table.
+
+    Returns:
+        dict: The table's columns, primary key, foreign keys and indexes.
+
+    Raises:
+        KeyError: If the table does not exist.
+    """
+    catalog = get_catalog()
+    if table_name not in catalog:
+        raise KeyError(f"Table {table_name} does not exist")
+    return catalog[table_name]
+
+
+def column_names(table_name, include_generated=True):
+    """
+    Returns the table's column names in their defined order.
+
+    Args:
+        table_name (str): Name of the table.
+        include_generated (bool): Whether to include generated columns (e.g. movement.position).
+
+    Returns:
+        list: Column names.
+    """
+    return [column["name"] for column in get_table(table_name)["columns"]
+            if include_generated or not column["generated"]]
+
+
+def primary_key(table_name):
+    """Returns the table's primary key columns (more than one for composite keys)."""
+    return list(get_table(table_name)["primary_key"])
+
+
+def column_info(table_name, column_name):
+    """Returns the catalog entry for a single column."""
+    for column in get_table(table_name)["columns"]:
+        if column["name"] == column_name:
+            return column
+    raise KeyError(f"Column {column_name} does not exist in {table_name}")
@@ -0,0 +1,331 @@
+"""
+Ranked full-text search across interactions, habitats and species.
+
+On MySQL the FULLTEXT indexes from WMCS_trig.sql answer one UNION query that
+ranks hits from every table together. Stand-in databases without FULLTEXT
+use an in-process inverted index instead, scored with BM25 and kept up to
+date from the audit_log change feed, so only changed rows are re-indexed.
+
+Both modes tokenize the same way: lower-case words of at least
+MIN_TOKEN_LENGTH characters, MySQL's default stopwords removed, and a
+trailing plural "s" stripped so that "entanglements" finds "entanglement".
+"""
+import os
+import re
+import threading
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+
+import db
+from cache import cached_read_sql
+from changefeed import changes_since, current_watermark, fetch_rows
+from db import get_connection
+from pagination import DEFAULT_PAGE_SIZE
+
+# "fulltext" uses MySQL FULLTEXT indexes, "index" the in-process inverted index.
+# Unset picks "index" on the SQLite stand-in and "fulltext" otherwise.
+SEARCH_MODE = os.environ.get("WMCS_SEARCH_MODE")
+
+# Searchable table -> (primary key, text columns); each column list matches a FULLTEXT index
+SEARCH_FIELDS = {
+    "interaction": ("interaction_id", ["incident_type", "mitigation_efforts", "location"]),
+    "habitat": ("habitat_id", ["name", "location", "environmental_attributes"]),
+    "species": ("species_id", ["common_name", "scientific_name"]),
+}
+HIT_COLUMNS = ["source", "record_id", "score", "text"]
+
+# innodb_ft_min_token_size and the InnoDB default stopword list
+MIN_TOKEN_LENGTH = 3
+STOPWORDS = frozenset(["a", "about", "an", "are", "as", "at", "be", "by", "com", "de", "en", "for", "from", "how",
+                       "i", "in", "is", "it", "la", "of", "on", "or", "that", "the", "this", "to", "was", "what",
+                       "when", "where", "who", "will", "with", "und", "www"])
+
+# BM25 parameters
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+
+
+def _stem(token):
+    if len(token) > 4 and token.endswith("ies"):
+        return token[:-3] + "y"
+    if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+        return token[:-1]
+    return token
+
+
+def tokenize(text):
+    """Splits text into the normalized terms that are indexed and searched."""
+    if not isinstance(text, str):
+        return []
+    return [_stem(t) for t in _TOKEN.findall(text.lower()) if len(t) >= MIN_TOKEN_LENGTH and t not in STOPWORDS]
+
+
+def _search_mode():
+    return SEARCH_MODE or ("index" if db.DB_BACKEND == "sqlite" else "fulltext")
+
+
+def _fulltext_search(terms, tables, limit, offset):
+    # Prefix matching on the stemmed term finds both singular and plural forms
+    against = " ".join(f"{term}*" for term in terms)
+    branches = []
+    params = []
+    for table_name in tables:
+        key_column, columns = SEARCH_FIELDS[table_name]
+        match = f"MATCH({', '.join(columns)}) AGAINST (%s IN BOOLEAN MODE)"
+        # Each branch is a single MATCH ordered by relevance with a LIMIT, which InnoDB answers from the index
+        branches.append(f"(SELECT '{table_name}' AS source, {key_column} AS record_id, {match} AS score, "
+                        f"CONCAT_WS(' | ', {', '.join(columns)}) AS text FROM {table_name} "
+                        f"WHERE {match} ORDER BY score DESC LIMIT %s)")
+        params.extend([against, against, offset + limit])
+    query = (f"SELECT source, record_id, score, text FROM ({' UNION ALL '.join(branches)}) hits "
+             f"ORDER BY score DESC, source, record_id LIMIT %s OFFSET %s")
+    params.extend([limit, offset])
+    return cached_read_sql(query, tuple(params), tables=list(tables))
+
+
+class InvertedIndex:
+    """
+    An in-memory BM25 index over the SEARCH_FIELDS columns.
+
+    Documents get consecutive slots. Each term's postings are NumPy arrays of
+    slots and term frequencies, plus a short list of postings added since the
+    last merge, so a query scores every matching document with a few
+    vectorized operations. Updating a row retires its old slot and indexes it
+    under a new one; retired slots are skipped when scoring and dropped on merge.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.slots = {}
+        self.sources = []
+        self.record_ids = []
+        self.texts = []
+        self.lengths = np.zeros(1024, dtype=np.float64)
+        self.alive = np.zeros(1024, dtype=bool)
+        self.source_codes = np.zeros(1024, dtype=np.int8)
+        self.size = 0
+        self.live_count = 0
+        self.total_length = 0.0
+        self.postings = {}
+        self.pending = {}
+        self.pending_count = 0
+        self.watermark = None
+        self.gaps = {}
+
+    def _grow(self):
+        capacity = len(self.lengths) * 2
+        self.lengths = np.resize(self.lengths, capacity)
+        self.source_codes = np.resize(self.source_codes, capacity)
+        self.alive = np.concatenate([self.alive, np.zeros(capacity - len(self.alive), dtype=bool)])
+
+    def _remove(self, source, record_id):
+        slot = self.slots.pop((source, record_id), None)
+        if slot is not None and self.alive[slot]:
+            self.alive[slot] = False
+            self.live_count -= 1
+            self.total_length -= self.lengths[slot]
+
+    def _add(self, source, record_id, text):
+        self._remove(source, record_id)
+        terms = tokenize(text)
+        if not terms:
+            return
+        if self.size == len(self.lengths):
+            self._grow()
+        slot = self.size
+        self.size += 1
+        self.slots[(source, record_id)] = slot
+        self.sources.append(source)
+        self.record_ids.append(record_id)
+        self.texts.append(text)
+        self.lengths[slot] = len(terms)
+        self.source_codes[slot] = list(SEARCH_FIELDS).index(source)
+        self.alive[slot] = True
+        self.live_count += 1
+        self.total_length += len(terms)
+        for term, count in Counter(terms).items():
+            self.pending.setdefault(term, []).append((slot, count))
+            self.pending_count += 1
+
+    def _term_weights(self, counts, slots, average_length):
+        # The BM25 term-frequency factor, which depends only on the document
+        return counts * (BM25_K1 + 1) / (counts + BM25_K1 * (1 - BM25_B + BM25_B * self.lengths[slots] / average_length))
+
+    def _merge(self):
+        """
+        Folds pending postings into the arrays and drops retired slots.
+
+        Term-frequency factors are precomputed here with the current average
+        document length; it drifts little between merges.
+        """
+        for term, added in self.pending.items():
+            slots = np.fromiter((s for s, _ in added), dtype=np.int64, count=len(added))
+            counts = np.fromiter((c for _, c in added), dtype=np.float64, count=len(added))
+            if term in self.postings:
+                slots = np.concatenate([self.postings[term][0], slots])
+                counts = np.concatenate([self.postings[term][1], counts])
+            self.postings[term] = (slots, counts)
+        average_length = self.total_length / max(self.live_count, 1)
+        for term, (slots, counts, *_) in list(self.postings.items()):
+            keep = self.alive[slots]
+            if not keep.any():
+                del self.postings[term]
+                continue
+            slots, counts = slots[keep], counts[keep]
+            self.postings[term] = (slots, counts, self._term_weights(counts, slots, average_length))
+        self.pending = {}
+        self.pending_count = 0
+
+    def _load(self, table_name, keys=None):
+        key_column, columns = SEARCH_FIELDS[table_name]
+        if keys is None:
+            # A one-off full read; kept out of the result cache so it does not evict everything else
+            with get_connection() as conn:
+                data = pd.read_sql(f"SELECT {key_column}, {', '.join(columns)} FROM {table_name} "
+                                   f"ORDER BY {key_column}", conn)
+        else:
+            data = fetch_rows(table_name, keys, columns=[key_column] + columns)
+        text = data[columns].astype(object).where(data[columns].notna(), None)
+        joined = [" | ".join(str(v) for v in row if v is not None) for row in text.itertuples(index=False)]
+        return zip(data[key_column].tolist(), joined)
+
+    def build(self, tables=tuple(SEARCH_FIELDS)):
+        """Indexes every row of `tables` from scratch."""
+        with self._lock:
+            self._reset()
+            self.watermark = current_watermark()
+            for table_name in tables:
+                for record_id, text in self._load(table_name):
+                    self._add(table_name, int(record_id), text)
+            self._merge()
+
+    def update(self):
+        """
+        Applies the changes logged since the index was last built or updated.
+
+        Returns:
+            int: Number of rows re-indexed or removed.
+        """
+        if self.watermark is None:
+            self.build()
+            return self.live_count
+        applied = 0
+        while True:
+            delta = changes_since(self.watermark, tables=list(SEARCH_FIELDS), gaps=self.gaps)
+            if delta["reset"]:
+                self.build()
+                return self.live_count
+            with self._lock:
+                for table_name, changes in delta["tables"].items():
+                    for record_id in changes["deleted"]:
+                        self._remove(table_name, record_id)
+                    if changes["upserted"]:
+                        for record_id in changes["upserted"]:
+                            self._remove(table_name, record_id)
+                        for record_id, text in self._load(table_name, changes["upserted"]):
+                            self._add(table_name, int(record_id), text)
+                    applied += len(changes["deleted"]) + len(changes["upserted"])
+                self.watermark = delta["watermark"]
+                self.gaps = delta["gaps"]
+                # Merging rewrites the arrays, so only do it once enough postings have piled up
+                if self.pending_count > max(10000, self.live_count // 10):
+                    self._merge()
+            if not delta["truncated"]:
+                return applied
+
+    def _term_postings(self, term, average_length):
+        """Returns a term's slots and term-frequency factors, pending postings included."""
+        slots, counts, weights = self.postings.get(term, (np.empty(0, dtype=np.int64), np.empty(0), np.empty(0)))
+        added = self.pending.get(term)
+        if added:
+            new_slots = np.array([s for s, _ in added], dtype=np.int64)
+            new_counts = np.array([c for _, c in added], dtype=np.float64)
+            slots = np.concatenate([slots, new_slots])
+            weights = np.concatenate([weights, self._term_weights(new_counts, new_slots, average_length)])
+        return slots, weights
+
+    def search(self, terms, tables, limit, offset):
+        """Returns the hits ranked `offset` to `offset + limit` by BM25 score."""
+        with self._lock:
+            if not self.live_count:
+                return pd.DataFrame(columns=HIT_COLUMNS)
+            average_length = self.total_length / self.live_count
+            scores = np.zeros(self.size)
+            for term in set(terms):
+                slots, weights = self._term_postings(term, average_length)
+                if not len(slots):
+                    continue
+                # Retired slots are still counted here until the next merge; their scores are zeroed below
+                idf = np.log(1 + (self.live_count - len(slots) + 0.5) / (len(slots) + 0.5))
+                scores += np.bincount(slots, weights=weights * idf, minlength=self.size)
+            scores[~self.alive[:self.size]] = 0
+            if len(tables) < len(SEARCH_FIELDS):
+                codes = [list(SEARCH_FIELDS).index(t) for t in tables]
+                scores[~np.isin(self.source_codes[:self.size], codes)] = 0
+            matched = np.flatnonzero(scores > 0)
+            wanted_count = offset + limit
+            if len(matched) > wanted_count:
+                # Only sort the hits that can reach the requested page: everything scoring above
+                # the cut-off, then as many of the hits tied at it as still fit, lowest slots first
+                cutoff = np.partition(scores[matched], len(matched) - wanted_count)[len(matched) - wanted_count]
+                above = matched[scores[matched] > cutoff]
+                tied = matched[scores[matched] == cutoff][:wanted_count - len(above)]
+                matched = np.concatenate([above, tied])
+            # Equal scores keep slot order, i.e. table and key order for rows indexed together
+            order = matched[np.lexsort((matched, -scores[matched]))]
+            page = order[offset:offset + limit]
+            return pd.DataFrame({
+                "source": [self.sources[s] for s in page],
+                "record_id": [self.record_ids[s] for s in page],
+                "score": [float(scores[s]) for s in page],
+                "text": [self.texts[s] for s in page],
+            }, columns=HIT_COLUMNS)
+
+
+_index = InvertedIndex()
+
+
+def get_index():
+    """Returns the process-wide inverted index, brought up to date with the change feed."""
+    _index.update()
+    return _index
+
+
+def search(text, tables=None, page_size=DEFAULT_PAGE_SIZE, page=0):
+    """
+    Finds rows of the searchable tables that match free text, best matches first.
+
+    A row matches when it contains any of the query terms; rows containing
+    more of them, or rarer ones, rank higher.
+
+    Args:
+        text (str): What to look for, e.g. "net entanglements near the buffer zone".
+        tables (list): Only search these tables; all of SEARCH_FIELDS by default.
+        page_size (int): Hits per page.
+        page (int): Zero-based page number.
+
+    Returns:
+        dict: The page of hits as `data` (source, record_id, score, text) plus `has_next` and `has_prev`.
+    """
+    tables = [t for t in (tables or SEARCH_FIELDS) if t in SEARCH_FIELDS]
+    terms = tokenize(text)
+    if not terms or not tables:
+        return {"data": pd.DataFrame(columns=HIT_COLUMNS), "has_next": False, "has_prev": page > 0}
+    offset = int(page) * int(page_size)
+    # Fetch one extra hit to find out whether there is another page
+    if _search_mode() == "index":
+        hits = get_index().search(terms, tables, int(page_size) + 1, offset)
+    else:
+        hits = _fulltext_search(terms, tables, int(page_size) + 1, offset)
+    return {
+        "data": hits.iloc[:page_size].reset_index(drop=True),
+        "has_next": len(hits) > page_size,
+        "has_prev": page > 0,
+    }
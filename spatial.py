@@ -0,0 +1,336 @@
+import math
+import os
+
+import numpy as np
+import pandas as pd
+
+import db
+from cache import cached_read_sql
+
+# "mysql" uses the SPATIAL index on movement_position.position (see WMCS_trig.sql);
+# "grid" builds an in-process grid index, for stand-in databases without spatial support.
+# Defaults to "grid" on the SQLite stand-in and "mysql" otherwise.
+SPATIAL_MODE = os.environ.get("WMCS_SPATIAL_MODE")
+
+EARTH_RADIUS_M = 6371008.8
+GRID_CELL_DEGREES = 0.05
+
+FIX_COLUMNS = ["movement_id", "species_id", "timestamp", "latitude", "longitude"]
+
+
+def haversine(lat, lon, lats, lons):
+    """
+    Great-circle distance in metres from one point to arrays of points.
+
+    Args:
+        lat (float): Latitude of the reference point.
+        lon (float): Longitude of the reference point.
+        lats (ndarray): Latitudes to measure to.
+        lons (ndarray): Longitudes to measure to.
+
+    Returns:
+        ndarray: Distances in metres.
+    """
+    lat1, lon1 = math.radians(lat), math.radians(lon)
+    lat2, lon2 = np.radians(lats), np.radians(lons)
+    a = np.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(a))
+
+
+def radius_bbox(lat, lon, radius_m):
+    """Returns (min_lat, min_lon, max_lat, max_lon) enclosing a circle around a point."""
+    dlat = math.degrees(radius_m / EARTH_RADIUS_M)
+    dlon = dlat / max(math.cos(math.radians(lat)), 1e-6)
+    return lat - dlat, lon - dlon, lat + dlat, lon + dlon
+
+
+def _spatial_mode():
+    return SPATIAL_MODE or ("grid" if db.DB_BACKEND == "sqlite" else "mysql")
+
+
+def _filters(species_ids, since, until):
+    """Builds the species and time window conditions shared by every geo query."""
+    conditions = ["m.latitude IS NOT NULL", "m.longitude IS NOT NULL"]
+    params = []
+    if species_ids:
+        conditions.append(f"m.species_id IN ({', '.join(['%s'] * len(species_ids))})")
+        params.extend(species_ids)
+    if since is not None:
+        conditions.append("m.timestamp >= %s")
+        params.append(since)
+    if until is not None:
+        conditions.append("m.timestamp < %s")
+        params.append(until)
+    return conditions, params
+
+
+def _envelope(min_lat, min_lon, max_lat, max_lon):
+    """Builds a SRID 0 rectangle literal for MBRContains; corners are forced to floats."""
+    min_lat, min_lon, max_lat, max_lon = (float(v) for v in (min_lat, min_lon, max_lat, max_lon))
+    return (f"ST_GeomFromText('POLYGON(({min_lon} {min_lat}, {max_lon} {min_lat}, {max_lon} {max_lat}, "
+            f"{min_lon} {max_lat}, {min_lon} {min_lat}))', 0)")
+
+
+class GridIndex:
+    """
+    An in-memory uniform grid over movement fixes.
+
+    Fixes are bucketed by (latitude, longitude) cell and sorted by cell key, so a
+    bounding box only touches the cells it overlaps. Every distance computation
+    is vectorized with NumPy.
+
+    Args:
+        fixes (DataFrame): Rows with the FIX_COLUMNS columns.
+        cell_size (float): Cell edge length in degrees.
+    """
+
+    def __init__(self, fixes, cell_size=GRID_CELL_DEGREES):
+        fixes = fixes.dropna(subset=["latitude", "longitude"])
+        self.cell_size = cell_size
+        lats = fixes["latitude"].to_numpy(dtype=np.float64)
+        lons = fixes["longitude"].to_numpy(dtype=np.float64)
+        keys = self._keys(np.floor(lats / cell_size), np.floor(lons / cell_size))
+        order = np.argsort(keys, kind="stable")
+        self.keys = keys[order]
+        self.fixes = fixes.iloc[order].reset_index(drop=True)
+        self.lats = lats[order]
+        self.lons = lons[order]
+        self.species = self.fixes["species_id"].to_numpy()
+        self.times = pd.to_datetime(self.fixes["timestamp"]).to_numpy()
+
+    @staticmethod
+    def _keys(rows, cols):
+        # Shift into non-negative range and pack (row, col) into one sortable integer
+        return (rows.astype(np.int64) + 100000) * 1000000 + (cols.astype(np.int64) + 100000)
+
+    def _candidates(self, min_lat, min_lon, max_lat, max_lon):
+        rows = np.arange(math.floor(min_lat / self.cell_size), math.floor(max_lat / self.cell_size) + 1)
+        cols = np.arange(math.floor(min_lon / self.cell_size), math.floor(max_lon / self.cell_size) + 1)
+        if len(rows) * len(cols) > len(self.keys):
+            # The box covers more cells than there are fixes, a straight scan is cheaper
+            return np.arange(len(self.keys))
+        wanted = self._keys(np.repeat(rows, len(cols)), np.tile(cols, len(rows)))
+        starts = np.searchsorted(self.keys, wanted, side="left")
+        ends = np.searchsorted(self.keys, wanted, side="right")
+        spans = [np.arange(s, e) for s, e in zip(starts, ends) if e > s]
+        return np.concatenate(spans) if spans else np.array([], dtype=np.int64)
+
+    def _filter(self, idx, species_ids, since, until):
+        mask = np.ones(len(idx), dtype=bool)
+        if species_ids:
+            mask &= np.isin(self.species[idx], list(species_ids))
+        if since is not None:
+            mask &= self.times[idx] >= np.datetime64(pd.Timestamp(since))
+        if until is not None:
+            mask &= self.times[idx] < np.datetime64(pd.Timestamp(until))
+        return idx[mask]
+
+    def bbox(self, min_lat, min_lon, max_lat, max_lon, species_ids=None, since=None, until=None):
+        idx = self._candidates(min_lat, min_lon, max_lat, max_lon)
+        inside = ((self.lats[idx] >= min_lat) & (self.lats[idx] <= max_lat)
+                  & (self.lons[idx] >= min_lon) & (self.lons[idx] <= max_lon))
+        idx = self._filter(idx[inside], species_ids, since, until)
+        return self.fixes.iloc[np.sort(idx)].reset_index(drop=True)
+
+    def radius(self, lat, lon, radius_m, species_ids=None, since=None, until=None):
+        idx = self._filter(self._candidates(*radius_bbox(lat, lon, radius_m)), species_ids, since, until)
+        distances = haversine(lat, lon, self.lats[idx], self.lons[idx])
+        keep = distances <= radius_m
+        result = self.fixes.iloc[idx[keep]].copy()
+        result["distance_m"] = distances[keep]
+        return result.sort_values("distance_m").reset_index(drop=True)
+
+    def nearest(self, lat, lon, n, species_ids=None, since=None, until=None, start_radius_m=1000,
+                max_radius_m=EARTH_RADIUS_M * math.pi):
+        radius_m = start_radius_m
+        while True:
+            result = self.radius(lat, lon, radius_m, species_ids, since, until)
+            if len(result) >= n or radius_m >= max_radius_m:
+                return result.head(n)
+            radius_m *= 4
+
+
+_grid = {"source": None, "index": None}
+
+
+def _grid_index(species_ids, since, until):
+    """Builds (or reuses) a grid over the fixes in the requested window."""
+    conditions, params = _filters(species_ids, since, until)
+    query = f"SELECT {', '.join('m.' + c for c in FIX_COLUMNS)} FROM movement m WHERE {' AND '.join(conditions)}"
+    fixes = cached_read_sql(query, tuple(params), tables=["movement"])
+    # A cache hit hands back the same DataFrame, so the grid built from it is still valid
+    if _grid["source"] is not fixes:
+        _grid["index"] = GridIndex(fixes)
+        _grid["source"] = fixes
+    return _grid["index"]
+
+
+def fixes_in_bbox(min_lat, min_lon, max_lat, max_lon, species_ids=None, since=None, until=None):
+    """
+    Returns movement fixes inside a latitude/longitude box.
+
+    Args:
+        min_lat, min_lon, max_lat, max_lon (float): Corners of the box in degrees.
+        species_ids (list): Only return fixes for these species.
+        since: Only return fixes at or after this time.
+        until: Only return fixes before this time.
+
+    Returns:
+        DataFrame: movement_id, species_id, timestamp, latitude and longitude.
+    """
+    if _spatial_mode() == "grid":
+        return _grid_index(species_ids, since, until).bbox(min_lat, min_lon, max_lat, max_lon)
+    conditions, params = _filters(species_ids, since, until)
+    conditions.insert(0, f"MBRContains({_envelope(min_lat, min_lon, max_lat, max_lon)}, p.position)")
+    query = (f"SELECT {', '.join('m.' + c for c in FIX_COLUMNS)} FROM movement_position p "
+             f"JOIN movement m ON m.movement_id = p.movement_id AND m.timestamp = p.timestamp "
+             f"WHERE {' AND '.join(conditions)} ORDER BY m.movement_id")
+    return cached_read_sql(query, tuple(params), tables=["movement"])
+
+
+def fixes_within(lat, lon, radius_m, species_ids=None, since=None, until=None):
+    """
+    Returns movement fixes within `radius_m` metres of a point, closest first.
+
+    The SPATIAL index narrows the search to the enclosing box before the exact
+    spherical distance is checked.
+
+    Args:
+        lat, lon (float): Centre of the search in degrees.
+        radius_m (float): Search radius in metres.
+        species_ids (list): Only return fixes for these species.
+        since: Only return fixes at or after this time.
+        until: Only return fixes before this time.
+
+    Returns:
+        DataFrame: The matching fixes with a `distance_m` column.
+    """
+    if _spatial_mode() == "grid":
+        return _grid_index(species_ids, since, until).radius(lat, lon, radius_m)
+    conditions, params = _filters(species_ids, since, until)
+    conditions.insert(0, f"MBRContains({_envelope(*radius_bbox(lat, lon, radius_m))}, p.position)")
+    distance = f"ST_Distance_Sphere(p.position, POINT({float(lon)}, {float(lat)}))"
+    query = (f"SELECT {', '.join('m.' + c for c in FIX_COLUMNS)}, {distance} AS distance_m FROM movement_position p "
+             f"JOIN movement m ON m.movement_id = p.movement_id AND m.timestamp = p.timestamp "
+             f"WHERE {' AND '.join(conditions)} HAVING distance_m <= %s ORDER BY distance_m")
+    params.append(radius_m)
+    return cached_read_sql(query, tuple(params), tables=["movement"])
+
+
+def nearest_fixes(lat, lon, n=10, species_ids=None, since=None, until=None, start_radius_m=1000):
+    """
+    Returns the `n` fixes closest to a point.
+
+    The search radius grows fourfold until enough fixes are found, so each step
+    is an indexed box lookup rather than a sort of the whole table.
+
+    Args:
+        lat, lon (float): Reference point in degrees.
+        n (int): Number of fixes to return.
+        species_ids (list): Only consider these species.
+        since: Only consider fixes at or after this time.
+        until: Only consider fixes before this time.
+        start_radius_m (float): Radius of the first search step.
+
+    Returns:
+        DataFrame: Up to `n` fixes with a `distance_m` column, closest first.
+    """
+    if _spatial_mode() == "grid":
+        return _grid_index(species_ids, since, until).nearest(lat, lon, n, start_radius_m=start_radius_m)
+    radius_m = start_radius_m
+    while True:
+        result = fixes_within(lat, lon, radius_m, species_ids, since, until)
+        if len(result) >= n or radius_m >= EARTH_RADIUS_M * math.pi:
+            return result.head(n)
+        radius_m *= 4
+
+
+def interaction_hotspots(match_days=7, since=None):
+    """
+    Places each interaction location on the map.
+
+    interaction.location is a place name, so a hotspot's position is the mean of
+    the involved species' collar fixes within `match_days` of each incident.
+    The windows are matched in pandas, so the same code runs on every backend.
+
+    Args:
+        match_days (int): Days either side of an incident to match fixes from.
+        since: Only place incidents recorded at or after this time.
+
+    Returns:
+        DataFrame: location, incidents, latitude and longitude per hotspot.
+    """
+    columns = ["location", "incidents", "latitude", "longitude"]
+    conditions = ["location IS NOT NULL", "species_id IS NOT NULL", "date_recorded IS NOT NULL"]
+    params = []
+    if since is not None:
+        conditions.append("date_recorded >= %s")
+        params.append(pd.Timestamp(since).date())
+    incidents = cached_read_sql(f"SELECT interaction_id, species_id, location, date_recorded FROM interaction "
+                                f"WHERE {' AND '.join(conditions)}", tuple(params), tables=["interaction"])
+    if incidents.empty:
+        return pd.DataFrame(columns=columns)
+
+    days = pd.to_datetime(incidents["date_recorded"])
+    window = pd.Timedelta(days=match_days)
+    species_ids = sorted(int(s) for s in incidents["species_id"].unique())
+    conditions, params = _filters(species_ids, (days.min() - window).to_pydatetime(), None)
+    conditions.append("m.timestamp <= %s")
+    params.append((days.max() + window).to_pydatetime())
+    fixes = cached_read_sql(f"SELECT m.species_id, m.timestamp, m.latitude, m.longitude FROM movement m "
+                            f"WHERE {' AND '.join(conditions)}", tuple(params), tables=["movement"])
+
+    # Per species, fixes sorted by time with running sums turn each incident's window into two lookups
+    matched = []
+    fixes = fixes.assign(timestamp=pd.to_datetime(fixes["timestamp"])).sort_values(["species_id", "timestamp"])
+    by_species = {species_id: group for species_id, group in fixes.groupby("species_id")}
+    for species_id, group in incidents.assign(day=days).groupby("species_id"):
+        species_fixes = by_species.get(species_id)
+        if species_fixes is None:
+            continue
+        times = species_fixes["timestamp"].to_numpy()
+        lat_sums = np.concatenate([[0.0], np.cumsum(species_fixes["latitude"].to_numpy(dtype=np.float64))])
+        lon_sums = np.concatenate([[0.0], np.cumsum(species_fixes["longitude"].to_numpy(dtype=np.float64))])
+        starts = np.searchsorted(times, (group["day"] - window).to_numpy(), side="left")
+        ends = np.searchsorted(times, (group["day"] + window).to_numpy(), side="right")
+        matched.append(pd.DataFrame({"location": group["location"].to_numpy(),
+                                     "interaction_id": group["interaction_id"].to_numpy(),
+                                     "fixes": ends - starts,
+                                     "latitude_sum": lat_sums[ends] - lat_sums[starts],
+                                     "longitude_sum": lon_sums[ends] - lon_sums[starts]}))
+    matched = pd.concat(matched, ignore_index=True) if matched else pd.DataFrame()
+    if matched.empty or not (matched["fixes"] > 0).any():
+        return pd.DataFrame(columns=columns)
+
+    hotspots = (matched[matched["fixes"] > 0].groupby("location")
+                .agg(incidents=("interaction_id", "nunique"), fixes=("fixes", "sum"),
+                     latitude_sum=("latitude_sum", "sum"), longitude_sum=("longitude_sum", "sum"))
+                .reset_index())
+    hotspots["latitude"] = hotspots["latitude_sum"] / hotspots["fixes"]
+    hotspots["longitude"] = hotspots["longitude_sum"] / hotspots["fixes"]
+    return hotspots[columns].sort_values("incidents", ascending=False, kind="stable").reset_index(drop=True)
+
+
+def incursions_near_hotspots(radius_m, since, species_ids=None, match_days=7):
+    """
+    Finds recent fixes that came within `radius_m` of any interaction hotspot.
+
+    Args:
+        radius_m (float): Distance from a hotspot that counts as an incursion.
+        since: Only consider fixes, and place hotspots from incidents, at or after this time.
+        species_ids (list): Only consider these species.
+        match_days (int): Passed to interaction_hotspots.
+
+    Returns:
+        DataFrame: The fixes with the hotspot `location` and `distance_m`.
+    """
+    frames = []
+    for hotspot in interaction_hotspots(match_days, since).itertuples(index=False):
+        fixes = fixes_within(float(hotspot.latitude), float(hotspot.longitude), radius_m,
+                             species_ids=species_ids, since=since)
+        if not fixes.empty:
+            frames.append(fixes.assign(location=hotspot.location))
+    if not frames:
+        return pd.DataFrame(columns=["location"] + FIX_COLUMNS + ["distance_m"])
+    result = pd.concat(frames, ignore_index=True)
+    return result[["location"] + FIX_COLUMNS + ["distance_m"]].sort_values(["location", "distance_m"])
@@ -0,0 +1,253 @@
+import numpy as np
+import pandas as pd
+from cache import cached_read_sql
+from partitions import archive_files, month_start, read_range
+
+# Resolutions served from the movement_track_daily rollup (see WMCS_trig.sql)
+COARSE_RESOLUTIONS = ("day", "week")
+# Resolutions computed on demand from raw fixes, which need a bounded time window
+FINE_RESOLUTIONS = ("hour", "raw")
+
+DEFAULT_FINE_WINDOW = pd.Timedelta(days=7)
+MAX_FINE_WINDOW = pd.Timedelta(days=31)
+
+TRACK_COLUMNS = ["bucket", "fix_count", "latitude", "longitude"]
+
+
+def lttb(x, y, target_points):
+    """
+    Largest-Triangle-Three-Buckets downsampling of an ordered sequence of points.
+
+    Keeps the first and last points and, from each of `target_points - 2` equal
+    buckets in between, the point forming the largest triangle with the point
+    kept before it and the mean of the next bucket. Each bucket is scored with
+    one vectorized NumPy expression.
+
+    Args:
+        x (ndarray): First coordinate of each point (e.g. longitude).
+        y (ndarray): Second coordinate of each point (e.g. latitude).
+        target_points (int): Number of points to keep.
+
+    Returns:
+        ndarray: Indices of the kept points, in order.
+    """
+    n = len(x)
+    if target_points >= n or target_points < 3:
+        return np.arange(n)
+
+    edges = np.linspace(1, n - 1, target_points - 1).astype(np.int64)
+    kept = np.empty(target_points, dtype=np.int64)
+    kept[0] = 0
+    previous = 0
+    for i in range(target_points - 2):
+        start, end = edges[i], edges[i + 1]
+        next_end = edges[i + 2] if i + 2 < len(edges) else n
+        next_x = x[end:next_end].mean() if next_end > end else x[-1]
+        next_y = y[end:next_end].mean() if next_end > end else y[-1]
+        # Twice the triangle area for every candidate in the bucket at once
+        areas = np.abs((x[previous] - next_x) * (y[start:end] - y[previous])
+                       - (x[previous] - x[start:end]) * (next_y - y[previous]))
+        previous = start + int(np.argmax(areas))
+        kept[i + 1] = previous
+    kept[-1] = n - 1
+    return kept
+
+
+def douglas_peucker(x, y, tolerance):
+    """
+    Douglas-Peucker simplification of an ordered sequence of points.
+
+    Args:
+        x (ndarray): First coordinate of each point.
+        y (ndarray): Second coordinate of each point.
+        tolerance (float): Maximum allowed distance from the simplified line, in coordinate units.
+
+    Returns:
+        ndarray: Indices of the kept points, in order.
+    """
+    n = len(x)
+    if n < 3:
+        return np.arange(n)
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        dx, dy = x[end] - x[start], y[end] - y[start]
+        segment = np.hypot(dx, dy)
+        px, py = x[start + 1:end] - x[start], y[start + 1:end] - y[start]
+        if segment == 0:
+            distances = np.hypot(px, py)
+        else:
+            distances = np.abs(dx * py - dy * px) / segment
+        farthest = int(np.argmax(distances))
+        if distances[farthest] > tolerance:
+            split = start + 1 + farthest
+            keep[split] = True
+            stack.append((start, split))
+            stack.append((split, end))
+    return np.flatnonzero(keep)
+
+
+def bucket_fixes(fixes, freq):
+    """
+    Averages raw fixes into fixed-width time buckets.
+
+    Args:
+        fixes (DataFrame): Rows with timestamp, latitude and longitude.
+        freq (str): A fixed pandas frequency such as "h".
+
+    Returns:
+        DataFrame: One row per non-empty bucket with TRACK_COLUMNS.
+    """
+    if fixes.empty:
+        return pd.DataFrame(columns=TRACK_COLUMNS)
+    buckets = pd.DatetimeIndex(fixes["timestamp"]).floor(freq)
+    codes, uniques = pd.factorize(buckets, sort=True)
+    counts = np.bincount(codes)
+    return pd.DataFrame({
+        "bucket": uniques,
+        "fix_count": counts,
+        "latitude": np.bincount(codes, weights=fixes["latitude"].to_numpy()) / counts,
+        "longitude": np.bincount(codes, weights=fixes["longitude"].to_numpy()) / counts,
+    })
+
+
+def _fine_window(species_id, start, end):
+    """Resolves the time window for on-demand resolutions, defaulting to the latest week of fixes."""
+    if end is None:
+        latest = cached_read_sql("SELECT MAX(last_fix_at) AS latest FROM movement_track_daily WHERE species_id = %s",
+                                 (species_id,))
+        latest = latest["latest"].iloc[0]
+        end = pd.Timestamp(latest) + pd.Timedelta(seconds=1) if pd.notna(latest) else pd.Timestamp.now()
+    end = pd.Timestamp(end)
+    start = pd.Timestamp(start) if start is not None else end - DEFAULT_FINE_WINDOW
+    if end - start > MAX_FINE_WINDOW:
+        raise ValueError(f"Fine resolutions are limited to {MAX_FINE_WINDOW.days} days; use 'day' or 'week' for longer spans")
+    return start, end
+
+
+def load_fixes(species_id, start, end):
+    """Loads one species' raw fixes in [start, end) as floats, oldest first."""
+    query = """
+        SELECT timestamp, latitude, longitude
+        FROM movement
+        WHERE species_id = %s AND timestamp >= %s AND timestamp < %s
+          AND latitude IS NOT NULL AND longitude IS NOT NULL
+        ORDER BY timestamp
+    """
+    if any(month_start(start) <= month <= month_start(end) for month, _ in archive_files("movement")):
+        # Part of the window has been archived; read it from the Parquet files as well
+        fixes = read_range("movement", start, end, columns=["timestamp", "latitude", "longitude"],
+                           filters={"species_id": [species_id]})
+        fixes = fixes.dropna(subset=["latitude", "longitude"])
+    else:
+        fixes = cached_read_sql(query, (species_id, start.to_pydatetime(), end.to_pydatetime()), tables=["movement"])
+    return pd.DataFrame({
+        "timestamp": pd.to_datetime(fixes["timestamp"]),
+        "latitude": pd.to_numeric(fixes["latitude"]).astype(np.float64),
+        "longitude": pd.to_numeric(fixes["longitude"]).astype(np.float64),
+    })
+
+
+def weekly_track(days):
+    """
+    Sums daily rollup rows into ISO weeks (Monday to Sunday).
+
+    Args:
+        days (DataFrame): day, fix_count, latitude_sum and longitude_sum from movement_track_daily.
+
+    Returns:
+        DataFrame: bucket (the first day with fixes in the week), fix_count, latitude and longitude.
+    """
+    if days.empty:
+        return pd.DataFrame({"bucket": pd.Series(dtype=object), "fix_count": pd.Series(dtype=np.int64),
+                             "latitude": pd.Series(dtype=np.float64), "longitude": pd.Series(dtype=np.float64)})
+    day = pd.to_datetime(days["day"])
+    sums = pd.DataFrame({
+        "bucket": days["day"],
+        "fix_count": pd.to_numeric(days["fix_count"]).astype(np.int64),
+        "latitude_sum": pd.to_numeric(days["latitude_sum"]).astype(np.float64),
+        "longitude_sum": pd.to_numeric(days["longitude_sum"]).astype(np.float64),
+    })
+    week = (day - pd.to_timedelta(day.dt.weekday, unit="D")).to_numpy()
+    weeks = sums.groupby(week, sort=True).agg(bucket=("bucket", "min"), fix_count=("fix_count", "sum"),
+                                              latitude_sum=("latitude_sum", "sum"),
+                                              longitude_sum=("longitude_sum", "sum"))
+    return pd.DataFrame({
+        "bucket": weeks["bucket"].to_numpy(),
+        "fix_count": weeks["fix_count"].to_numpy(),
+        "latitude": (weeks["latitude_sum"] / weeks["fix_count"]).to_numpy(),
+        "longitude": (weeks["longitude_sum"] / weeks["fix_count"]).to_numpy(),
+    })
+
+
+def get_track(species_id, resolution="day", start=None, end=None, target_points=None, tolerance=None):
+    """
+    Returns a species' movement track at a resolution suitable for plotting.
+
+    "day" and "week" read the precomputed movement_track_daily rollup and can
+    cover any time span. "hour" and "raw" read raw fixes from a window of at
+    most MAX_FINE_WINDOW (the latest week by default). Any resolution can be
+    further reduced to `target_points` with LTTB, or simplified with
+    Douglas-Peucker when a `tolerance` in degrees is given.
+
+    Args:
+        species_id (int): Species to plot.
+        resolution (str): "hour", "day", "week" or "raw".
+        start: Start of the time window (inclusive).
+        end: End of the time window (exclusive).
+        target_points (int): Maximum number of points to return.
+        tolerance (float): Douglas-Peucker tolerance in degrees.
+
+    Returns:
+        DataFrame: bucket, fix_count, latitude and longitude, oldest first.
+    """
+    if resolution in COARSE_RESOLUTIONS:
+        conditions = ["species_id = %s"]
+        params = [species_id]
+        if start is not None:
+            conditions.append("day >= %s")
+            params.append(pd.Timestamp(start).date())
+        if end is not None:
+            conditions.append("day < %s")
+            params.append(pd.Timestamp(end).date())
+        where = " AND ".join(conditions)
+        if resolution == "day":
+            query = f"""
+                SELECT day AS bucket, fix_count,
+                       latitude_sum / fix_count AS latitude, longitude_sum / fix_count AS longitude
+                FROM movement_track_daily WHERE {where} ORDER BY day
+            """
+            track = cached_read_sql(query, tuple(params), tables=["movement_track_daily"])
+            track = track.astype({"fix_count": np.int64, "latitude": np.float64, "longitude": np.float64})
+        else:
+            # Weeks are summed here from the daily rows, as week functions differ between MySQL and SQLite
+            query = f"""
+                SELECT day, fix_count, latitude_sum, longitude_sum
+                FROM movement_track_daily WHERE {where} ORDER BY day
+            """
+            days = cached_read_sql(query, tuple(params), tables=["movement_track_daily"])
+            track = weekly_track(days)
+    elif resolution in FINE_RESOLUTIONS:
+        start, end = _fine_window(species_id, start, end)
+        fixes = load_fixes(species_id, start, end)
+        if resolution == "hour":
+            track = bucket_fixes(fixes, "h")
+        else:
+            track = fixes.rename(columns={"timestamp": "bucket"}).assign(fix_count=1)[TRACK_COLUMNS]
+    else:
+        raise ValueError(f"Unknown resolution: {resolution}")
+
+    if track.empty:
+        return track
+    x = track["longitude"].to_numpy()
+    y = track["latitude"].to_numpy()
+    if tolerance is not None:
+        track = track.iloc[douglas_peucker(x, y, tolerance)]
+        x, y = track["longitude"].to_numpy(), track["latitude"].to_numpy()
+    if target_points is not None:
+        track = track.iloc[lttb(x, y, target_points)]
+    return track.reset_index(drop=True)